@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the generator, encoder and insert path of generateAndInsert.py
+
+Micro benchmarks time the building blocks in-process (readings/sec per device type for both
+generation engines, holiday/event lookups, dict vs raw BSON encoding). Macro benchmarks run
+the full shard pipeline end to end at several intervals, either into the null sink or into a
+real mongod when --url is given. The storage benchmarks (mongod only) load the same data with
+different bucketing settings and compare load time, bucket count and storage size; the client
+benchmarks (mongod only) do the same for connection pool, compression and write settings, and the
+disorder benchmarks load it once per --disorder profile to show what late and out-of-order readings
+cost in throughput and buckets. Results are written as JSON so runs on different commits can be
+diffed with --compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import bson
+import numpy as np
+import pymongo
+
+import generateAndInsert as loader
+
+#################################################
+# BENCHMARK CONFIGURATION
+#################################################
+
+SEED = 42                       # Every benchmark uses fixed seeds so runs are comparable
+REPEATS = 5                     # Timed repetitions per benchmark (median is reported)
+MICRO_READINGS = 20000          # Readings per repetition for the scalar micro benchmarks
+MICRO_BLOCK = 100000            # Readings per repetition for the vectorized micro benchmarks
+MACRO_DOCS_PER_DEVICE = 200000  # Documents per device for each end-to-end run
+MACRO_INTERVALS = [1, 10, 60]   # Seconds between readings for the end-to-end runs
+STORAGE_INTERVALS = [1, 60]     # Seconds between readings for the storage benchmarks
+STORAGE_SETTINGS = {            # Loader options compared by the storage benchmarks
+    "auto": ["--granularity", "auto"],
+    "seconds": ["--granularity", "seconds"],
+    "minutes": ["--granularity", "minutes"],
+    "hours": ["--granularity", "hours"],
+    "auto_indexed": ["--granularity", "auto", "--create-indexes"],
+}
+CLIENT_INTERVAL = 10            # Seconds between readings for the client benchmarks
+CLIENT_SETTINGS = {             # Loader options compared by the client benchmarks, each against "baseline"
+    "baseline": [],
+    "zstd": ["--compressors", "zstd"],
+    "snappy": ["--compressors", "snappy"],
+    "zlib": ["--compressors", "zlib"],
+    "w_majority": ["--write-concern", "majority"],
+    "journaled": ["--write-concern", "1", "--journal"],
+    "load_test": ["--load-test"],
+    "ordered": ["--ordered"],
+    "bypass_validation": ["--bypass-validation"],
+    "pool_5": ["--max-pool-size", "5"],
+}
+DISORDER_INTERVAL = 10          # Seconds between readings for the disorder benchmarks (one run per loader.DISORDER_PROFILES)
+BENCHMARK_START = datetime.datetime(2024, 1, 1)
+BENCHMARK_COLLECTION = "benchmark_readings"
+
+#################################################
+# HELPERS
+#################################################
+
+def measure(function, items, repeats=REPEATS):
+    """Run function() `repeats` times; returns items/sec statistics for `items` processed per call"""
+    function()  # Warm-up (imports, caches, allocator)
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return {
+        "items": items,
+        "repeats": repeats,
+        "median_seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "per_second": items / statistics.median(seconds)
+    }
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """Machine and library versions recorded with every result file"""
+    return {
+        "commit": git_commit(),
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pymongo": pymongo.version,
+        "bson_c_extension": bson.has_c(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+def year_calendar():
+    """Calendar index covering a full year, so lookups hit holidays and events"""
+    return loader.CalendarIndex(BENCHMARK_START, BENCHMARK_START.replace(year=BENCHMARK_START.year + 1), loader.DEVICES)
+
+#################################################
+# MICRO BENCHMARKS
+#################################################
+
+def bench_scalar_readings(calendar):
+    """generate_reading readings/sec for each device type"""
+    results = {}
+    step = datetime.timedelta(minutes=7)
+    for device in loader.DEVICES:
+        timestamps = [BENCHMARK_START + step * i for i in range(MICRO_READINGS)]
+        draws = loader.reading_draws(device, loader.timestamp_block(BENCHMARK_START, step, MICRO_READINGS), step, SEED).tolist()
+
+        def run():
+            for timestamp, reading_draws in zip(timestamps, draws):
+                loader.generate_reading(device, timestamp, calendar, reading_draws)
+
+        results[device["id"]] = measure(run, MICRO_READINGS)
+    return results
+
+def bench_vectorized_readings(calendar):
+    """generate_block readings/sec for each device type"""
+    results = {}
+    step = datetime.timedelta(seconds=1)
+    for device in loader.DEVICES:
+        def run():
+            loader.generate_block(device, BENCHMARK_START, step, MICRO_BLOCK, SEED, calendar)
+
+        results[device["id"]] = measure(run, MICRO_BLOCK)
+    return results
+
+def bench_calendar_lookup(calendar):
+    """Holiday/event lookups per second: direct HOLIDAYS/SPECIAL_EVENTS scans vs the calendar index"""
+    device = loader.DEVICES[0]
+    step = datetime.timedelta(minutes=13)
+    timestamps = [BENCHMARK_START + step * i for i in range(MICRO_READINGS)]
+
+    def direct():
+        for timestamp in timestamps:
+            loader.is_holiday(timestamp)
+            loader.is_special_event(device, timestamp)
+
+    def indexed():
+        for timestamp in timestamps:
+            calendar.holiday(timestamp)
+            calendar.special_event(device, timestamp)
+
+    def build():
+        loader.CalendarIndex(BENCHMARK_START, BENCHMARK_START.replace(year=BENCHMARK_START.year + 1), loader.DEVICES)
+
+    return {
+        "direct_scan": measure(direct, MICRO_READINGS),
+        "calendar_index": measure(indexed, MICRO_READINGS),
+        "index_build_one_year": measure(build, 1, repeats=1)
+    }
+
+def bench_encoding(calendar):
+    """Documents/sec for dict building + bson.encode vs RawBatchEncoder"""
+    results = {}
+    step = datetime.timedelta(seconds=1)
+    for device in loader.DEVICES:
+        columns = loader.generate_block(device, BENCHMARK_START, step, MICRO_BLOCK // 10, SEED, calendar)
+        encoder = loader.RawBatchEncoder(device, calendar)
+
+        def as_dicts():
+            for document in loader.build_documents(device, columns):
+                bson.encode(document)
+
+        results[device["id"]] = {
+            "dict": measure(as_dicts, MICRO_BLOCK // 10),
+            "raw": measure(lambda: encoder.encode(columns), MICRO_BLOCK // 10)
+        }
+    return results
+
+#################################################
+# MACRO BENCHMARKS
+#################################################
+
+class DiscardQueue:
+    """Progress queue stand-in: the benchmarks read the shared counter instead"""
+
+    def put(self, item):
+        pass
+
+def macro_settings(url, database, interval_seconds, extra_args):
+    """Loader settings for one end-to-end run, built through the loader's own option parsing"""
+    end = BENCHMARK_START + datetime.timedelta(seconds=interval_seconds * MACRO_DOCS_PER_DEVICE - 1)
+    argv = ["--start", BENCHMARK_START.strftime("%Y-%m-%d"), "--end", end.strftime("%Y-%m-%d"),
+            "--interval", str(interval_seconds), "--seed", str(SEED), "--yes"]
+    if url:
+        argv += ["--url", url, "--database", database, "--collection", BENCHMARK_COLLECTION]
+    else:
+        argv += ["--sink", "null"]
+    settings = loader.load_settings(argv + list(extra_args))
+    # End-to-end runs measure the pipeline, not recovery bookkeeping
+    settings["checkpoint_dir"] = None
+    settings["resume"] = False
+    return settings, end
+
+def run_end_to_end(settings, end_date):
+    """Run every device shard on its own thread exactly like the loader's thread mode; returns docs/sec
+    
+    Against mongod the collection is recreated with the loader's bucketing choice, indexes
+    are built afterwards when create_indexes is set, and the collection's bucket and
+    storage statistics are included in the result.
+    """
+    step = datetime.timedelta(seconds=settings["interval_seconds"])
+    calendar = loader.CalendarIndex(settings["start_date"], end_date, loader.DEVICES)
+    client = loader.create_client(settings, len(loader.DEVICES) * max(1, settings["writer_threads"]))
+    settings = dict(settings)
+    if client is not None:
+        database = client[settings["database_name"]]
+        database.drop_collection(settings["collection_name"])
+        server_version = tuple(client.server_info()["versionArray"][:2])
+        loader.resolve_bucketing(settings, loader.DEVICES, len(loader.DEVICES), server_version)
+        database.create_collection(settings["collection_name"], timeseries=loader.timeseries_options(settings))
+    else:
+        loader.resolve_bucketing(settings, loader.DEVICES, len(loader.DEVICES))
+    collection = loader.sink_collection(client, settings)
+    counter = loader.SharedCounter()
+    shards = loader.plan_shards(loader.DEVICES, settings["start_date"], end_date, step, 1)
+    buckets_before = sum(loader.METRICS.counter_values("buckets_opened_total").values())
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=loader.run_shard, args=(shard, settings, collection, counter, DiscardQueue(), calendar))
+        for shard in shards
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    result = {
+        "documents": counter.value,
+        "seconds": seconds,
+        "per_second": counter.value / seconds,
+        "bucketing": loader.describe_bucketing(settings),
+        "model_buckets_opened": sum(loader.METRICS.counter_values("buckets_opened_total").values()) - buckets_before
+    }
+    if client is not None:
+        if settings["create_indexes"]:
+            result["index_seconds"] = loader.create_secondary_indexes(collection)
+        result["storage"] = loader.bucket_stats(database, settings["collection_name"])
+        client.close()
+    return result
+
+def bench_end_to_end(url, database, extra_args):
+    """End-to-end docs/sec for each interval in MACRO_INTERVALS"""
+    results = {}
+    for interval_seconds in MACRO_INTERVALS:
+        settings, end = macro_settings(url, database, interval_seconds, extra_args)
+        runs = [run_end_to_end(settings, end) for _ in range(max(1, REPEATS // 2))]
+        results[f"{interval_seconds}s"] = {
+            "sink": settings["sink"] if not url else "mongodb",
+            "engine": settings["engine"],
+            "encoding": settings["encoding"],
+            "documents": runs[0]["documents"],
+            "median_seconds": statistics.median(run["seconds"] for run in runs),
+            "per_second": statistics.median(run["per_second"] for run in runs)
+        }
+    return results
+
+def bench_storage(url, database, extra_args):
+    """Load time, bucket count and storage size for each of STORAGE_SETTINGS at each interval"""
+    results = {}
+    for interval_seconds in STORAGE_INTERVALS:
+        for name, options in STORAGE_SETTINGS.items():
+            settings, end = macro_settings(url, database, interval_seconds, list(extra_args) + options)
+            run = run_end_to_end(settings, end)
+            storage = run["storage"] or {}
+            results[f"{interval_seconds}s.{name}"] = {
+                "bucketing": run["bucketing"],
+                "documents": run["documents"],
+                "load_seconds": run["seconds"],
+                "index_seconds": run.get("index_seconds"),
+                "per_second": run["per_second"],
+                "bucket_count": storage.get("bucket_count"),
+                "storage_bytes_per_doc": storage.get("storage_size", 0) / run["documents"] if run["documents"] else None,
+                "index_bytes_per_doc": storage.get("index_size", 0) / run["documents"] if run["documents"] else None
+            }
+    return results
+
+def print_storage(results):
+    """Storage benchmark table: one row per (interval, setting)"""
+    print(f"\n  {'run':<22} {'bucketing':<52} {'docs/sec':>12} {'buckets':>10} {'disk B/doc':>11} {'index B/doc':>12}")
+    for name, row in results.items():
+        print(f"  {name:<22} {row['bucketing']:<52} {row['per_second']:>12,.0f} {row['bucket_count'] or 0:>10,} "
+              f"{row['storage_bytes_per_doc'] or 0:>11.1f} {row['index_bytes_per_doc'] or 0:>12.1f}")
+
+def bench_client(url, database, extra_args):
+    """End-to-end docs/sec for each of CLIENT_SETTINGS; compressors that are not installed are skipped"""
+    results = {}
+    # Untimed warm-up so the first setting does not pay for connection setup and caches
+    run_end_to_end(*macro_settings(url, database, CLIENT_INTERVAL, extra_args))
+    for name, options in CLIENT_SETTINGS.items():
+        settings, end = macro_settings(url, database, CLIENT_INTERVAL, list(extra_args) + options)
+        if "--compressors" in options and not settings["compressors"]:
+            continue
+        runs = [run_end_to_end(settings, end) for _ in range(max(1, REPEATS // 2))]
+        results[name] = {
+            "client": loader.describe_client(settings, len(loader.DEVICES) * max(1, settings["writer_threads"])),
+            "documents": runs[0]["documents"],
+            "median_seconds": statistics.median(run["seconds"] for run in runs),
+            "per_second": statistics.median(run["per_second"] for run in runs)
+        }
+    return results
+
+def print_client(results):
+    """Client benchmark table: docs/sec for each setting and its change against the baseline"""
+    baseline = results["baseline"]["per_second"]
+    print(f"\n  {'setting':<18} {'docs/sec':>12} {'vs baseline':>12}  client")
+    for name, row in results.items():
+        change = (row["per_second"] - baseline) / baseline * 100 if baseline else 0.0
+        print(f"  {name:<18} {row['per_second']:>12,.0f} {change:>+11.1f}%  {row['client']}")
+
+def bench_disorder(url, database, extra_args):
+    """Docs/sec and buckets opened per 1000 docs for each disorder profile (client-side model, and the server's with --url)"""
+    results = {}
+    for name in loader.DISORDER_PROFILES:
+        settings, end = macro_settings(url, database, DISORDER_INTERVAL, list(extra_args) + ["--disorder", name])
+        run = run_end_to_end(settings, end)
+        storage = run.get("storage") or {}
+        results[name] = {
+            "disorder": loader.describe_disorder(settings["disorder_profile"], settings["reorder_buffer"]) if settings["disorder_profile"] else "in order",
+            "documents": run["documents"],
+            "load_seconds": run["seconds"],
+            "per_second": run["per_second"],
+            "model_buckets_per_1000": run["model_buckets_opened"] / run["documents"] * 1000 if run["documents"] else None,
+            "server_buckets_per_1000": storage["buckets_opened"] / storage["measurements"] * 1000 if storage.get("measurements") else None,
+            "bucket_count": storage.get("bucket_count")
+        }
+    return results
+
+def print_disorder(results):
+    """Disorder benchmark table: one row per profile, with its docs/sec change against in-order delivery"""
+    baseline = results["none"]["per_second"]
+    print(f"\n  {'profile':<10} {'docs/sec':>12} {'vs none':>9} {'model bkt/1k':>13} {'server bkt/1k':>14}  disorder")
+    for name, row in results.items():
+        change = (row["per_second"] - baseline) / baseline * 100 if baseline else 0.0
+        server = f"{row['server_buckets_per_1000']:>14.2f}" if row["server_buckets_per_1000"] is not None else f"{'-':>14}"
+        print(f"  {name:<10} {row['per_second']:>12,.0f} {change:>+8.1f}% {row['model_buckets_per_1000']:>13.2f} {server}  {row['disorder']}")
+
+#################################################
+# REPORTING
+#################################################
+
+def flatten(results, prefix=""):
+    """{"a.b.per_second": value} for every throughput figure in a result tree"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "per_second" in value:
+                flat[f"{prefix}{key}"] = value["per_second"]
+            else:
+                flat.update(flatten(value, f"{prefix}{key}."))
+    return flat
+
+def print_results(results):
+    """Print every throughput figure, one per line"""
+    for name, per_second in flatten(results["benchmarks"]).items():
+        print(f"  {name:<55} {per_second:>14,.1f} /sec")
+
+def compare(baseline_path, results):
+    """Print the change in every throughput figure against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = flatten(baseline["benchmarks"])
+    new = flatten(results["benchmarks"])
+    print(f"\nComparison against {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    for name in sorted(set(old) & set(new)):
+        change = (new[name] - old[name]) / old[name] * 100 if old[name] else 0.0
+        flag = "  <-- regression" if change < -5 else ""
+        print(f"  {name:<55} {old[name]:>14,.1f} -> {new[name]:>14,.1f} ({change:+.1f}%){flag}")
+
+def main(argv=None):
+    """Run the selected benchmark groups and write the results as JSON"""
+    global REPEATS
+
+    parser = argparse.ArgumentParser(description="Benchmark the data generator, encoder and insert path.")
+    parser.add_argument("--suite", choices=["all", "micro", "macro", "storage", "client", "disorder"], default="all", help="Which benchmark group to run (storage and client need --url)")
+    parser.add_argument("--url", help="MongoDB URL for macro benchmarks (default: in-process null sink)")
+    parser.add_argument("--database", default="benchmark", help="Database for macro benchmarks against mongod")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed repetitions per benchmark")
+    parser.add_argument("--output", help="Result file (default benchmark-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result file to diff against")
+    args, loader_args = parser.parse_known_args(argv)
+    REPEATS = args.repeats
+
+    results = {"environment": environment(), "loader_args": loader_args, "benchmarks": {}}
+    benchmarks = results["benchmarks"]
+
+    if args.suite in ("all", "micro"):
+        print("Running micro benchmarks...")
+        calendar = year_calendar()
+        benchmarks["readings_scalar"] = bench_scalar_readings(calendar)
+        benchmarks["readings_vectorized"] = bench_vectorized_readings(calendar)
+        benchmarks["calendar_lookup"] = bench_calendar_lookup(calendar)
+        benchmarks["encoding"] = bench_encoding(calendar)
+
+    if args.suite in ("all", "macro"):
+        print(f"Running macro benchmarks ({'mongod at ' + args.url if args.url else 'null sink'})...")
+        benchmarks["end_to_end"] = bench_end_to_end(args.url, args.database, loader_args)
+
+    if args.suite == "storage" or (args.suite == "all" and args.url):
+        if not args.url:
+            parser.error("the storage benchmarks need --url")
+        print(f"Running storage benchmarks against mongod at {args.url}...")
+        benchmarks["storage"] = bench_storage(args.url, args.database, loader_args)
+        print_storage(benchmarks["storage"])
+
+    if args.suite == "client" or (args.suite == "all" and args.url):
+        if not args.url:
+            parser.error("the client benchmarks need --url")
+        print(f"Running client benchmarks against mongod at {args.url}...")
+        benchmarks["client"] = bench_client(args.url, args.database, loader_args)
+        print_client(benchmarks["client"])
+
+    if args.suite == "disorder":
+        print(f"Running disorder benchmarks ({'mongod at ' + args.url if args.url else 'null sink'})...")
+        benchmarks["disorder"] = bench_disorder(args.url, args.database, loader_args)
+        print_disorder(benchmarks["disorder"])
+
+    print("\nResults:")
+    print_results(results)
+
+    output = args.output or f"benchmark-{results['environment']['commit'] or 'local'}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,11 +1,36 @@
 #!/usr/bin/env python3
 import random
+import abc
+import argparse
+import bisect
+import calendar as calendar_module
 import datetime
 import time
 import threading
+import multiprocessing
+import concurrent.futures
+import cProfile
+import pstats
+import itertools
+import heapq
+import http.server
+import importlib.util
+import json
+import math
+import os
+import mmap
+import queue
+import shutil
+import signal
 import sys
-from pymongo import MongoClient
-from bson import ObjectId
+import tomllib
+import tracemalloc
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+import bson
+from bson import ObjectId, json_util
+from bson.raw_bson import RawBSONDocument
 
 #################################################
 # BATCH SIZE CONFIGURATION
@@ -13,6 +38,18 @@ from bson import ObjectId
 
 # Data Insertion Settings
 BATCH_SIZE = 1000          # Number of documents per batch insert
+ADAPTIVE_BATCH_SIZE = True # Tune the batch size from measured insert throughput (BATCH_SIZE is the starting point)
+MIN_BATCH_SIZE = 100       # Lower bound for adaptive batch sizing
+MAX_BATCH_SIZE = 100000    # Upper bound for adaptive batch sizing
+WRITER_THREADS = 4         # insert_many calls in flight per worker (0 = insert inline, no pipelining)
+WRITE_QUEUE_DEPTH = 8      # Generated batches buffered ahead of the writers before generation blocks
+
+# Generation Engine Settings
+GENERATION_ENGINE = "vectorized"  # "vectorized" (NumPy column blocks) or "scalar" (one generate_reading call per document)
+RANDOM_SEED = None                # Run seed; the same seed gives identical data (None = a fresh seed every run, printed)
+SCALAR_CHUNK = 4096                # Timestamps and random draws the scalar engine prepares at a time
+RANDOM_DRAWS = 6                  # Uniform draws per reading: power level, on/off chance, temperature, runtime, efficiency, maintenance
+ENCODING = "raw"                  # Vectorized engine output: "raw" (pre-encoded BSON) or "dict" (pymongo encodes dicts)
 
 # Define devices for our smart home
 DEVICES = [
@@ -26,17 +63,17 @@ DEVICES = [
 # Define US holidays with dramatic power consumption changes
 HOLIDAYS = [
     {"month": 1, "day": 1, "name": "New Year's Day"},
-    {"month": 1, "day": 16, "name": "Martin Luther King Jr. Day", "day_of_week": 0},
+    {"month": 1, "day": 16, "name": "Martin Luther King Jr. Day", "day_of_week": 0, "week": 3},  # 3rd Monday
     {"month": 2, "day": 14, "name": "Valentine's Day"},
     {"month": 3, "day": 17, "name": "St. Patrick's Day"},
     {"month": 4, "day": 15, "name": "Tax Day"},
     {"month": 5, "day": 5, "name": "Cinco de Mayo"},
-    {"month": 5, "day": 29, "name": "Memorial Day", "day_of_week": 0},
+    {"month": 5, "day": 29, "name": "Memorial Day", "day_of_week": 0, "week": -1},  # Last Monday
     {"month": 6, "day": 19, "name": "Juneteenth"},
     {"month": 7, "day": 4, "name": "Independence Day"},
-    {"month": 9, "day": 4, "name": "Labor Day", "day_of_week": 0},
+    {"month": 9, "day": 4, "name": "Labor Day", "day_of_week": 0, "week": 1},  # 1st Monday
     {"month": 10, "day": 31, "name": "Halloween"},
-    {"month": 11, "day": 23, "name": "Thanksgiving", "day_of_week": 3},
+    {"month": 11, "day": 23, "name": "Thanksgiving", "day_of_week": 3, "week": 4},  # 4th Thursday
     {"month": 12, "day": 24, "name": "Christmas Eve"},
     {"month": 12, "day": 25, "name": "Christmas Day"},
     {"month": 12, "day": 31, "name": "New Year's Eve"}
@@ -91,6 +128,161 @@ SEASONAL_MULTIPLIERS = {
     12: {"HVAC": 1.8, "LIGHTING": 2.0, "EV_CHARGER": 0.8, "WASHER": 1.4, "FRIDGE": 1.1}  # December
 }
 
+# Power profiles: device x hour band x day type -> distribution of the reading's base power.
+# Rules apply in order and a later rule overwrites the fields it names for the cells it matches.
+# "device" is an id, a list of ids or "*"; "hours" is an inclusive [first, last] band that may
+# wrap past midnight; "days" is "weekday" or "weekend". A reading draws uniform(low, high) when
+# its chance draw is below "chance" and uses "otherwise" when not; "scale" multiplies either.
+POWER_PROFILES = [
+    {"device": "*", "low": 0.1, "high": 0.5, "chance": 1.0, "otherwise": 0.0, "scale": 1.0},
+    
+    # HVAC: higher during afternoon, lower at night
+    {"device": "HVAC", "low": 1.0, "high": 2.0},                    # Normal
+    {"device": "HVAC", "hours": [13, 18], "low": 2.5, "high": 3.5},  # Peak afternoon
+    {"device": "HVAC", "hours": [23, 5], "low": 0.1, "high": 0.5},   # Low overnight
+    
+    # Fridge: consistent
+    {"device": "FRIDGE", "low": 0.1, "high": 0.2},
+    
+    # Lighting: higher when dark
+    {"device": "LIGHTING", "low": 0.0, "high": 0.1},
+    {"device": "LIGHTING", "hours": [6, 8], "low": 0.2, "high": 0.5},
+    {"device": "LIGHTING", "hours": [18, 23], "low": 0.2, "high": 0.5},
+    
+    # EV charger: primarily evening/overnight, charging half the time
+    {"device": "EV_CHARGER", "chance": 0.0, "otherwise": 0.0},
+    {"device": "EV_CHARGER", "hours": [19, 5], "low": 6.0, "high": 7.5, "chance": 0.5},
+    
+    # Washing machine: used mostly mornings and evenings (30% chance), standby power otherwise
+    {"device": "WASHER", "chance": 0.0, "otherwise": 0.01},
+    {"device": "WASHER", "hours": [7, 10], "low": 0.5, "high": 1.2, "chance": 0.3},
+    {"device": "WASHER", "hours": [18, 21], "low": 0.5, "high": 1.2, "chance": 0.3},
+    
+    # Increased weekend usage
+    {"device": ["LIGHTING", "HVAC", "WASHER"], "days": "weekend", "scale": 1.5},
+]
+
+# Holiday rules: holiday x device x hour band -> power multiplier (1.0 where no rule matches).
+# "holiday" is a HOLIDAYS name or a list of them; "device" and "hours" work as in POWER_PROFILES.
+HOLIDAY_RULES = [
+    # Christmas: more cooking, lights, people at home
+    {"holiday": ["Christmas Day", "Christmas Eve"], "device": "HVAC", "multiplier": 2.0},       # Much more heating with people at home
+    {"holiday": ["Christmas Day", "Christmas Eve"], "device": "LIGHTING", "multiplier": 5.0},   # Dramatic Christmas lights!
+    {"holiday": ["Christmas Day", "Christmas Eve"], "device": "WASHER", "multiplier": 3.0},     # Many more dishes and laundry with guests
+    {"holiday": ["Christmas Day", "Christmas Eve"], "device": "EV_CHARGER", "multiplier": 0.3}, # Much less commuting
+    
+    # Thanksgiving: heavy cooking day
+    {"holiday": "Thanksgiving", "device": "HVAC", "multiplier": 2.0},
+    {"holiday": "Thanksgiving", "device": "LIGHTING", "multiplier": 2.5},
+    {"holiday": "Thanksgiving", "device": "WASHER", "multiplier": 4.0},
+    
+    # New Year's: party time
+    {"holiday": ["New Year's Eve", "New Year's Day"], "device": "LIGHTING", "multiplier": 3.0},
+    {"holiday": ["New Year's Eve", "New Year's Day"], "device": "HVAC", "multiplier": 2.0},
+    {"holiday": ["New Year's Eve", "New Year's Day"], "device": "EV_CHARGER", "multiplier": 0.4},
+    
+    # Summer holidays: AC on hot afternoons, less indoor lighting
+    {"holiday": ["Independence Day", "Memorial Day", "Labor Day"], "device": "HVAC", "hours": [13, 18], "multiplier": 2.5},
+    {"holiday": ["Independence Day", "Memorial Day", "Labor Day"], "device": "LIGHTING", "multiplier": 0.3},
+    
+    # Halloween: decorations and porch lights in the evening
+    {"holiday": "Halloween", "device": "LIGHTING", "hours": [17, 22], "multiplier": 5.0},
+    
+    # Valentine's Day: evening at home
+    {"holiday": "Valentine's Day", "device": "LIGHTING", "hours": [18, 23], "multiplier": 2.0},
+    {"holiday": "Valentine's Day", "device": "HVAC", "hours": [18, 23], "multiplier": 1.5},
+    
+    # St. Patrick's Day: party lighting
+    {"holiday": "St. Patrick's Day", "device": "LIGHTING", "hours": [17, 23], "multiplier": 2.0},
+]
+
+# Fleet Settings (fleet mode generates N homes, each with its own copy of the DEVICES templates)
+FLEET_HOMES = 0                     # Homes to generate (0 = the single home described by DEVICES)
+FLEET_REGIONS = ["northeast", "southeast", "midwest", "southwest", "west"]
+REGION_SEASONAL_SCALE = {           # How strongly each region follows SEASONAL_MULTIPLIERS
+    "northeast": 1.2, "southeast": 1.0, "midwest": 1.3, "southwest": 0.8, "west": 0.7
+}
+HOME_LOAD_SIGMA = 0.25              # Spread of the per-home load factor (lognormal sigma)
+MAX_EVENT_SHIFT_DAYS = 3            # Per-home special events move up to this many days either way
+EVENT_PARTICIPATION = 0.6           # Chance that a home takes part in each special event
+HOMES_PER_SHARD = None              # Homes per fleet shard (None = 4 shards per process, 1 per thread)
+
+# Execution Settings
+EXECUTION_MODE = "threads"          # "threads" (one thread per device) or "processes" (process pool over shards)
+WORKER_PROCESSES = os.cpu_count()   # Pool size for "processes" mode
+TIME_SLICES_PER_DEVICE = None       # Time slices per device in "processes" mode (None = 4 shards per process)
+
+# Client Settings (one MongoClient per process, shared by all of its worker and writer threads)
+MAX_POOL_SIZE = None                # maxPoolSize (None = one connection per concurrent insert_many, at least the default)
+DEFAULT_POOL_SIZE = 100             # pymongo's own maxPoolSize default
+COMPRESSORS = None                  # Wire compression in order of preference, e.g. ["zstd", "snappy"] (None = uncompressed)
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}  # Module pymongo needs for each
+BYPASS_DOCUMENT_VALIDATION = False  # insert_many bypass_document_validation (not allowed with w=0)
+
+# Server limits a single insert_many batch should stay under
+MAX_WRITE_BATCH_SIZE = 100000       # maxWriteBatchSize (operations per write command)
+MAX_MESSAGE_SIZE_BYTES = 48000000   # maxMessageSizeBytes (48MB wire message)
+
+# Time series bucketing (mirrors the server's bucket catalog limits)
+TIMESERIES_GRANULARITY = "auto"     # Granularity of the created collection ("auto" = chosen from interval and device count)
+INSERT_ORDER = "bucket"             # "bucket" (cut batches on server bucket boundaries) or "generated" (cut at the batch size)
+ORDERED_INSERTS = False             # insert_many ordered flag (unordered keeps going past a failed document)
+BUCKET_MAX_COUNT = 1000             # Measurements per bucket (timeseriesBucketMaxCount)
+BUCKET_MAX_BYTES = 125 * 1024       # Measurement data per bucket (timeseriesBucketMaxSize)
+GRANULARITY_BUCKETING = {           # granularity -> (bucketMaxSpanSeconds, bucketRoundingSeconds), finest first
+    "seconds": (3600, 60),
+    "minutes": (86400, 3600),
+    "hours": (2592000, 86400)
+}
+MAX_BUCKET_SPAN_SECONDS = 31536000  # Largest custom bucketMaxSpanSeconds the server accepts
+CUSTOM_BUCKETING_VERSION = (6, 3)   # First server version with bucketMaxSpanSeconds/bucketRoundingSeconds
+TIMESERIES_DELETE_VERSION = (7, 0)  # First server version that deletes from time series collections by timestamp
+BUCKET_CATALOG_BUDGET_BYTES = 256 * 1024 * 1024  # Open-bucket data "auto" plans to leave in the server's bucket catalog
+MIN_BUCKET_FILL = 0.25              # "auto" never plans buckets below this fraction of their capacity
+
+# Failure Handling Settings
+MAX_RETRIES = 5                     # Retries per failed insert_many before the batch is given up
+RETRY_BACKOFF_SECONDS = 0.5         # First retry delay; doubles on every further attempt
+CHECKPOINT_INTERVAL_SECONDS = 2.0   # Minimum time between checkpoint file writes per shard
+DUPLICATE_KEY_ERROR = 11000
+
+# File Sink Settings (--sink bson/jsonl/parquet write files instead of inserting)
+OUTPUT_DIR = "dump"                 # Files go to <output dir>/<database>/<collection>.<ext>, the mongodump layout
+FILE_BUFFER_BYTES = 8 * 1024 * 1024 # Write/read buffer per open file
+PARQUET_ROW_GROUP = 131072          # Rows buffered per Parquet row group
+FILE_SINKS = {"bson": ".bson", "jsonl": ".json", "parquet": ".parquet"}  # sink -> file extension
+
+# Rollup Settings (--rollups maintains per-device totals in <collection>_hourly and <collection>_daily)
+ROLLUP_PERIODS = {"hourly": ("hour", 3600), "daily": ("day", 86400)}  # Collection suffix -> ($dateTrunc unit, seconds)
+ROLLUP_FLUSH = 1000                 # Completed rollups per unordered bulk_write of upserts
+ROLLUP_TIMING_REPEATS = 3           # --verify-rollups times each query this often and keeps the fastest
+
+# Disorder Settings (--disorder sends some readings late or in bursts, the way real devices do)
+DISORDER_PROFILE = "none"           # Delivery profile (see DISORDER_PROFILES)
+DISORDER_PROFILES = {               # name -> share of readings sent late, most seconds late, outages per series per day, outage length
+    "none": {"late_fraction": 0.0, "max_lateness": 0, "outages_per_day": 0.0, "outage_minutes": 0},
+    "jitter": {"late_fraction": 0.05, "max_lateness": 120, "outages_per_day": 0.0, "outage_minutes": 0},
+    "late": {"late_fraction": 0.2, "max_lateness": 3600, "outages_per_day": 0.0, "outage_minutes": 0},
+    "outage": {"late_fraction": 0.0, "max_lateness": 0, "outages_per_day": 1.0, "outage_minutes": 120},
+    "mixed": {"late_fraction": 0.05, "max_lateness": 900, "outages_per_day": 0.5, "outage_minutes": 60},
+}
+REORDER_BUFFER = 10000              # Readings a series holds back at most; past that its next due go out early
+
+# Live Feed Settings (--live streams readings with current timestamps as they come due)
+LIVE_TICK_SECONDS = 1.0             # Scheduler cadence: every tick generates and inserts all readings that came due
+LIVE_MAX_COALESCE = 8               # When behind schedule, batches grow to at most this many times the batch size
+LIVE_MAX_DAYS = 366                 # Length of a live run without --duration (it normally ends with Ctrl-C)
+LIVE_RATE_TOLERANCE = 0.01          # Warn when devices / interval misses --rate by more than this fraction
+
+# Metrics Settings
+METRICS_PREFIX = "loader_"          # Prefix for exported metric names
+METRICS_PUSH_SECONDS = 2.0          # How often worker processes send their metrics to the parent
+
+# Profiling Settings (--profile writes a report of startup phases, memory growth and, with --cprofile, CPU time)
+PROFILE_MAX_SAMPLES = 5000          # Per-batch memory samples a process keeps (past that every other one is dropped)
+PROFILE_TOP_ALLOCATIONS = 10        # Allocation sites listed from the final tracemalloc snapshot
+PROFILE_TOP_FUNCTIONS = 25          # Functions listed from the merged cProfile stats, by cumulative time
+
 # Progress Reporting Frequency (in documents)
 PROGRESS_REPORT_FREQUENCY = 300000  # Report progress every 300k documents
 
@@ -98,98 +290,506 @@ PROGRESS_REPORT_FREQUENCY = 300000  # Report progress every 300k documents
 # SHARED VARIABLES AND INTERACTIVE PROMPTS
 #################################################
 
+class SharedCounter:
+    """Inserted-document counter shared by worker threads and worker processes"""
+    
+    def __init__(self):
+        self._value = MP_CONTEXT.Value("q", 0)
+    
+    def add(self, count):
+        """Add to the counter and return the new total"""
+        with self._value.get_lock():
+            self._value.value += count
+            return self._value.value
+    
+    @property
+    def value(self):
+        return self._value.value
+
 # Shared variables
-lock = threading.Lock()
-total_inserted = 0
 process_start = time.time()
 
-def get_user_inputs():
-    """Prompt user for all required inputs"""
+# Spawn rather than fork for worker processes: the parent already holds an open MongoClient
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Set on Ctrl-C to end a live feed: every live shard stops after its current tick
+live_stop = MP_CONTEXT.Event()
+
+def get_user_inputs(settings):
+    """Prompt user for any required inputs not given on the command line or in a config file"""
     print("Welcome to the Thermostat Data Generator")
     print("----------------------------------------")
     print("Please provide the following information:")
     
-    # MongoDB connection details
-    mongodb_url = input("\nMongoDB connection URL: ")
-    database_name = input("Database name: ")
-    collection_name = input("Collection name: ")
+    # MongoDB connection details (file sinks only need the names for their layout)
+    if settings["sink"] != "null":
+        if not settings["mongodb_url"] and settings["sink"] == "mongodb":
+            settings["mongodb_url"] = input("\nMongoDB connection URL: ")
+        if not settings["database_name"]:
+            settings["database_name"] = input("Database name: ")
+        if not settings["collection_name"]:
+            settings["collection_name"] = input("Collection name: ")
+    if settings["replay"] or settings["verify_rollups"]:
+        return settings
     
-    # Date range
-    while True:
+    # Date range (a live feed starts now)
+    while settings["start_date"] is None and not settings["live"]:
         start_date_str = input("\nStart date (YYYY-MM-DD): ")
         try:
-            start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d")
-            break
+            settings["start_date"] = parse_date(start_date_str)
         except ValueError:
             print("Invalid date format. Please use YYYY-MM-DD.")
     
-    while True:
+    while settings["end_date"] is None and not settings["live"]:
         end_date_str = input("End date (YYYY-MM-DD): ")
         try:
-            end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d")
-            if end_date < start_date:
+            end_date = parse_date(end_date_str)
+            if end_date < settings["start_date"]:
                 print("End date must be after start date.")
                 continue
-            break
+            settings["end_date"] = end_date
         except ValueError:
             print("Invalid date format. Please use YYYY-MM-DD.")
     
-    # Interval
-    while True:
+    # Interval (a live feed can derive it from --rate)
+    while settings["interval_seconds"] is None and not settings["rate"]:
         try:
             interval_seconds = int(input("\nInterval between data points (in seconds): "))
             if interval_seconds <= 0:
                 print("Interval must be a positive number.")
                 continue
-            break
+            settings["interval_seconds"] = interval_seconds
         except ValueError:
             print("Please enter a valid number.")
     
-    # Convert seconds to minutes for internal calculations
-    interval_minutes = interval_seconds / 60
+    return settings
+
+#################################################
+# COMMAND LINE AND CONFIG FILE
+#################################################
+
+# Defaults for every run setting; a config file overrides these and command-line options override both
+DEFAULT_SETTINGS = {
+    "mongodb_url": None,
+    "database_name": None,
+    "collection_name": None,
+    "start_date": None,
+    "end_date": None,
+    "interval_seconds": None,
+    "sink": "mongodb",
+    "output_dir": OUTPUT_DIR,
+    "replay": None,
+    "rollups": False,
+    "verify_rollups": False,
+    "execution_mode": EXECUTION_MODE,
+    "workers": WORKER_PROCESSES,
+    "time_slices": TIME_SLICES_PER_DEVICE,
+    "engine": GENERATION_ENGINE,
+    "encoding": ENCODING,
+    "seed": RANDOM_SEED,
+    "homes": FLEET_HOMES,
+    "device_templates": None,
+    "homes_per_shard": HOMES_PER_SHARD,
+    "batch_size": BATCH_SIZE,
+    "adaptive_batch_size": ADAPTIVE_BATCH_SIZE,
+    "min_batch_size": MIN_BATCH_SIZE,
+    "max_batch_size": MAX_BATCH_SIZE,
+    "writer_threads": WRITER_THREADS,
+    "queue_depth": WRITE_QUEUE_DEPTH,
+    "write_concern": None,
+    "journal": None,
+    "max_pool_size": MAX_POOL_SIZE,
+    "compressors": COMPRESSORS,
+    "bypass_validation": BYPASS_DOCUMENT_VALIDATION,
+    "load_test": False,
+    "live": False,
+    "rate": None,
+    "duration": None,
+    "tick": LIVE_TICK_SECONDS,
+    "disorder": DISORDER_PROFILE,
+    "late_fraction": None,
+    "max_lateness": None,
+    "outages_per_day": None,
+    "outage_minutes": None,
+    "reorder_buffer": REORDER_BUFFER,
+    "power_profiles": [],
+    "holiday_rules": [],
+    "granularity": TIMESERIES_GRANULARITY,
+    "bucket_span_seconds": None,
+    "create_indexes": False,
+    "insert_order": INSERT_ORDER,
+    "ordered_inserts": ORDERED_INSERTS,
+    "checkpoint_dir": None,
+    "resume": False,
+    "metrics_port": None,
+    "metrics_file": None,
+    "metrics_interval": 10.0,
+    "profile": None,
+    "cprofile": False,
+    "tracemalloc": False,
+    "max_retries": MAX_RETRIES,
+    "retry_backoff": RETRY_BACKOFF_SECONDS,
+    "yes": False
+}
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string (or a date from a TOML/YAML file) into a datetime"""
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+def parse_templates(value):
+    """Device template ids from a comma-separated string (or a list in a config file)"""
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(",") if item.strip()]
+    return [item.upper() for item in value]
+
+def parse_write_concern(value):
+    """Write concern "w" value: an integer node count or a tag such as "majority" """
+    return int(value) if str(value).isdigit() else value
+
+def parse_compressors(value):
+    """Compressor names from a comma-separated string (or a list in a config file)"""
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(",") if item.strip()]
+    compressors = [item.lower() for item in value]
+    unknown = set(compressors) - set(COMPRESSOR_MODULES)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown compressor(s) {', '.join(sorted(unknown))}; choose from {', '.join(COMPRESSOR_MODULES)}")
+    return compressors
+
+def build_arg_parser():
+    """Command-line options; every option can also be set in the config file by its long name"""
+    parser = argparse.ArgumentParser(description="Generate smart-home power readings and load them into MongoDB.")
+    parser.add_argument("--config", help="TOML or YAML file with settings (keys use the long option names, e.g. batch_size)")
     
-    return {
-        "mongodb_url": mongodb_url,
-        "database_name": database_name,
-        "collection_name": collection_name,
-        "start_date": start_date,
-        "end_date": end_date,
-        "interval_seconds": interval_seconds,
-        "interval_minutes": interval_minutes
-    }
+    connection = parser.add_argument_group("connection")
+    connection.add_argument("--url", dest="mongodb_url", help="MongoDB connection URL")
+    connection.add_argument("--database", dest="database_name", help="Database name")
+    connection.add_argument("--collection", dest="collection_name", help="Collection name")
+    connection.add_argument("--write-concern", dest="write_concern", type=parse_write_concern, help='Write concern "w" (e.g. 0, 1, majority)')
+    connection.add_argument("--journal", dest="journal", action=argparse.BooleanOptionalAction, help="Request journaled writes (j)")
+    connection.add_argument("--max-pool-size", dest="max_pool_size", type=int, help="maxPoolSize of the shared client (default: one connection per concurrent insert)")
+    connection.add_argument("--compressors", type=parse_compressors, help="Wire compression in order of preference, e.g. zstd,snappy")
+    connection.add_argument("--bypass-validation", dest="bypass_validation", action=argparse.BooleanOptionalAction, help="insert_many with bypass_document_validation")
+    connection.add_argument("--load-test", dest="load_test", action="store_true", default=None, help="Unacknowledged (w=0), unjournaled writes and no checkpoints: raw insert throughput")
+    
+    data = parser.add_argument_group("data")
+    data.add_argument("--start", dest="start_date", type=parse_date, help="Start date (YYYY-MM-DD)")
+    data.add_argument("--end", dest="end_date", type=parse_date, help="End date (YYYY-MM-DD), inclusive")
+    data.add_argument("--interval", dest="interval_seconds", type=int, help="Interval between data points in seconds")
+    data.add_argument("--seed", type=int, help="Random seed; the same seed and settings give identical data for any worker count or batch size")
+    data.add_argument("--homes", type=int, help="Fleet mode: generate this many homes instead of a single one")
+    data.add_argument("--device-templates", dest="device_templates", type=parse_templates, help="Comma-separated device ids to generate (per home in fleet mode; default all)")
+    
+    execution = parser.add_argument_group("execution")
+    execution.add_argument("--mode", dest="execution_mode", choices=["threads", "processes"], help="Thread per device or process pool over shards")
+    execution.add_argument("--workers", type=int, help="Worker processes in processes mode")
+    execution.add_argument("--time-slices", dest="time_slices", type=int, help="Time slices per device in processes mode")
+    execution.add_argument("--homes-per-shard", dest="homes_per_shard", type=int, help="Homes per shard in fleet mode")
+    execution.add_argument("--engine", choices=["vectorized", "scalar"], help="Generation engine")
+    execution.add_argument("--encoding", choices=["raw", "dict"], help="Document encoding for the vectorized engine")
+    execution.add_argument("--batch-size", dest="batch_size", type=int, help="Documents per insert_many (starting size when adaptive)")
+    execution.add_argument("--adaptive-batch-size", dest="adaptive_batch_size", action=argparse.BooleanOptionalAction, help="Tune batch size from measured insert throughput")
+    execution.add_argument("--min-batch-size", dest="min_batch_size", type=int, help="Lower bound for adaptive batch sizing")
+    execution.add_argument("--max-batch-size", dest="max_batch_size", type=int, help="Upper bound for adaptive batch sizing")
+    execution.add_argument("--writers", dest="writer_threads", type=int, help="insert_many calls in flight per worker (0 = inline)")
+    execution.add_argument("--queue-depth", dest="queue_depth", type=int, help="Batches buffered ahead of the writers")
+    
+    live = parser.add_argument_group("live feed")
+    live.add_argument("--live", action="store_true", default=None, help="Stream readings with current timestamps on a wall-clock schedule instead of backfilling --start/--end")
+    live.add_argument("--rate", type=float, help="Target docs/sec of a live feed; sets the interval to devices / rate")
+    live.add_argument("--duration", type=float, help="Seconds a live feed runs (default: until interrupted)")
+    live.add_argument("--tick", type=float, help=f"Seconds between scheduler ticks of a live feed (default {LIVE_TICK_SECONDS:g})")
+    
+    disorder = parser.add_argument_group("disorder")
+    disorder.add_argument("--disorder", choices=list(DISORDER_PROFILES), help="Deliver readings late and out of order like real devices (default none)")
+    disorder.add_argument("--late-fraction", dest="late_fraction", type=float, help="Share of readings sent late (overrides the profile)")
+    disorder.add_argument("--max-lateness", dest="max_lateness", type=float, help="Most seconds a late reading is delayed (overrides the profile)")
+    disorder.add_argument("--outages-per-day", dest="outages_per_day", type=float, help="Simulated outages per device per day; each ends with a burst of its backlog (overrides the profile)")
+    disorder.add_argument("--outage-minutes", dest="outage_minutes", type=float, help="Length of a simulated outage (overrides the profile)")
+    disorder.add_argument("--reorder-buffer", dest="reorder_buffer", type=int, help=f"Readings a device holds back at most (default {REORDER_BUFFER:,})")
+    
+    timeseries = parser.add_argument_group("time series")
+    timeseries.add_argument("--granularity", choices=["auto"] + list(GRANULARITY_BUCKETING), help="Granularity of the created time series collection")
+    timeseries.add_argument("--bucket-span", dest="bucket_span_seconds", type=int, help="Custom bucketMaxSpanSeconds (= bucketRoundingSeconds) instead of a granularity")
+    timeseries.add_argument("--insert-order", dest="insert_order", choices=["bucket", "generated"], help="Cut batches on server bucket boundaries or at the batch size")
+    timeseries.add_argument("--ordered", dest="ordered_inserts", action=argparse.BooleanOptionalAction, help="Use ordered insert_many (default unordered)")
+    timeseries.add_argument("--create-indexes", dest="create_indexes", action=argparse.BooleanOptionalAction, help="Index metadata.device_id + timestamp after the load")
+    
+    recovery = parser.add_argument_group("checkpoints and retries")
+    recovery.add_argument("--checkpoint-dir", dest="checkpoint_dir", help="Where shard checkpoints are kept (default checkpoints/<database>.<collection>)")
+    recovery.add_argument("--resume", action="store_true", default=None, help="Continue an interrupted run from its checkpoints")
+    recovery.add_argument("--max-retries", dest="max_retries", type=int, help="Retries per failed insert_many")
+    recovery.add_argument("--retry-backoff", dest="retry_backoff", type=float, help="First retry delay in seconds (doubles per attempt)")
+    
+    instrumentation = parser.add_argument_group("metrics")
+    instrumentation.add_argument("--metrics-port", dest="metrics_port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    instrumentation.add_argument("--metrics-file", dest="metrics_file", help="Append a JSON metrics record to this JSONL file periodically")
+    instrumentation.add_argument("--metrics-interval", dest="metrics_interval", type=float, help="Seconds between JSONL metrics records")
+    instrumentation.add_argument("--profile", help="Write a JSON report of startup phase timings and per-batch RSS/allocation samples to this file")
+    instrumentation.add_argument("--cprofile", action="store_true", default=None, help="With --profile, also run every shard's generation loop under cProfile (stats saved next to the report)")
+    instrumentation.add_argument("--tracemalloc", action="store_true", default=None, help="With --profile, also trace Python allocations (traced bytes per batch, top allocation sites); slows generation several times")
+    
+    output = parser.add_argument_group("output")
+    output.add_argument("--sink", choices=["mongodb", "null"] + list(FILE_SINKS), help="Where documents go; null discards them to measure generation alone, bson/jsonl/parquet write files")
+    output.add_argument("--dry-run", dest="sink", action="store_const", const="null", help="Same as --sink=null")
+    output.add_argument("--output-dir", dest="output_dir", help=f"Directory for file sinks (default {OUTPUT_DIR}/<database>/<collection>.<ext>)")
+    output.add_argument("--replay", help="Insert a file written by a bson/jsonl/parquet sink instead of generating data")
+    output.add_argument("--rollups", action=argparse.BooleanOptionalAction, help="Also upsert hourly/daily per-device rollups into <collection>_hourly and <collection>_daily")
+    output.add_argument("--verify-rollups", dest="verify_rollups", action="store_true", default=None, help="Compare the rollup collections with a $group over the raw collection and time both, instead of generating data")
+    output.add_argument("-y", "--yes", action="store_true", default=None, help="Do not ask for confirmation on large datasets")
+    
+    # Unset options stay None so they do not override the config file
+    parser.set_defaults(**{key: None for key in DEFAULT_SETTINGS})
+    return parser
+
+def load_config_file(path):
+    """Read a TOML (.toml) or YAML (.yaml/.yml) settings file into a dict"""
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            print("Error: PyYAML is required for YAML config files (pip install pyyaml), or use TOML.")
+            sys.exit(1)
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    else:
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    
+    unknown = set(config) - set(DEFAULT_SETTINGS)
+    if unknown:
+        print(f"Error: unknown setting(s) in {path}: {', '.join(sorted(unknown))}")
+        sys.exit(1)
+    return config
+
+def load_settings(argv=None):
+    """Merge defaults, config file and command-line options, prompting for anything still missing"""
+    args = vars(build_arg_parser().parse_args(argv))
+    
+    config_path = args.pop("config")
+    
+    settings = dict(DEFAULT_SETTINGS)
+    if config_path:
+        settings.update(load_config_file(config_path))
+    settings.update({key: value for key, value in args.items() if value is not None})
+    
+    for key in ("start_date", "end_date"):
+        if settings[key] is not None:
+            settings[key] = parse_date(settings[key])
+    
+    if settings["replay"] or settings["verify_rollups"]:
+        if settings["sink"] != "mongodb":
+            print(f"Error: {'--replay' if settings['replay'] else '--verify-rollups'} works against MongoDB and cannot be combined with --sink.")
+            sys.exit(1)
+        required = ["mongodb_url", "database_name", "collection_name"]
+    else:
+        required = [] if settings["live"] else ["start_date", "end_date"]
+        if not (settings["live"] and settings["rate"]):
+            required += ["interval_seconds"]
+        if settings["sink"] != "null":
+            required += ["database_name", "collection_name"]
+        if settings["sink"] == "mongodb":
+            required += ["mongodb_url"]
+    missing = [key for key in required if settings[key] in (None, "")]
+    if missing:
+        if not sys.stdin.isatty():
+            print(f"Error: missing required setting(s): {', '.join(missing)}")
+            sys.exit(1)
+        settings = get_user_inputs(settings)
+    if settings["sink"] == "parquet" or str(settings["replay"]).endswith(".parquet"):
+        import_pyarrow()
+    if (settings["cprofile"] or settings["tracemalloc"]) and not settings["profile"]:
+        print("Error: --cprofile and --tracemalloc need --profile <report.json> to write their results to.")
+        sys.exit(1)
+    if settings["replay"] or settings["verify_rollups"]:
+        settings["checkpoint_dir"] = None
+        settings["resume"] = False
+        return settings
+    
+    if settings["live"]:
+        schedule_live_feed(settings)
+    if settings["end_date"] < settings["start_date"]:
+        print("Error: end date must be after start date.")
+        sys.exit(1)
+    if settings["interval_seconds"] <= 0:
+        print("Error: interval must be a positive number.")
+        sys.exit(1)
+    
+    if settings["device_templates"] is not None:
+        settings["device_templates"] = parse_templates(settings["device_templates"])
+        unknown = set(settings["device_templates"]) - {device["id"] for device in DEVICES}
+        if unknown or not settings["device_templates"]:
+            print(f"Error: device templates must be chosen from {', '.join(device['id'] for device in DEVICES)}")
+            sys.exit(1)
+    if settings["bucket_span_seconds"] is not None:
+        if not 1 <= settings["bucket_span_seconds"] <= MAX_BUCKET_SPAN_SECONDS:
+            print(f"Error: bucket span must be between 1 and {MAX_BUCKET_SPAN_SECONDS} seconds.")
+            sys.exit(1)
+        settings["granularity"] = "custom"
+    if settings["homes"] < 0:
+        print("Error: homes must be zero or a positive number.")
+        sys.exit(1)
+    if settings["homes"] and settings["engine"] != "vectorized":
+        print("Error: fleet mode (--homes) requires the vectorized engine.")
+        sys.exit(1)
+    if settings["rollups"] and settings["sink"] in FILE_SINKS:
+        print("Error: rollups are written to companion collections and need --sink mongodb (or null to measure them).")
+        sys.exit(1)
+    if settings["rollups"] and settings["resume"]:
+        # Rollup upserts add to the stored totals, so regenerating readings would count them twice
+        print("Error: --rollups cannot be combined with --resume; rebuild the rollups over a fresh load.")
+        sys.exit(1)
+    
+    settings["disorder_profile"] = disorder_profile(settings)
+    
+    # Load-test mode fills in relaxed write concern wherever it was not set explicitly
+    if settings["load_test"]:
+        if settings["write_concern"] is None:
+            settings["write_concern"] = 0
+        if settings["journal"] is None:
+            settings["journal"] = False
+    if settings["write_concern"] == 0 and (settings["journal"] or settings["bypass_validation"]):
+        print("Error: unacknowledged writes (w=0) cannot be journaled or bypass document validation.")
+        sys.exit(1)
+    if settings["max_pool_size"] is not None and settings["max_pool_size"] < 1:
+        print("Error: max pool size must be a positive number.")
+        sys.exit(1)
+    if settings["compressors"]:
+        settings["compressors"] = parse_compressors(settings["compressors"])
+        # pymongo silently drops compressors whose library is missing, so say so up front
+        missing = [name for name in settings["compressors"] if importlib.util.find_spec(COMPRESSOR_MODULES[name]) is None]
+        if missing:
+            print(f"Warning: {', '.join(missing)} compression unavailable (pip install 'pymongo[{','.join(missing)}]'); not requesting it.")
+            settings["compressors"] = [name for name in settings["compressors"] if name not in missing] or None
+    
+    # Config rules are applied after the built-in POWER_PROFILES and HOLIDAY_RULES
+    try:
+        settings["profiles"] = PowerProfiles(DEVICES, settings["power_profiles"], settings["holiday_rules"])
+    except (TypeError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    # Parquet rows are built from documents, not pre-encoded BSON
+    if settings["sink"] == "parquet":
+        settings["encoding"] = "dict"
+    
+    # Checkpoints only make sense when documents are stored in MongoDB (file sinks rewrite their files),
+    # writes are acknowledged (with w=0 a batch counts as done as soon as it is sent) and the range is
+    # fixed (a live feed's timestamps are wall-clock time, so there is nothing to resume)
+    if settings["sink"] != "mongodb" or settings["write_concern"] == 0 or settings["live"]:
+        settings["checkpoint_dir"] = None
+        settings["resume"] = False
+    elif not settings["checkpoint_dir"]:
+        settings["checkpoint_dir"] = os.path.join("checkpoints", f"{settings['database_name']}.{settings['collection_name']}")
+    # Turned on by timeseries_cleanup once the collection is known to be time series on 7.0+
+    settings["purge_retries"] = False
+    
+    # Without --seed every run gets a fresh one; a resumed run keeps the seed it started with
+    plan_path = os.path.join(settings["checkpoint_dir"], "plan.json") if settings["checkpoint_dir"] else None
+    if settings["seed"] is None and settings["resume"] and os.path.exists(plan_path):
+        with open(plan_path) as f:
+            settings["seed"] = json.load(f).get("seed")
+    if settings["seed"] is None:
+        settings["seed"] = int(np.random.SeedSequence().entropy)
+    if settings["seed"] < 0:
+        print("Error: seed must be zero or a positive number.")
+        sys.exit(1)
+    
+    # Convert seconds to minutes for internal calculations
+    settings["interval_minutes"] = settings["interval_seconds"] / 60
+    return settings
+
+def schedule_live_feed(settings):
+    """Check the live feed options and set its interval and (start, end) from the wall clock"""
+    if settings["start_date"] is not None or settings["end_date"] is not None:
+        print("Error: a live feed (--live) uses current timestamps and cannot be combined with --start/--end.")
+        sys.exit(1)
+    if settings["engine"] != "vectorized":
+        print("Error: a live feed (--live) requires the vectorized engine.")
+        sys.exit(1)
+    if settings["tick"] <= 0 or (settings["duration"] is not None and settings["duration"] <= 0):
+        print("Error: --tick and --duration must be positive numbers of seconds.")
+        sys.exit(1)
+    if settings["rate"] is not None:
+        if settings["rate"] <= 0:
+            print("Error: rate must be a positive number of docs/sec.")
+            sys.exit(1)
+        templates = parse_templates(settings["device_templates"]) if settings["device_templates"] else DEVICES
+        devices = max(1, settings["homes"]) * len(templates)
+        # Readings are at least a second apart (their _id carries the timestamp in seconds)
+        if devices / settings["rate"] < 0.5:
+            print(f"Error: {devices:,} devices produce at most {devices:,} docs/sec; add homes (--homes) for {settings['rate']:,.0f} docs/sec.")
+            sys.exit(1)
+        settings["interval_seconds"] = max(1, round(devices / settings["rate"]))
+        # Every device reads once per whole-second interval, so only devices / n docs/sec are possible
+        achievable = devices / settings["interval_seconds"]
+        if abs(achievable - settings["rate"]) > settings["rate"] * LIVE_RATE_TOLERANCE:
+            print(f"Warning: {devices:,} devices reading every {settings['interval_seconds']}s give {achievable:,.1f} docs/sec, "
+                  f"not the {settings['rate']:,.1f} asked for; adjust --homes or --device-templates to get closer.")
+    if settings["interval_seconds"] <= 0:
+        print("Error: interval must be a positive number.")
+        sys.exit(1)
+    settings["start_date"], settings["end_date"] = live_window(settings)
+
+def live_window(settings):
+    """(start, exclusive end) of a live feed starting at the next interval boundary from now"""
+    first = -(-int(time.time()) // settings["interval_seconds"]) * settings["interval_seconds"]
+    start = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=first)
+    return start, start + datetime.timedelta(seconds=settings["duration"] or LIVE_MAX_DAYS * 86400)
+
+def disorder_profile(settings):
+    """The run's disorder profile with any command-line overrides applied, or None for in-order delivery"""
+    if settings["disorder"] not in DISORDER_PROFILES:
+        print(f"Error: unknown disorder profile {settings['disorder']!r}; choose from {', '.join(DISORDER_PROFILES)}.")
+        sys.exit(1)
+    profile = dict(DISORDER_PROFILES[settings["disorder"]])
+    profile.update({key: settings[key] for key in profile if settings[key] is not None})
+    if not 0 <= profile["late_fraction"] <= 1:
+        print("Error: late fraction must be between 0 and 1.")
+        sys.exit(1)
+    if min(profile["max_lateness"], profile["outages_per_day"], profile["outage_minutes"]) < 0:
+        print("Error: lateness, outages per day and outage minutes must be zero or positive numbers.")
+        sys.exit(1)
+    if settings["reorder_buffer"] < 1:
+        print("Error: reorder buffer must be a positive number of readings.")
+        sys.exit(1)
+    if not profile["late_fraction"] and not (profile["outages_per_day"] and profile["outage_minutes"]):
+        return None
+    if profile != DISORDER_PROFILES[settings["disorder"]]:
+        settings["disorder"] = "custom"
+    if settings["live"]:
+        print("Error: --disorder reorders a backfill; a live feed (--live) delivers readings as they come due.")
+        sys.exit(1)
+    return profile
 
 #################################################
 # DATA GENERATION FUNCTIONS
 #################################################
 
+def holiday_date(holiday, year):
+    """Return the exact date of a holiday in the given year"""
+    if "day_of_week" not in holiday:
+        return datetime.date(year, holiday["month"], holiday["day"])
+    
+    # Floating holidays: nth (or last, week == -1) given weekday of the month
+    week = holiday["week"]
+    if week > 0:
+        first = datetime.date(year, holiday["month"], 1)
+        offset = (holiday["day_of_week"] - first.weekday()) % 7
+        return first + datetime.timedelta(days=offset + 7 * (week - 1))
+    next_month = datetime.date(year + holiday["month"] // 12, holiday["month"] % 12 + 1, 1)
+    last = next_month - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - holiday["day_of_week"]) % 7)
+
 def is_holiday(timestamp):
     """Check if the timestamp is on a holiday"""
     for holiday in HOLIDAYS:
-        if timestamp.month == holiday["month"]:
-            # Handle fixed-date holidays
-            if "day_of_week" not in holiday and timestamp.day == holiday["day"]:
-                return holiday["name"]
-            
-            # Handle holidays that fall on specific days of week (e.g., Thanksgiving - 4th Thursday)
-            elif "day_of_week" in holiday:
-                # For simplification, we'll just handle a few special cases
-                # A full implementation would calculate the exact dates for each year
-                
-                # Memorial Day (last Monday in May)
-                if holiday["name"] == "Memorial Day" and timestamp.day >= 25 and timestamp.weekday() == 0:
-                    return holiday["name"]
-                
-                # Labor Day (first Monday in September)
-                if holiday["name"] == "Labor Day" and timestamp.day <= 7 and timestamp.weekday() == 0:
-                    return holiday["name"]
-                
-                # Thanksgiving (fourth Thursday in November)
-                if holiday["name"] == "Thanksgiving" and 22 <= timestamp.day <= 28 and timestamp.weekday() == 3:
-                    return holiday["name"]
-                
-                # MLK Day (third Monday in January)
-                if holiday["name"] == "Martin Luther King Jr. Day" and 15 <= timestamp.day <= 21 and timestamp.weekday() == 0:
-                    return holiday["name"]
+        if timestamp.month == holiday["month"] and holiday_date(holiday, timestamp.year) == timestamp.date():
+            return holiday["name"]
     
     return None
 
@@ -213,11 +813,10 @@ def is_special_event(device, timestamp):
                 if event["start_day"] <= timestamp.day <= event["end_day"]:
                     # Random pattern events (e.g., home renovation)
                     if "random_pattern" in event and event["random_pattern"]:
-                        # Create a random but consistent pattern for this event
+                        # Random but consistent pattern for this day/hour, drawn from a private
+                        # generator so the shared random module is never reseeded
                         seed = timestamp.day + timestamp.hour
-                        random.seed(seed)
-                        multiplier = random.choice([0.1, 0.5, 2.0, 3.0, 0.0])
-                        random.seed()  # Reset seed
+                        multiplier = random.Random(seed).choice([0.1, 0.5, 2.0, 3.0, 0.0])
                         return event["name"], multiplier
                     
                     # Check if event applies to all devices or this specific device
@@ -228,70 +827,17 @@ def is_special_event(device, timestamp):
     
     return None, 1.0
 
-def apply_holiday_patterns(device, power, timestamp, holiday_name):
-    """Apply holiday-specific patterns to device power consumption with more dramatic changes"""
-    
-    # Each holiday has different energy usage patterns
-    if holiday_name == "Christmas Day" or holiday_name == "Christmas Eve":
-        # Christmas: More cooking, lights, people at home
-        if device["id"] == "HVAC":
-            power *= 2.0  # Much more heating with people at home
-        elif device["id"] == "LIGHTING":
-            power *= 5.0  # Dramatic Christmas lights!
-        elif device["id"] == "WASHER":
-            power *= 3.0  # Many more dishes and laundry with guests
-        elif device["id"] == "EV_CHARGER":
-            power *= 0.3  # Much less commuting
-    
-    elif holiday_name == "Thanksgiving":
-        # Thanksgiving: Heavy cooking day
-        if device["id"] == "HVAC":
-            power *= 2.0  # More heating with people at home
-        elif device["id"] == "LIGHTING":
-            power *= 2.5  # More lights on for gathering
-        elif device["id"] == "WASHER":
-            power *= 4.0  # Many more dishes
-    
-    elif holiday_name == "New Year's Eve" or holiday_name == "New Year's Day":
-        # New Year's: Party time
-        if device["id"] == "LIGHTING":
-            power *= 3.0  # Party lighting
-        elif device["id"] == "HVAC":
-            power *= 2.0  # More heating with people at home
-        elif device["id"] == "EV_CHARGER":
-            power *= 0.4  # Much less driving on New Year's Day
-    
-    elif holiday_name == "Independence Day" or holiday_name == "Memorial Day" or holiday_name == "Labor Day":
-        # Summer holidays: Different pattern
-        if device["id"] == "HVAC":
-            if 13 <= timestamp.hour <= 18:  # Hot summer afternoon
-                power *= 2.5  # Much more AC use during summer holidays
-        elif device["id"] == "LIGHTING":
-            power *= 0.3  # Much less indoor lighting, more time outside
-    
-    elif holiday_name == "Halloween":
-        # Halloween: Evening spike
-        if device["id"] == "LIGHTING" and timestamp.hour >= 17 and timestamp.hour <= 22:
-            power *= 5.0  # Dramatic Halloween decorations and porch lights
-    
-    elif holiday_name == "Valentine's Day":
-        # Valentine's Day: Evening at home
-        if 18 <= timestamp.hour <= 23:
-            if device["id"] == "LIGHTING":
-                power *= 2.0  # Romantic lighting
-            elif device["id"] == "HVAC":
-                power *= 1.5  # Keeping it warm and cozy
-    
-    elif holiday_name == "St. Patrick's Day":
-        # St. Patrick's Day: Party effects
-        if 17 <= timestamp.hour <= 23:
-            if device["id"] == "LIGHTING":
-                power *= 2.0  # Party lighting
-    
-    return power
-
-def apply_device_specific_metrics(device, reading):
-    """Add simple device-specific metrics to the reading"""
+def apply_holiday_patterns(device, power, timestamp, holiday_name, profiles=None):
+    """Apply the HOLIDAY_RULES multiplier for the device and hour to its power consumption"""
+    profiles = profiles or default_profiles()
+    return power * profiles.holiday_multiplier(holiday_name, device, timestamp.hour)
+
+def uniform(low, high, draw):
+    """Map a [0, 1) draw (or an array of them) onto [low, high)"""
+    return low + (high - low) * draw
+
+def apply_device_specific_metrics(device, reading, draws):
+    """Add simple device-specific metrics to the reading (draws as in generate_reading)"""
     
     # Add status field for all devices - simple on/off
     reading["status"] = "on" if reading["power_kw"] > 0.05 else "off"
@@ -299,67 +845,37 @@ def apply_device_specific_metrics(device, reading):
     # Add device temperature for applicable devices
     if device["id"] in ["HVAC", "FRIDGE"]:
         if device["id"] == "HVAC":
-            reading["temperature"] = random.randint(65, 80)  # Room temperature in F
+            reading["temperature"] = 65 + int(draws[2] * 16)  # Room temperature in F (65-80)
         else:  # FRIDGE
-            reading["temperature"] = random.randint(33, 40)  # Fridge temperature in F
+            reading["temperature"] = 33 + int(draws[2] * 8)  # Fridge temperature in F (33-40)
     
     # Add runtime for all devices (how long it's been on in current state)
     # Simple random value that doesn't need to be consistent across time series
     if reading["status"] == "on":
-        reading["runtime_minutes"] = random.randint(1, 120)
+        reading["runtime_minutes"] = 1 + int(draws[3] * 120)
     else:
         reading["runtime_minutes"] = 0
     
     # Add efficiency rating for all devices (percentage)
-    reading["efficiency"] = random.randint(70, 99)
+    reading["efficiency"] = 70 + int(draws[4] * 30)
     
     # Add maintenance_needed flag (simple boolean for all devices)
-    reading["maintenance_needed"] = random.random() < 0.05  # 5% chance of maintenance flag
+    reading["maintenance_needed"] = draws[5] < 0.05  # 5% chance of maintenance flag
     
     return reading
 
-def generate_reading(device, timestamp):
-    """Generate a reading with realistic patterns including dramatic holiday and special events"""
+def generate_reading(device, timestamp, calendar=None, draws=None):
+    """Generate a reading with realistic patterns including dramatic holiday and special events
     
-    hour = timestamp.hour
-    is_weekend = timestamp.weekday() >= 5
-    
-    # Simple power values based on device type and time
-    if device["id"] == "HVAC":
-        # HVAC: higher during afternoon, lower at night
-        if 13 <= hour <= 18:
-            power = random.uniform(2.5, 3.5)  # Peak afternoon
-        elif 23 <= hour or hour <= 5:
-            power = random.uniform(0.1, 0.5)  # Low overnight
-        else:
-            power = random.uniform(1.0, 2.0)  # Normal
-    elif device["id"] == "FRIDGE":
-        power = random.uniform(0.1, 0.2)  # Consistent
-    elif device["id"] == "LIGHTING":
-        # Lighting: higher when dark
-        if 6 <= hour <= 8 or 18 <= hour <= 23:
-            power = random.uniform(0.2, 0.5)
-        else:
-            power = random.uniform(0.0, 0.1)
-    elif device["id"] == "EV_CHARGER":
-        # EV Charger: primarily evening/overnight
-        if 19 <= hour <= 23 or 0 <= hour <= 5:
-            power = random.uniform(6.0, 7.5) if random.random() < 0.5 else 0
-        else:
-            power = 0
-    elif device["id"] == "WASHER":
-        # Washing machine: used mostly mornings and evenings
-        if (7 <= hour <= 10) or (18 <= hour <= 21):
-            # 30% chance of being active during these hours
-            power = random.uniform(0.5, 1.2) if random.random() < 0.3 else 0.01
-        else:
-            power = 0.01  # Standby power
-    else:
-        power = random.uniform(0.1, 0.5)
+    draws are the reading's RANDOM_DRAWS uniforms from reading_draws; without them the
+    reading uses fresh values from the random module and is not reproducible.
+    """
+    if draws is None:
+        draws = [random.random() for _ in range(RANDOM_DRAWS)]
+    profiles = calendar.profiles if calendar else default_profiles()
     
-    # Weekend variations
-    if is_weekend and device["id"] in ["LIGHTING", "HVAC", "WASHER"]:
-        power *= 1.5  # Increased weekend usage
+    # Base power from the device's POWER_PROFILES cell for the hour and day type
+    power = profiles.reading_power(device, timestamp.hour, timestamp.weekday() >= 5, draws[0], draws[1])
     
     # Apply seasonal multipliers (different for each month)
     month = timestamp.month
@@ -367,29 +883,31 @@ def generate_reading(device, timestamp):
         power *= SEASONAL_MULTIPLIERS[month][device["id"]]
     
     # Check for holidays
-    holiday_name = is_holiday(timestamp)
+    holiday_name = calendar.holiday(timestamp) if calendar else is_holiday(timestamp)
     if holiday_name:
-        power = apply_holiday_patterns(device, power, timestamp, holiday_name)
+        if calendar:
+            power *= calendar.holiday_multiplier(device, timestamp)
+        else:
+            power = apply_holiday_patterns(device, power, timestamp, holiday_name, profiles)
     
     # Check for special events
-    event_name, event_multiplier = is_special_event(device, timestamp)
+    if calendar:
+        event_name, event_multiplier = calendar.special_event(device, timestamp)
+    else:
+        event_name, event_multiplier = is_special_event(device, timestamp)
     if event_name:
         power *= event_multiplier
     
-    # Create the base reading
+    # Create the base reading (the metadata subdocument is shared by all of the device's readings)
     reading = {
-        "_id": ObjectId(),
-        "metadata": {
-            "device_id": device["id"],
-            "device_name": device["name"],
-            "device_type": device["type"]
-        },
+        "_id": reading_id(device, timestamp),
+        "metadata": shared_metadata(device),
         "timestamp": timestamp,
         "power_kw": round(power, 3)
     }
     
     # Add device-specific fields
-    reading = apply_device_specific_metrics(device, reading)
+    reading = apply_device_specific_metrics(device, reading, draws)
     
     # Add event tagging for easier analytics
     if holiday_name:
@@ -399,178 +917,3285 @@ def generate_reading(device, timestamp):
     
     return reading
 
-def worker_thread(device, start_date, end_date, interval_minutes, batch_size, mongodb_url, database_name, collection_name):
-    """Worker thread that generates and inserts data for a specific device for a date range"""
+#################################################
+# POWER PROFILES
+#################################################
+
+POWER_FIELDS = ("low", "high", "chance", "otherwise", "scale")
+DAY_TYPES = ("weekday", "weekend")
+
+class PowerProfiles:
+    """POWER_PROFILES and HOLIDAY_RULES compiled into dense lookup arrays
     
-    global total_inserted
+    power[device, day type, hour] holds (low, high, chance, otherwise, scale) and
+    holiday[holiday code, device, hour] the multiplier, with devices in the order of
+    the device list, day type 0 = weekday / 1 = weekend and holiday code 0 = no holiday.
+    The hot paths only index these; rules from a config file are applied after the
+    built-in ones.
+    """
     
-    # Connect to MongoDB
-    client = MongoClient(mongodb_url)
-    db = client[database_name]
-    collection = db[collection_name]
+    def __init__(self, devices, power_rules=None, holiday_rules=None):
+        self.device_index = {device["id"]: i for i, device in enumerate(devices)}
+        self.holiday_names = [None] + [holiday["name"] for holiday in HOLIDAYS]
+        self.holiday_index = {name: i for i, name in enumerate(self.holiday_names) if name}
+        
+        self.power = np.full((len(devices), len(DAY_TYPES), 24, len(POWER_FIELDS)), np.nan)
+        for rule in POWER_PROFILES + list(power_rules or []):
+            self._check(rule, {"device", "hours", "days"} | set(POWER_FIELDS), (), "power profile")
+            days = [DAY_TYPES.index(rule["days"])] if "days" in rule else range(len(DAY_TYPES))
+            devices_matched, hours = self._devices(rule), self._hours(rule)
+            for field in POWER_FIELDS:
+                if field in rule:
+                    for d in devices_matched:
+                        for day_type in days:
+                            self.power[d, day_type, hours, POWER_FIELDS.index(field)] = float(rule[field])
+        missing = np.argwhere(np.isnan(self.power))
+        if missing.size:
+            d, day_type, hour, field = missing[0]
+            raise ValueError(f"power profile has no {POWER_FIELDS[field]} for {devices[d]['id']} at hour {hour} on a {DAY_TYPES[day_type]}")
+        
+        self.holiday = np.ones((len(self.holiday_names), len(devices), 24))
+        for rule in HOLIDAY_RULES + list(holiday_rules or []):
+            self._check(rule, {"holiday", "device", "hours", "multiplier"}, ("holiday", "multiplier"), "holiday rule")
+            names = [rule["holiday"]] if isinstance(rule["holiday"], str) else rule["holiday"]
+            unknown = [name for name in names if name not in self.holiday_index]
+            if unknown:
+                raise ValueError(f"holiday rule names unknown holiday(s): {', '.join(unknown)}")
+            for name in names:
+                for d in self._devices(rule):
+                    self.holiday[self.holiday_index[name], d, self._hours(rule)] = float(rule["multiplier"])
+        
+        # Nested lists for the scalar engine: plain indexing is faster than NumPy scalars there
+        self.power_cells = self.power.tolist()
+        self.holiday_cells = self.holiday.tolist()
     
-    print(f"Worker started for {device['name']}: generating data from {start_date} to {end_date}")
+    @staticmethod
+    def _check(rule, allowed, required, kind):
+        if not isinstance(rule, dict):
+            raise ValueError(f"{kind} must be a table of fields: {rule!r}")
+        unknown = set(rule) - allowed
+        if unknown:
+            raise ValueError(f"{kind} has unknown field(s) {', '.join(sorted(unknown))}: {rule}")
+        missing = [field for field in required if field not in rule]
+        if missing:
+            raise ValueError(f"{kind} is missing {', '.join(missing)}: {rule}")
+        if "days" in rule and rule["days"] not in DAY_TYPES:
+            raise ValueError(f"{kind} days must be one of {', '.join(DAY_TYPES)}: {rule}")
     
-    # Generate and insert data in batches
-    device_inserted = 0
-    batch = []
+    def _devices(self, rule):
+        """Device codes a rule applies to"""
+        ids = rule.get("device", "*")
+        if ids == "*":
+            return list(self.device_index.values())
+        ids = [ids] if isinstance(ids, str) else ids
+        unknown = [device_id for device_id in ids if device_id not in self.device_index]
+        if unknown:
+            raise ValueError(f"rule names unknown device(s) {', '.join(unknown)}: {rule}")
+        return [self.device_index[device_id] for device_id in ids]
     
-    current_time = start_date
+    @staticmethod
+    def _hours(rule):
+        """Hours of the day a rule covers; [first, last] is inclusive and may wrap past midnight"""
+        if "hours" not in rule:
+            return list(range(24))
+        hours = rule["hours"]
+        if not (isinstance(hours, list) and len(hours) == 2 and all(isinstance(hour, int) for hour in hours)):
+            raise ValueError(f"rule hours must be [first, last]: {rule}")
+        first, last = hours
+        if not (0 <= first <= 23 and 0 <= last <= 23):
+            raise ValueError(f"rule hours must be between 0 and 23: {rule}")
+        return [hour % 24 for hour in range(first, last + 1 if last >= first else last + 25)]
     
-    while current_time <= end_date:
-        # Generate reading for this device
-        reading = generate_reading(device, current_time)
-        batch.append(reading)
+    def reading_power(self, device, hour, weekend, level, chance):
+        """Base power of one reading from its level and chance draws"""
+        low, high, chance_on, otherwise, scale = self.power_cells[self.device_index[device["id"]]][weekend][hour]
+        return scale * (uniform(low, high, level) if chance < chance_on else otherwise)
+    
+    def power_block(self, device, hour, weekend, level, chance):
+        """Vectorized reading_power for arrays of hours, weekend flags and draws"""
+        cells = self.power[self.device_index[device["id"]], weekend.astype(np.int64), hour]
+        low, high, chance_on, otherwise, scale = cells.T
+        return scale * np.where(chance < chance_on, uniform(low, high, level), otherwise)
+    
+    def holiday_multiplier(self, holiday_name, device, hour):
+        """Power multiplier of a device during a holiday hour"""
+        return self.holiday_cells[self.holiday_index[holiday_name]][self.device_index[device["id"]]][hour]
+
+# Profiles compiled from the built-in tables, used when no CalendarIndex supplies its own
+_default_profiles = None
+
+def default_profiles():
+    """PowerProfiles for DEVICES from the built-in tables, compiled on first use"""
+    global _default_profiles
+    if _default_profiles is None:
+        _default_profiles = PowerProfiles(DEVICES)
+    return _default_profiles
+
+#################################################
+# CALENDAR INDEX
+#################################################
+
+class CalendarIndex:
+    """Holiday and special-event lookups precomputed for every (date, hour, device) of a run
+    
+    margin_days extends the index on both sides so fleet homes can look up their
+    special events shifted by up to that many days. profiles are the compiled
+    PowerProfiles the run generates from (default: the built-in tables).
+    """
+    
+    def __init__(self, start_date, end_date, devices, margin_days=0, profiles=None):
+        self.profiles = profiles or default_profiles()
+        self.first_day = start_date.date() - datetime.timedelta(days=margin_days)
+        self.num_days = (end_date.date() - self.first_day).days + 1 + margin_days
+        self.device_index = {device["id"]: i for i, device in enumerate(devices)}
         
-        # Insert when batch is full
-        if len(batch) >= batch_size:
-            try:
-                collection.insert_many(batch)
-                
-                with lock:
-                    device_inserted += len(batch)
-                    total_inserted += len(batch)
-                    
-                    # Print progress based on configured frequency
-                    if total_inserted % PROGRESS_REPORT_FREQUENCY < batch_size:
-                        elapsed = time.time() - process_start
-                        docs_per_second = total_inserted / elapsed if elapsed > 0 else 0
-                        time_diff = (end_date - start_date).total_seconds()
-                        if time_diff > 0:
-                            percent_time = ((current_time - start_date).total_seconds() / time_diff) * 100
-                            est_remaining_secs = (elapsed / percent_time * 100) - elapsed if percent_time > 0 else 0
-                        else:
-                            percent_time = 100
-                            est_remaining_secs = 0
-                        
-                        print(f"\n[{datetime.datetime.now().strftime('%H:%M:%S')}] PROGRESS UPDATE:")
-                        print(f"  Inserted: {total_inserted:,} documents")
-                        print(f"  Date progress: {current_time.strftime('%Y-%m-%d %H:%M')} ({percent_time:.1f}%)")
-                        print(f"  Elapsed time: {elapsed:.1f} seconds ({elapsed/60:.1f} minutes)")
-                        print(f"  Insertion rate: {docs_per_second:.1f} docs/sec")
-                        print(f"  Estimated remaining: {est_remaining_secs/60:.1f} minutes")
-                        print("-" * 60)
-            except Exception as e:
-                print(f"Error inserting batch for {device['name']}: {e}")
-                # Try to continue with the next batch
+        # Code 0 means "no holiday" / "no event"
+        self.holiday_names = [None]
+        self.event_names = [None]
+        
+        self.holiday_codes = np.zeros(self.num_days, dtype=np.int16)
+        self.holiday_multipliers = np.ones((self.num_days, 24, len(devices)))
+        self.event_codes = np.zeros((self.num_days, 24, len(devices)), dtype=np.int16)
+        self.event_multipliers = np.ones((self.num_days, 24, len(devices)))
+        
+        holidays_by_date = {}
+        for year in range(self.first_day.year, end_date.year + 2):
+            for holiday in HOLIDAYS:
+                holidays_by_date[holiday_date(holiday, year)] = holiday["name"]
+        
+        for day_offset in range(self.num_days):
+            date = self.first_day + datetime.timedelta(days=day_offset)
+            holiday_name = holidays_by_date.get(date)
+            if holiday_name:
+                self.holiday_codes[day_offset] = self._code(self.holiday_names, holiday_name)
+                # HOLIDAY_RULES multipliers for every hour of the day
+                holiday = self.profiles.holiday[self.profiles.holiday_index[holiday_name]]
+                for d, device in enumerate(devices):
+                    self.holiday_multipliers[day_offset, :, d] = holiday[self.profiles.device_index[device["id"]]]
             
-            batch = []
+            for hour in range(24):
+                hour_start = datetime.datetime(date.year, date.month, date.day, hour)
+                for d, device in enumerate(devices):
+                    event_name, event_multiplier = is_special_event(device, hour_start)
+                    if event_name:
+                        self.event_codes[day_offset, hour, d] = self._code(self.event_names, event_name)
+                        self.event_multipliers[day_offset, hour, d] = event_multiplier
         
-        # Move to next timestamp
-        current_time += datetime.timedelta(minutes=interval_minutes)
+        self.holiday_name_array = np.array(self.holiday_names, dtype=object)
+        self.event_name_array = np.array(self.event_names, dtype=object)
+        # Bit of each event code in a fleet home's event_mask (see Fleet)
+        event_index = {event["name"]: i for i, event in enumerate(SPECIAL_EVENTS)}
+        self.event_bits = np.array([0] + [1 << event_index[name] for name in self.event_names[1:]], dtype=np.uint8)
     
-    # Insert any remaining documents
-    if batch:
-        try:
-            collection.insert_many(batch)
-            with lock:
-                device_inserted += len(batch)
-                total_inserted += len(batch)
-        except Exception as e:
-            print(f"Error inserting final batch for {device['name']}: {e}")
+    @staticmethod
+    def _code(names, name):
+        """Return the integer code for a name, registering it on first use"""
+        if name not in names:
+            names.append(name)
+        return names.index(name)
     
-    print(f"Worker for {device['name']} completed. Inserted {device_inserted:,} documents.")
-    client.close()
+    def _day_offset(self, timestamp):
+        day_offset = (timestamp.date() - self.first_day).days
+        if not 0 <= day_offset < self.num_days:
+            raise KeyError(f"{timestamp} is outside the calendar index range")
+        return day_offset
+    
+    def holiday(self, timestamp):
+        """Return the holiday name for a timestamp, or None"""
+        return self.holiday_names[self.holiday_codes[self._day_offset(timestamp)]]
+    
+    def holiday_multiplier(self, device, timestamp):
+        """Return the holiday power multiplier for a device at a timestamp"""
+        return self.holiday_multipliers[self._day_offset(timestamp), timestamp.hour, self.device_index[device["id"]]]
+    
+    def special_event(self, device, timestamp):
+        """Return (event_name, multiplier) for a device at a timestamp, like is_special_event"""
+        day_offset = self._day_offset(timestamp)
+        d = self.device_index[device["id"]]
+        code = self.event_codes[day_offset, timestamp.hour, d]
+        if not code:
+            return None, 1.0
+        return self.event_names[code], float(self.event_multipliers[day_offset, timestamp.hour, d])
+    
+    def block(self, device, timestamps, hour, home=None):
+        """Vectorized lookup: holiday codes/multipliers and event codes/multipliers for a block
+        
+        For a fleet home, events are shifted by the home's event_shift and dropped unless
+        the home takes part in them.
+        """
+        if home is None:
+            return self.homes_block(device, timestamps, hour)
+        return self.homes_block(device, timestamps, hour, home.event_shift, home.event_mask)
+    
+    def homes_block(self, device, timestamps, hour, event_shift=None, event_mask=None):
+        """block() for readings of several fleet homes, given each reading's event_shift and event_mask"""
+        day_offset = (timestamps.astype("datetime64[D]") - np.datetime64(self.first_day, "D")).astype(np.int64)
+        event_offset = day_offset - event_shift if event_shift is not None else day_offset
+        if day_offset.size and (min(day_offset.min(), event_offset.min()) < 0 or max(day_offset.max(), event_offset.max()) >= self.num_days):
+            raise KeyError("timestamp block is outside the calendar index range")
+        d = self.device_index[device["id"]]
+        event_code = self.event_codes[event_offset, hour, d]
+        event_multiplier = self.event_multipliers[event_offset, hour, d]
+        if event_mask is not None:
+            skipped = (self.event_bits[event_code] & event_mask) == 0
+            event_code = np.where(skipped, 0, event_code).astype(np.int16)
+            event_multiplier = np.where(skipped, 1.0, event_multiplier)
+        return (
+            self.holiday_codes[day_offset],
+            self.holiday_multipliers[day_offset, hour, d],
+            event_code,
+            event_multiplier,
+        )
 
-def main():
-    """Main function to set up and run the data generation process"""
-    # Get user inputs through interactive prompts
-    inputs = get_user_inputs()
-    
-    mongodb_url = inputs["mongodb_url"]
-    database_name = inputs["database_name"]
-    collection_name = inputs["collection_name"]
-    start_date = inputs["start_date"]
-    end_date = inputs["end_date"]
-    interval_seconds = inputs["interval_seconds"]
-    interval_minutes = inputs["interval_minutes"]
-    
-    # Add a day to end_date and subtract the interval to include the full end date
-    end_date = end_date + datetime.timedelta(days=1) - datetime.timedelta(seconds=interval_seconds)
-    
-    # Connect to MongoDB
-    print(f"\nConnecting to MongoDB at: {datetime.datetime.now().strftime('%H:%M:%S')}")
-    print(f"MongoDB URL: {mongodb_url}")
-    print(f"Database: {database_name}")
-    print(f"Collection: {collection_name}")
+#################################################
+# FLEET OF HOMES
+#################################################
+
+class HomeProfile:
+    """One fleet home: its identity and its variation of the seasonal and event profiles"""
     
-    try:
-        client = MongoClient(mongodb_url)
-        # Quick test of the connection
-        client.server_info()
-        # Create database reference
-        db = client[database_name]
-        print("MongoDB connection successful!")
-    except Exception as e:
-        print(f"\nError connecting to MongoDB: {e}")
-        sys.exit(1)
+    __slots__ = ("index", "home_id", "region", "load_scale", "seasonal_scale", "event_shift", "event_mask")
     
-    # Create collection with time series configuration if it doesn't exist
-    if collection_name not in db.list_collection_names():
-        print(f"\nCreating time series collection: {collection_name}")
-        try:
-            db.create_collection(
-                collection_name,
-                timeseries={
-                    "timeField": "timestamp",
-                    "metaField": "metadata",
-                    "granularity": "minutes"
-                }
-            )
-            print(f"Created time series collection: {collection_name}")
-        except Exception as e:
-            print(f"Warning: Could not create time series collection: {e}")
-            print("Will use regular collection instead.")
+    def __init__(self, index, home_id, region, load_scale, seasonal_scale, event_shift, event_mask):
+        self.index = index
+        self.home_id = home_id
+        self.region = region
+        self.load_scale = load_scale
+        self.seasonal_scale = seasonal_scale
+        self.event_shift = event_shift
+        self.event_mask = event_mask
+
+class Fleet:
+    """N homes x M device templates, kept as one NumPy array per home attribute
     
-    # Calculate total documents and estimate data size
-    total_seconds = int((end_date - start_date).total_seconds()) + 1
-    total_data_points = (total_seconds // interval_seconds) * len(DEVICES)
-    estimated_size_mb = total_data_points * 0.0005  # Rough estimate of 500 bytes per document
+    A home costs 11 bytes here, so million-home fleets fit comfortably in memory.
+    HomeProfile objects are only created for the homes a shard is working on, and
+    the device templates are the shared DEVICES dicts.
+    """
     
-    print(f"\nData Generation Plan:")
-    print(f"  Time range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-    print(f"  Resolution: Every {interval_seconds} second(s)")
-    print(f"  Devices: {len(DEVICES)}")
-    print(f"  Estimated data points: {total_data_points:,}")
-    print(f"  Estimated data size: {estimated_size_mb:.1f} MB")
-    print(f"  Threads: {len(DEVICES)}")
-    print("-" * 60)
+    def __init__(self, homes, templates, seed=None):
+        self.homes = homes
+        self.templates = templates
+        self.id_width = max(7, len(str(homes - 1)))
+        rng = np.random.default_rng(seed)
+        
+        region_scale = np.array([REGION_SEASONAL_SCALE[region] for region in FLEET_REGIONS])
+        self.region = rng.integers(0, len(FLEET_REGIONS), homes, dtype=np.uint8)
+        self.load_scale = rng.lognormal(0.0, HOME_LOAD_SIGMA, homes).astype(np.float32)
+        self.seasonal_scale = (region_scale[self.region] * rng.uniform(0.75, 1.25, homes)).astype(np.float32)
+        self.event_shift = rng.integers(-MAX_EVENT_SHIFT_DAYS, MAX_EVENT_SHIFT_DAYS + 1, homes, dtype=np.int8)
+        # Bit i set = the home takes part in SPECIAL_EVENTS[i]
+        self.event_mask = np.zeros(homes, dtype=np.uint8)
+        for i in range(len(SPECIAL_EVENTS)):
+            self.event_mask |= (rng.random(homes) < EVENT_PARTICIPATION).astype(np.uint8) << i
     
-    # Get confirmation for large datasets
-    if total_data_points > 1000000:
-        confirm = input(f"\nWarning: This will generate a large dataset ({total_data_points:,} data points). Continue? (y/n): ")
-        if confirm.lower() != 'y':
-            print("Operation cancelled.")
-            return
+    @property
+    def device_count(self):
+        return self.homes * len(self.templates)
+    
+    def home_id(self, index):
+        """Zero-padded home id, so ranges of homes are also ranges of home_id strings"""
+        return f"H{index:0{self.id_width}d}"
     
-    # Start worker threads for each device
-    threads = []
-    for device in DEVICES:
-        thread = threading.Thread(
-            target=worker_thread,
-            args=(device, start_date, end_date, interval_minutes, BATCH_SIZE, mongodb_url, database_name, collection_name)
+    def home(self, index):
+        """Build the HomeProfile for one home"""
+        return HomeProfile(
+            index,
+            self.home_id(index),
+            FLEET_REGIONS[self.region[index]],
+            float(self.load_scale[index]),
+            float(self.seasonal_scale[index]),
+            int(self.event_shift[index]),
+            int(self.event_mask[index])
         )
-        thread.daemon = True  # Set daemon to True so main program can exit if threads are still running
-        threads.append(thread)
-        thread.start()
+
+def device_number(device, home=None):
+    """Unique number of a device: its DEVICES index, or for a fleet home one number per (home, template)"""
+    index = DEVICES.index(device)
+    if home is None:
+        return index
+    return (home.index + 1) * len(DEVICES) + index
+
+def device_metadata(device, home=None):
+    """The metadata subdocument of a device's readings"""
+    if home is None:
+        return {
+            "device_id": device["id"],
+            "device_name": device["name"],
+            "device_type": device["type"]
+        }
+    return {
+        "home_id": home.home_id,
+        "region": home.region,
+        "device_id": f"{home.home_id}-{device['id']}",
+        "device_name": device["name"],
+        "device_type": device["type"]
+    }
+
+# One metadata subdocument per device, shared by every scalar reading of that device
+_shared_metadata = {}
+
+def shared_metadata(device):
+    """device_metadata(device), built once per device; readings share it, so it must never be modified"""
+    metadata = _shared_metadata.get(device["id"])
+    if metadata is None:
+        metadata = _shared_metadata[device["id"]] = device_metadata(device)
+    return metadata
+
+#################################################
+# VECTORIZED (COLUMNAR) GENERATION
+#################################################
+
+def timestamp_block(start_time, step, count):
+    """Return `count` timestamps spaced `step` apart as a datetime64[us] array"""
+    step_us = step // datetime.timedelta(microseconds=1)
+    start = np.datetime64(start_time, "us")
+    return start + np.arange(count, dtype=np.int64) * np.timedelta64(step_us, "us")
+
+def calendar_fields(timestamps):
+    """Split a datetime64 array into hour, weekday, month and day-of-month arrays"""
+    days = timestamps.astype("datetime64[D]")
+    months = timestamps.astype("datetime64[M]")
+    hour = (timestamps - days) // np.timedelta64(1, "h")
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday (Monday = 0)
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    return hour, weekday, month, day
+
+def reading_id(device, timestamp, home=None):
+    """Deterministic ObjectId for a device's reading at a timestamp (see object_id_block)"""
+    seconds = calendar_module.timegm(timestamp.timetuple())
+    return ObjectId((seconds & 0xFFFFFFFF).to_bytes(4, "big") + device_number(device, home).to_bytes(5, "big") + bytes(3))
+
+def object_id_block(device, timestamps, home=None):
+    """Deterministic ObjectIds for a block of readings as a (count, 12) uint8 array
     
-    # Wait for all threads to complete
-    try:
-        for thread in threads:
-            thread.join()
-    except KeyboardInterrupt:
-        print("\nProcess interrupted by user. Waiting for threads to complete...")
-        print("Please wait to ensure data integrity.")
-        # Let threads finish their current batch
-        for thread in threads:
-            if thread.is_alive():
-                thread.join(timeout=10)
-        print("Process terminated.")
-        sys.exit(0)
+    Layout: 4-byte timestamp seconds (like a normal ObjectId), 5-byte device number,
+    3 zero bytes. A retried or resumed batch therefore carries the same _ids as the
+    first attempt, and a duplicate key error means the reading is already stored.
+    Seconds are taken modulo 2**32, so readings before 1970 wrap like ObjectId's own
+    timestamp field instead of failing.
+    """
+    count = timestamps.shape[0]
+    seconds = (timestamps.astype("datetime64[s]").astype(np.int64) & 0xFFFFFFFF).astype(">u4")
+    ids = np.zeros((count, 12), dtype=np.uint8)
+    ids[:, 0:4] = seconds.view(np.uint8).reshape(count, 4)
+    ids[:, 4:9] = np.frombuffer(device_number(device, home).to_bytes(5, "big"), dtype=np.uint8)
+    return ids
+
+def homes_object_ids(device, homes, timestamps):
+    """object_id_block for `timestamps` repeated once per home, home after home"""
+    ids = np.tile(object_id_block(device, timestamps), (len(homes), 1))
+    numbers = np.array([device_number(device, home) for home in homes], dtype=">u8")
+    ids[:, 4:9] = np.repeat(numbers.view(np.uint8).reshape(len(homes), 8)[:, 3:], timestamps.shape[0], axis=0)
+    return ids
+
+def generate_block(device, start_time, step, count, seed, calendar, home=None):
+    """Generate `count` consecutive readings for a device (of a fleet home) as a dict of NumPy columns"""
+    timestamps = timestamp_block(start_time, step, count)
+    hour, weekday, month, _ = calendar_fields(timestamps)
+    device_id = device["id"]
+    draws = reading_draws(device, timestamps, step, seed, home)
     
-    print(f"\nData generation complete! Total documents inserted: {total_inserted:,}")
-    print(f"Total runtime: {(time.time() - process_start)/60:.1f} minutes")
-    client.close()
+    # Base power from the device's POWER_PROFILES cells (hour band and weekday/weekend)
+    power = calendar.profiles.power_block(device, hour, weekday >= 5, draws[:, 0], draws[:, 1])
+    if home is not None:
+        power = power * home.load_scale
+    
+    # Seasonal multipliers, looked up by month number
+    seasonal = np.array([SEASONAL_MULTIPLIERS.get(m, {}).get(device_id, 1.0) for m in range(13)])
+    if home is not None:
+        # Homes follow the seasonal swing more or less strongly depending on region and house
+        seasonal = 1.0 + (seasonal - 1.0) * home.seasonal_scale
+    power = power * seasonal[month]
+    
+    # Holidays and special events
+    holiday_code, holiday_multiplier, event_code, event_multiplier = calendar.block(device, timestamps, hour, home)
+    power = power * holiday_multiplier * event_multiplier
+    return block_columns(device, object_id_block(device, timestamps, home), timestamps, power, draws, holiday_code, event_code, calendar)
+
+def generate_homes_block(device, homes, start_time, step, count, seed, calendar, streams=None):
+    """generate_block for the same `count` readings of a template in several fleet homes
+    
+    The columns hold the homes one after another, exactly as concatenating each home's
+    generate_block would, but every step after the random draws runs once for all homes.
+    streams is a DrawStreams that carries the homes' draw streams over from earlier calls.
+    """
+    timestamps = timestamp_block(start_time, step, count)
+    hour, weekday, month, _ = calendar_fields(timestamps)
+    draws = np.empty((len(homes) * count, RANDOM_DRAWS))
+    for i, home in enumerate(homes):
+        if streams is not None:
+            streams.draws(device, timestamps, step, home, out=draws[i * count:(i + 1) * count])
+        else:
+            draws[i * count:(i + 1) * count] = reading_draws(device, timestamps, step, seed, home)
+    
+    def per_reading(values, dtype=np.float64):
+        return np.repeat(np.array(values, dtype=dtype), count)
+    
+    hour, weekday, month = (np.tile(column, len(homes)) for column in (hour, weekday, month))
+    timestamps = np.tile(timestamps, len(homes))
+    power = calendar.profiles.power_block(device, hour, weekday >= 5, draws[:, 0], draws[:, 1])
+    power = power * per_reading([home.load_scale for home in homes])
+    seasonal = np.array([SEASONAL_MULTIPLIERS.get(m, {}).get(device["id"], 1.0) for m in range(13)])[month]
+    power = power * (1.0 + (seasonal - 1.0) * per_reading([home.seasonal_scale for home in homes]))
+    holiday_code, holiday_multiplier, event_code, event_multiplier = calendar.homes_block(
+        device, timestamps, hour,
+        per_reading([home.event_shift for home in homes], np.int64), per_reading([home.event_mask for home in homes], np.uint8)
+    )
+    power = power * holiday_multiplier * event_multiplier
+    ids = homes_object_ids(device, homes, timestamps[:count])
+    return block_columns(device, ids, timestamps, power, draws, holiday_code, event_code, calendar)
+
+def home_columns(columns, index, count):
+    """The columns of the index-th home of a generate_homes_block block of `count` readings per home"""
+    return column_rows(columns, index * count, (index + 1) * count)
+
+def column_rows(columns, start, end):
+    """Rows start:end of every column of a block"""
+    return {key: None if values is None else values[start:end] for key, values in columns.items()}
+
+def block_columns(device, ids, timestamps, power, draws, holiday_code, event_code, calendar):
+    """The generate_block columns for a block's final power and draws"""
+    device_id = device["id"]
+    
+    # Device-specific metrics (same distributions as apply_device_specific_metrics)
+    power_kw = np.round(power, 3)
+    status_on = power_kw > 0.05
+    if device_id == "HVAC":
+        temperature = 65 + (draws[:, 2] * 16).astype(np.int64)
+    elif device_id == "FRIDGE":
+        temperature = 33 + (draws[:, 2] * 8).astype(np.int64)
+    else:
+        temperature = None
+    runtime_minutes = np.where(status_on, 1 + (draws[:, 3] * 120).astype(np.int64), 0)
+    efficiency = 70 + (draws[:, 4] * 30).astype(np.int64)
+    maintenance_needed = draws[:, 5] < 0.05
+    
+    return {
+        "_id": ids,
+        "timestamp": timestamps,
+        "power_kw": power_kw,
+        "status_on": status_on,
+        "temperature": temperature,
+        "runtime_minutes": runtime_minutes,
+        "efficiency": efficiency,
+        "maintenance_needed": maintenance_needed,
+        "holiday": calendar.holiday_name_array[holiday_code],
+        "holiday_code": holiday_code,
+        "special_event": calendar.event_name_array[event_code],
+        "event_code": event_code,
+    }
+
+def build_documents(device, columns, home=None):
+    """Turn a column block into reading documents; only done at the insert boundary
+    
+    All documents of the block share one metadata dict; nothing downstream modifies it.
+    """
+    metadata = device_metadata(device, home)
+    ids = columns["_id"].tobytes()
+    timestamps = columns["timestamp"].tolist()
+    power_kw = columns["power_kw"].tolist()
+    status_on = columns["status_on"].tolist()
+    temperature = columns["temperature"].tolist() if columns["temperature"] is not None else None
+    runtime_minutes = columns["runtime_minutes"].tolist()
+    efficiency = columns["efficiency"].tolist()
+    maintenance_needed = columns["maintenance_needed"].tolist()
+    holiday = columns["holiday"].tolist()
+    special_event = columns["special_event"].tolist()
+    
+    documents = []
+    for i in range(len(timestamps)):
+        reading = {
+            "_id": ObjectId(ids[12 * i:12 * i + 12]),
+            "metadata": metadata,
+            "timestamp": timestamps[i],
+            "power_kw": power_kw[i],
+            "status": "on" if status_on[i] else "off"
+        }
+        if temperature is not None:
+            reading["temperature"] = temperature[i]
+        reading["runtime_minutes"] = runtime_minutes[i]
+        reading["efficiency"] = efficiency[i]
+        reading["maintenance_needed"] = maintenance_needed[i]
+        if holiday[i]:
+            reading["holiday"] = holiday[i]
+        if special_event[i]:
+            reading["special_event"] = special_event[i]
+        documents.append(reading)
+    
+    return documents
+
+def reading_draws(device, timestamps, step, seed, home=None):
+    """(count, RANDOM_DRAWS) uniforms in [0, 1) for a device's readings at the given timestamps
+    
+    Every (device, UTC day) has its own PCG64 stream derived from the run seed, and a
+    reading takes the RANDOM_DRAWS values at its position within that day's stream. The
+    values depend only on the seed, the device and the timestamp, never on batch sizes,
+    shard boundaries or the number of workers, so any slice can be regenerated alone.
+    """
+    step_us = step // datetime.timedelta(microseconds=1)
+    days = timestamps.astype("datetime64[D]")
+    day_numbers = days.astype(np.int64)
+    positions = (timestamps - days).astype("timedelta64[us]").astype(np.int64) // step_us
+    number = device_number(device, home)
+    
+    draws = np.empty((timestamps.shape[0], RANDOM_DRAWS))
+    # Readings are in time order, so each day is one contiguous run of positions
+    cuts = np.flatnonzero(day_numbers[1:] != day_numbers[:-1]) + 1
+    for first, end in zip(np.r_[0, cuts], np.r_[cuts, timestamps.shape[0]]):
+        # SeedSequence only takes non-negative entropy, so days before 1970 wrap to 32 bits
+        bit_generator = np.random.PCG64(np.random.SeedSequence([seed, number, int(day_numbers[first]) & 0xFFFFFFFF]))
+        bit_generator.advance(int(positions[first]) * RANDOM_DRAWS)
+        draws[first:end] = np.random.Generator(bit_generator).random((end - first, RANDOM_DRAWS))
+    return draws
+
+class DrawStreams:
+    """reading_draws that keep each device's stream open between calls
+    
+    A live feed asks for the next few readings of every (device, home) each tick;
+    continuing the day's stream where the last call stopped saves seeding and
+    advancing a new PCG64 every time. The draws are identical to reading_draws.
+    """
+    
+    def __init__(self, seed):
+        self.seed = seed
+        self._streams = {}  # device number -> (day number, next position, Generator)
+    
+    def draws(self, device, timestamps, step, home=None, out=None):
+        """reading_draws(device, timestamps, step, seed, home), written into `out` when given"""
+        step_us = step // datetime.timedelta(microseconds=1)
+        days = timestamps.astype("datetime64[D]")
+        day_numbers = days.astype(np.int64)
+        positions = (timestamps - days).astype("timedelta64[us]").astype(np.int64) // step_us
+        number = device_number(device, home)
+        if out is None:
+            out = np.empty((timestamps.shape[0], RANDOM_DRAWS))
+        
+        cuts = np.flatnonzero(day_numbers[1:] != day_numbers[:-1]) + 1
+        for first, end in zip(np.r_[0, cuts].tolist(), np.r_[cuts, timestamps.shape[0]].tolist()):
+            day, position = int(day_numbers[first]), int(positions[first])
+            stream = self._streams.get(number)
+            if stream is not None and stream[0] == day and stream[1] == position:
+                generator = stream[2]
+            else:
+                bit_generator = np.random.PCG64(np.random.SeedSequence([self.seed, number, day & 0xFFFFFFFF]))
+                bit_generator.advance(position * RANDOM_DRAWS)
+                generator = np.random.Generator(bit_generator)
+            generator.random(out=out[first:end])
+            self._streams[number] = (day, position + end - first, generator)
+        return out
+
+#################################################
+# RAW BSON BATCH ENCODING
+#################################################
+
+def _element(type_byte, key):
+    """BSON element header: type byte followed by the NUL-terminated key"""
+    return bytes([type_byte]) + key.encode() + b"\x00"
+
+def _string_element(key, value):
+    """Complete BSON string element for a constant key/value pair"""
+    data = value.encode() + b"\x00"
+    return _element(0x02, key) + len(data).to_bytes(4, "little") + data
+
+def _as_bytes(values, dtype):
+    """View a 1-D array as a (n, itemsize) uint8 array in the given little-endian dtype"""
+    values = np.ascontiguousarray(values, dtype=dtype)
+    return values.view(np.uint8).reshape(values.shape[0], values.dtype.itemsize)
+
+class RawBatchEncoder:
+    """Encodes a device's column blocks straight into BSON, producing RawBSONDocuments
+    
+    Produces exactly the bytes bson.encode() would for the dicts from build_documents,
+    but writes every field for the whole batch with array operations into one reused
+    buffer. The metadata subdocument is encoded once per device; in fleet mode one
+    encoder serves a template and set_home() swaps in each home's metadata.
+    """
+    
+    def __init__(self, device, calendar, home=None):
+        self.device = device
+        self.has_temperature = device["id"] in ["HVAC", "FRIDGE"]
+        self.set_home(home)
+        
+        # Fixed-width fields after the status string
+        tail = b""
+        self.tail_fields = []
+        for key, type_byte, dtype in (
+            ("temperature", 0x10, "<i4"),
+            ("runtime_minutes", 0x10, "<i4"),
+            ("efficiency", 0x10, "<i4"),
+            ("maintenance_needed", 0x08, "u1"),
+        ):
+            if key == "temperature" and not self.has_temperature:
+                continue
+            tail += _element(type_byte, key)
+            self.tail_fields.append((key, len(tail), dtype))
+            tail += bytes(np.dtype(dtype).itemsize)
+        self.tail = np.frombuffer(tail, dtype=np.uint8)
+        
+        # Optional holiday / special_event elements, one complete element per calendar code
+        self.holiday_elements = [b""] + [_string_element("holiday", name) for name in calendar.holiday_names[1:]]
+        self.event_elements = [b""] + [_string_element("special_event", name) for name in calendar.event_names[1:]]
+        self.holiday_lengths = np.array([len(e) for e in self.holiday_elements], dtype=np.int64)
+        self.event_lengths = np.array([len(e) for e in self.event_elements], dtype=np.int64)
+        
+        self._buffer = np.empty((0, 0), dtype=np.uint8)
+        self._tail_buffer = np.empty((0, len(self.tail)), dtype=np.uint8)
+        self._home_heads = {}
+    
+    def set_home(self, home):
+        """Encode the metadata subdocument for the device of this home (None outside fleet mode)"""
+        metadata = bson.encode(device_metadata(self.device, home))
+        
+        # Everything from the _id element up to and including the status string length
+        self.head = np.frombuffer(
+            _element(0x07, "_id") + bytes(12)
+            + _element(0x03, "metadata") + metadata
+            + _element(0x09, "timestamp") + bytes(8)
+            + _element(0x01, "power_kw") + bytes(8)
+            + _element(0x02, "status") + bytes(4),
+            dtype=np.uint8
+        )
+        self.id_at = len(_element(0x07, "_id"))
+        self.timestamp_at = self.id_at + 12 + len(_element(0x03, "metadata")) + len(metadata) + len(_element(0x09, "timestamp"))
+        self.power_at = self.timestamp_at + 8 + len(_element(0x01, "power_kw"))
+        self.status_length_at = len(self.head) - 4
+    
+    def home_head(self, home):
+        """The head of this device's documents in one home, encoded on first use"""
+        head = self._home_heads.get(home.index)
+        if head is None:
+            self.set_home(home)
+            head = self._home_heads[home.index] = self.head
+        return head
+    
+    def encode_homes(self, columns, homes):
+        """Encode a generate_homes_block block, giving every home's readings its own metadata
+        
+        Metadata differs in length between regions, so homes whose heads have the same
+        length are encoded together and the documents put back in the block's order.
+        """
+        count = columns["timestamp"].shape[0] // len(homes)
+        heads = [self.home_head(home) for home in homes]
+        groups = {}
+        for i, head in enumerate(heads):
+            groups.setdefault(len(head), []).append(i)
+        documents = [None] * (len(homes) * count)
+        for indexes in groups.values():
+            self.set_home(homes[indexes[0]])
+            rows = (np.asarray(indexes)[:, None] * count + np.arange(count)).ravel()
+            group_columns = {key: None if values is None else values[rows] for key, values in columns.items()}
+            group_heads = np.repeat(np.stack([heads[i] for i in indexes]), count, axis=0)
+            for row, document in zip(rows.tolist(), self.encode(group_columns, group_heads)):
+                documents[row] = document
+        return documents
+    
+    def encode(self, columns, heads=None):
+        """Encode a column block into a list of RawBSONDocuments
+        
+        heads optionally gives every document its own head (see encode_homes); they must
+        all have the length of the current one.
+        """
+        count = columns["timestamp"].shape[0]
+        status_on = columns["status_on"]
+        holiday_code = columns["holiday_code"]
+        event_code = columns["event_code"]
+        
+        # Per-document lengths: 4-byte size + head + "on\0"/"off\0" + tail + optional strings + terminator
+        status_length = np.where(status_on, 3, 4)
+        lengths = 4 + len(self.head) + status_length + len(self.tail) + self.holiday_lengths[holiday_code] + self.event_lengths[event_code] + 1
+        
+        # Each document is laid out in one row of a padded 2-D buffer; rows are compacted at the end
+        width = 4 + len(self.head) + 4 + len(self.tail) + self.holiday_lengths.max() + self.event_lengths.max() + 1
+        allocated_rows, allocated_width = self._buffer.shape
+        if allocated_rows < count or allocated_width < width:
+            if allocated_rows < count:
+                allocated_rows = max(count, 2 * allocated_rows)
+            self._buffer = np.empty((allocated_rows, max(width, allocated_width)), dtype=np.uint8)
+        rows = self._buffer[:count, :width]
+        rows[:] = 0
+        
+        # Document size, constant head and the variable fields inside it
+        rows[:, 0:4] = _as_bytes(lengths, "<i4")
+        head = rows[:, 4:4 + len(self.head)]
+        head[:] = self.head if heads is None else heads
+        head[:, self.id_at:self.id_at + 12] = columns["_id"]
+        milliseconds = columns["timestamp"].astype("datetime64[ms]").astype(np.int64)
+        head[:, self.timestamp_at:self.timestamp_at + 8] = _as_bytes(milliseconds, "<i8")
+        head[:, self.power_at:self.power_at + 8] = _as_bytes(columns["power_kw"], "<f8")
+        head[:, self.status_length_at:self.status_length_at + 4] = _as_bytes(status_length, "<i4")
+        
+        # Fixed-width tail fields, assembled separately because their offset depends on the status string
+        if self._tail_buffer.shape[0] < count:
+            self._tail_buffer = np.empty((max(count, 2 * self._tail_buffer.shape[0]), len(self.tail)), dtype=np.uint8)
+        tail = self._tail_buffer[:count]
+        tail[:] = self.tail
+        for key, offset, dtype in self.tail_fields:
+            tail[:, offset:offset + np.dtype(dtype).itemsize] = _as_bytes(columns[key], dtype)
+        
+        # Status string, tail and optional holiday/event strings, per distinct (status, holiday, event) shape
+        shapes = status_on.astype(np.int64) * 1_000_000 + holiday_code.astype(np.int64) * 1000 + event_code
+        for shape in np.unique(shapes):
+            mask = shapes == shape
+            holiday = self.holiday_elements[shape // 1000 % 1000]
+            event = self.event_elements[shape % 1000]
+            status = b"on\x00" if shape >= 1_000_000 else b"off\x00"
+            position = 4 + len(self.head)
+            rows[mask, position:position + len(status)] = np.frombuffer(status, dtype=np.uint8)
+            position += len(status)
+            rows[mask, position:position + len(self.tail)] = tail[mask]
+            position += len(self.tail)
+            for element in (holiday, event):
+                if element:
+                    rows[mask, position:position + len(element)] = np.frombuffer(element, dtype=np.uint8)
+                    position += len(element)
+        
+        # Drop the padding (terminators are already zero) and slice out each document
+        data = rows[np.arange(width) < lengths[:, None]].tobytes()
+        ends = np.cumsum(lengths).tolist()
+        return [RawBSONDocument(data[start:end]) for start, end in zip([0] + ends[:-1], ends)]
+
+#################################################
+# METRICS
+#################################################
+
+# Histogram bucket upper bounds: seconds for timings, batches for queue depth
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+class Histogram:
+    """Prometheus-style cumulative-bucket histogram that can be merged across processes"""
+    
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def merge(self, state):
+        for i, count in enumerate(state["counts"]):
+            self.counts[i] += count
+        self.sum += state["sum"]
+        self.count += state["count"]
+    
+    def state(self):
+        return {"bounds": list(self.bounds), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+    
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that contains it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+class MetricsRegistry:
+    """Counters, gauges and histograms keyed by metric name and labels"""
+    
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+    
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+    
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+    
+    def drain(self):
+        """Return everything recorded since the last drain and reset (worker processes ship this to the parent)"""
+        with self._lock:
+            state = {
+                "counters": list(self.counters.items()),
+                "gauges": list(self.gauges.items()),
+                "histograms": [(key, histogram.state()) for key, histogram in self.histograms.items()]
+            }
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+        return state
+    
+    def merge(self, state):
+        """Fold a drained state from a worker process into this registry"""
+        with self._lock:
+            for key, value in state["counters"]:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, value in state["gauges"]:
+                self.gauges[key] = value
+            for key, histogram_state in state["histograms"]:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram_state["bounds"])
+                self.histograms[key].merge(histogram_state)
+    
+    def total_histogram(self, name):
+        """One histogram merged over every label set of a metric"""
+        with self._lock:
+            total = None
+            for (metric, _), histogram in self.histograms.items():
+                if metric == name:
+                    if total is None:
+                        total = Histogram(histogram.bounds)
+                    total.merge(histogram.state())
+        return total
+    
+    def counter_values(self, name):
+        """{labels: value} for one counter"""
+        with self._lock:
+            return {labels: value for (metric, labels), value in self.counters.items() if metric == name}
+    
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format"""
+        def render_labels(labels, extra=()):
+            # Label values escape backslash, double quote and newline, as the text format requires
+            pairs = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in list(labels) + list(extra)]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+        
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({metric for metric, _ in metrics}):
+                    lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+                    for (metric, labels), value in sorted(metrics.items()):
+                        if metric == name:
+                            lines.append(f"{METRICS_PREFIX}{name}{render_labels(labels)} {value}")
+            for name in sorted({metric for metric, _ in self.histograms}):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{METRICS_PREFIX}{name}_bucket{render_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{METRICS_PREFIX}{name}_sum{render_labels(labels)} {histogram.sum}")
+                    lines.append(f"{METRICS_PREFIX}{name}_count{render_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self):
+        """JSON-friendly view: counters, gauges and p50/p95/p99 for every histogram"""
+        def name_of(metric, labels):
+            return metric + "".join(f"{{{k}={v}}}" for k, v in labels)
+        
+        with self._lock:
+            histograms = list(self.histograms.items())
+            snapshot = {
+                "counters": {name_of(*key): value for key, value in self.counters.items()},
+                "gauges": {name_of(*key): value for key, value in self.gauges.items()}
+            }
+        snapshot["histograms"] = {
+            name_of(*key): {
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "p50": histogram.quantile(0.50),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99)
+            }
+            for key, histogram in histograms
+        }
+        return snapshot
+
+# This process's registry. Worker processes drain theirs to the parent's over the progress queue.
+METRICS = MetricsRegistry()
+
+def push_metrics(progress_queue):
+    """Ship this worker process's metrics recorded since the last push to the parent"""
+    state = METRICS.drain()
+    if state["counters"] or state["gauges"] or state["histograms"]:
+        progress_queue.put(("metrics", state))
+
+def metrics_pusher(progress_queue):
+    """Background loop in each worker process pushing metrics every METRICS_PUSH_SECONDS"""
+    while True:
+        time.sleep(METRICS_PUSH_SECONDS)
+        push_metrics(progress_queue)
+
+def format_latency(histogram):
+    """p50/p95/p99 of a latency histogram in milliseconds"""
+    if histogram is None or not histogram.count:
+        return "n/a"
+    return ", ".join(f"p{int(q * 100)} {histogram.quantile(q) * 1000:.1f} ms" for q in (0.50, 0.95, 0.99))
+
+class MetricsExporter:
+    """Publishes the parent registry as a Prometheus /metrics endpoint and/or a JSONL file"""
+    
+    def __init__(self, port=None, path=None, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_time = time.time()
+        self._last_docs = {}
+        
+        if port:
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(handler):
+                    if handler.path.rstrip("/") not in ("", "/metrics"):
+                        handler.send_error(404)
+                        return
+                    body = METRICS.prometheus_text().encode()
+                    handler.send_response(200)
+                    handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                    handler.send_header("Content-Length", str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+                
+                def log_message(handler, *args):
+                    pass
+            
+            self.server = http.server.ThreadingHTTPServer(("", port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Metrics: http://localhost:{port}/metrics")
+        
+        if path:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+            print(f"Metrics: appending to {path} every {interval:g}s")
+    
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_record()
+    
+    def write_record(self):
+        """Append one JSON line: the registry snapshot plus per-device docs/sec since the last line"""
+        now = time.time()
+        docs = {dict(labels).get("device", ""): value for labels, value in METRICS.counter_values("documents_inserted_total").items()}
+        seconds = now - self._last_time
+        record = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": round(now - process_start, 3),
+            "docs_per_second": {
+                device: round((value - self._last_docs.get(device, 0)) / seconds, 1) if seconds > 0 else 0.0
+                for device, value in docs.items()
+            }
+        }
+        record.update(METRICS.snapshot())
+        self._last_time = now
+        self._last_docs = docs
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    
+    def close(self):
+        """Write a final record and stop serving"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.write_record()
+        if self.server:
+            self.server.shutdown()
+
+#################################################
+# PROFILING
+#################################################
+
+def interpreter_start_time():
+    """Wall-clock time this process started, from /proc (None where that is not available)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is starttime in clock ticks after boot; the command name before it may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+
+def memory_usage():
+    """(current, peak) resident set size in bytes; without /proc only the peak is known (from resource)"""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if line.startswith(("VmRSS", "VmHWM")))
+        return int(fields["VmRSS"].split()[0]) * 1024, int(fields["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return None, peak if sys.platform == "darwin" else peak * 1024
+
+def format_bytes(value):
+    """Megabytes for the profile summary ("?" when unknown)"""
+    return f"{value / 1e6:,.1f} MB" if value is not None else "?"
+
+class Profiler:
+    """Startup phase timings, per-batch memory samples and cProfile stats of one process (--profile)
+    
+    Phases are seconds since the interpreter started (read from /proc, so they include the
+    imports before this module ran; seconds since the module finished importing elsewhere)
+    and only the first time a phase is reached counts. Every inserted batch adds a sample
+    of RSS and Python's allocated block count, plus the bytes tracemalloc traces when it
+    runs (it is opt-in because it slows every allocation, phases included). With cProfile
+    each shard's generation loop is profiled on its own thread and dumped next to the report
+    for the parent to merge.
+    """
+    
+    SAMPLE_FIELDS = ("seconds", "documents", "rss_bytes", "traced_bytes", "allocated_blocks")
+    
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.report_path = None
+        self.started = None
+        self.phases = {}
+        self.samples = []
+        self.documents = 0
+        self.rss_at_start = None
+        self.workers = {}  # pid -> state() of a worker process (parent only)
+        self._stride = 1
+        self._pending = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def parts_directory(self):
+        """Where shards dump their cProfile stats until the parent merges them"""
+        return f"{os.path.splitext(self.report_path)[0]}.prof.parts"
+    
+    def start(self, report_path, cprofile=False, trace=False):
+        """Turn profiling on for this process (tracemalloc only sees allocations from here on)"""
+        self.enabled = True
+        self.cprofile = cprofile
+        self.report_path = report_path
+        self.started = interpreter_start_time() or process_start
+        self.rss_at_start = memory_usage()[0]
+        if trace:
+            tracemalloc.start()
+        self.mark("imports", process_start)
+    
+    def mark(self, phase, at=None):
+        """Record when a phase was first reached"""
+        if self.enabled:
+            self.phases.setdefault(phase, round((at or time.time()) - self.started, 4))
+    
+    def sample(self, documents):
+        """Record memory after an inserted batch of `documents`"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.documents += documents
+            self._pending += 1
+            if self._pending < self._stride:
+                return
+            self._pending = 0
+            self.samples.append((
+                round(time.time() - self.started, 3),
+                self.documents,
+                memory_usage()[0],
+                tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+                sys.getallocatedblocks()
+            ))
+            if len(self.samples) >= PROFILE_MAX_SAMPLES:
+                # Keep every other sample and halve the sampling rate, so a long run stays bounded
+                del self.samples[1::2]
+                self._stride *= 2
+    
+    def shard_profile(self):
+        """A running cProfile.Profile for the calling thread's shard loop, or None"""
+        if not (self.enabled and self.cprofile):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process: other shards run unprofiled
+            return None
+        return profile
+    
+    def save_shard_profile(self, profile, shard):
+        """Stop a shard's profiler and dump its stats for the parent to merge"""
+        profile.disable()
+        os.makedirs(self.parts_directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.parts_directory, f"{os.getpid()}-{shard_key(shard)}.prof"))
+    
+    def state(self):
+        """This process's phases and memory, as shipped from a worker process to the parent"""
+        rss, peak_rss = memory_usage()
+        traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        with self._lock:
+            samples = list(self.samples)
+        return {
+            "pid": os.getpid(),
+            "interpreter_start_known": self.started != process_start,
+            "phases": dict(self.phases),
+            "documents": self.documents,
+            "memory": {
+                "rss_at_start_bytes": self.rss_at_start,
+                "rss_bytes": rss,
+                "peak_rss_bytes": peak_rss,
+                "traced_bytes": traced,
+                "traced_peak_bytes": traced_peak,
+                "allocated_blocks": sys.getallocatedblocks(),
+                "sample_fields": list(self.SAMPLE_FIELDS),
+                "samples": samples
+            }
+        }
+
+# This process's profiler; started by main and by each worker process when --profile is given
+PROFILER = Profiler()
+
+def push_profile(progress_queue):
+    """Ship this worker process's profile so far to the parent"""
+    if PROFILER.enabled:
+        progress_queue.put(("profile", PROFILER.state()))
+
+def top_allocations():
+    """The allocation sites holding the most traced memory right now (none without tracemalloc)"""
+    if not tracemalloc.is_tracing():
+        return []
+    statistics = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]
+    return [
+        {"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size_bytes": stat.size, "blocks": stat.count}
+        for stat in statistics
+    ]
+
+def merge_cprofile_stats():
+    """Merge the shards' cProfile dumps into <report>.prof; returns (path, top functions) or (None, [])"""
+    directory = PROFILER.parts_directory
+    parts = sorted(os.path.join(directory, name) for name in os.listdir(directory)) if os.path.isdir(directory) else []
+    if not parts:
+        return None, []
+    stats = pstats.Stats(*parts)
+    path = f"{os.path.splitext(PROFILER.report_path)[0]}.prof"
+    stats.dump_stats(path)
+    shutil.rmtree(directory)
+    stats.sort_stats("cumulative")
+    functions = []
+    for function in stats.fcn_list[:PROFILE_TOP_FUNCTIONS]:
+        _, calls, total_time, cumulative_time, _ = stats.stats[function]
+        functions.append({
+            "function": f"{function[0]}:{function[1]}({function[2]})",
+            "calls": calls,
+            "tottime": round(total_time, 4),
+            "cumtime": round(cumulative_time, 4)
+        })
+    return path, functions
+
+def write_profile_report(settings, documents, load_seconds=None):
+    """Write the --profile report (this process plus every worker process) and print its summary"""
+    PROFILER.mark("done")
+    report = PROFILER.state()
+    report.update({
+        "command": sys.argv,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpu_count": os.cpu_count(),
+        "mode": settings["execution_mode"],
+        "workers": settings["workers"],
+        "engine": settings["engine"],
+        "sink": settings["sink"],
+        "documents": documents,
+        "load_seconds": load_seconds,
+        "docs_per_second": documents / load_seconds if load_seconds else None,
+        "top_allocations": top_allocations()
+    })
+    report["worker_processes"] = {str(pid): state for pid, state in sorted(PROFILER.workers.items())}
+    stats_path, functions = merge_cprofile_stats()
+    if stats_path:
+        report["cprofile"] = {"stats_file": stats_path, "top_functions": functions}
+    try:
+        with open(PROFILER.report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        print(f"Warning: could not write the profile report: {e}")
+        return
+    
+    origin = "process start" if report["interpreter_start_known"] else "module import"
+    print(f"\nProfile (seconds since {origin}): " + ", ".join(f"{phase.replace('_', ' ')} {seconds:.3f}" for phase, seconds in report["phases"].items()))
+    memory = report["memory"]
+    print(f"  Memory: RSS {format_bytes(memory['rss_at_start_bytes'])} at start, {format_bytes(memory['rss_bytes'])} at end, "
+          f"{format_bytes(memory['peak_rss_bytes'])} peak" + (f"; traced peak {format_bytes(memory['traced_peak_bytes'])}" if memory["traced_peak_bytes"] is not None else ""))
+    if PROFILER.workers:
+        peaks = [state["memory"]["peak_rss_bytes"] or 0 for state in PROFILER.workers.values()]
+        first_batches = [state["phases"]["first_batch_inserted"] for state in PROFILER.workers.values() if "first_batch_inserted" in state["phases"]]
+        print(f"  Worker processes: {len(peaks)}, peak RSS up to {format_bytes(max(peaks))}"
+              + (f", first batch inserted {min(first_batches):.3f}-{max(first_batches):.3f}s after their start" if first_batches else ""))
+    print(f"  Report: {PROFILER.report_path}" + (f" (cProfile stats: {stats_path})" if stats_path else ""))
+
+#################################################
+# TIME SERIES BUCKETS
+#################################################
+
+def timeseries_bucketing(settings):
+    """(bucketMaxSpanSeconds, bucketRoundingSeconds) the collection's buckets follow"""
+    if settings["granularity"] == "custom":
+        return settings["bucket_span_seconds"], settings["bucket_span_seconds"]
+    return GRANULARITY_BUCKETING[settings["granularity"]]
+
+def timeseries_options(settings):
+    """The timeseries option of create_collection for the resolved bucketing settings"""
+    options = {"timeField": "timestamp", "metaField": "metadata"}
+    if settings["granularity"] == "custom":
+        options["bucketMaxSpanSeconds"] = settings["bucket_span_seconds"]
+        options["bucketRoundingSeconds"] = settings["bucket_span_seconds"]
+    else:
+        options["granularity"] = settings["granularity"]
+    return options
+
+def existing_bucketing(database, collection_name):
+    """(granularity, bucket span) of an existing time series collection, or None"""
+    for collection in database.list_collections(filter={"name": collection_name}):
+        timeseries = collection.get("options", {}).get("timeseries")
+        if not timeseries:
+            return None
+        if "granularity" in timeseries:
+            return timeseries["granularity"], None
+        return "custom", timeseries["bucketMaxSpanSeconds"]
+    return None
+
+def choose_bucketing(interval_seconds, device_count, measurement_bytes, custom_spans=True):
+    """Pick the bucketing for a load; returns (granularity, custom span or None, reason)
+    
+    Buckets should fill up to their count/size limit before their time span runs out,
+    so the choice is the finest granularity whose span holds a full bucket of one
+    series' readings (a custom span when even "hours" is too short). Every series also
+    keeps a bucket open in the server's catalog, so with many devices the planned fill
+    is lowered (to no less than MIN_BUCKET_FILL of capacity) until those open buckets
+    fit in BUCKET_CATALOG_BUDGET_BYTES, which can select a finer granularity.
+    """
+    capacity = bucket_capacity(measurement_bytes)
+    target = capacity
+    reason = f"span holds a full bucket ({capacity} readings)"
+    per_series = BUCKET_CATALOG_BUDGET_BYTES // (device_count * measurement_bytes)
+    if per_series < capacity:
+        target = max(int(capacity * MIN_BUCKET_FILL), per_series)
+        reason = f"span holds {target} readings to limit the bucket catalog for {device_count:,} devices"
+    
+    for name, (span, _) in GRANULARITY_BUCKETING.items():
+        if span // interval_seconds >= target:
+            return name, None, reason
+    if custom_spans:
+        span = min(MAX_BUCKET_SPAN_SECONDS, -(-interval_seconds * target // 86400) * 86400)
+        return "custom", span, f"{interval_seconds}s readings need a {span // 86400}-day span to fill {target} readings"
+    return list(GRANULARITY_BUCKETING)[-1], None, "coarsest granularity; the server does not support custom bucket spans"
+
+def resolve_bucketing(settings, devices, device_count, server_version=None, existing=None):
+    """Settle settings["granularity"] (and bucket span) for the run; returns why it was chosen
+    
+    An existing collection keeps its own bucketing, an explicit setting is used as
+    given, and "auto" goes through choose_bucketing. server_version is None when there
+    is no server (dry runs), in which case custom spans are assumed to be available.
+    """
+    if existing:
+        settings["granularity"], settings["bucket_span_seconds"] = existing
+        return "existing collection"
+    if settings["granularity"] != "auto":
+        return "set explicitly"
+    custom_spans = server_version is None or server_version >= CUSTOM_BUCKETING_VERSION
+    measurement_bytes = max(measurement_size(device) for device in devices)
+    settings["granularity"], settings["bucket_span_seconds"], reason = choose_bucketing(
+        settings["interval_seconds"], device_count, measurement_bytes, custom_spans
+    )
+    return reason
+
+def describe_bucketing(settings):
+    """One-line description of the resolved bucketing"""
+    span, rounding = timeseries_bucketing(settings)
+    name = settings["granularity"]
+    return f"{name} (bucketMaxSpanSeconds {span:,}, rounding {rounding:,})"
+
+def create_secondary_indexes(collection):
+    """Index metadata.device_id + timestamp; run after the load so inserts do not maintain it; returns seconds"""
+    started = time.perf_counter()
+    collection.create_index([("metadata.device_id", 1), ("timestamp", 1)])
+    return time.perf_counter() - started
+
+def measurement_size(device):
+    """BSON bytes one reading adds to a bucket (everything but the metadata, which buckets store once)"""
+    measurement = {
+        "_id": ObjectId(),
+        "timestamp": datetime.datetime(2024, 1, 1),
+        "power_kw": 0.0,
+        "status": "off"
+    }
+    if device["id"] in ["HVAC", "FRIDGE"]:
+        measurement["temperature"] = 0
+    measurement.update({"runtime_minutes": 0, "efficiency": 0, "maintenance_needed": False})
+    return len(bson.encode(measurement))
+
+def bucket_capacity(measurement_bytes):
+    """Most readings a bucket takes before the server closes it for count or size"""
+    return max(1, min(BUCKET_MAX_COUNT, BUCKET_MAX_BYTES // measurement_bytes))
+
+class BucketAligner:
+    """Chooses batch lengths that end exactly where the server will close a series' bucket
+    
+    A series written in time order fills one bucket at a time: the bucket opened by a
+    reading covers [reading rounded down to bucketRoundingSeconds, + bucketMaxSpanSeconds)
+    and closes early once it holds bucket_capacity readings. Cutting batches on those
+    boundaries means concurrent writers never split a bucket, so a batch that overtakes
+    its predecessor cannot close and reopen the bucket the earlier batch is still filling.
+    """
+    
+    def __init__(self, step, bucketing, measurement_bytes):
+        self.step_seconds = step.total_seconds()
+        self.max_span, self.rounding = bucketing
+        self.capacity = bucket_capacity(measurement_bytes)
+    
+    def bucket_length(self, timestamp):
+        """Readings in the bucket opened by a reading at `timestamp`"""
+        seconds = calendar_module.timegm(timestamp.timetuple())
+        closes = seconds - seconds % self.rounding + self.max_span
+        return min(self.capacity, -(-(closes - seconds) // self.step_seconds))
+    
+    def count(self, start_time, target, available):
+        """Whole buckets' worth of readings closest to `target` (at least one bucket), at most `available`"""
+        step = datetime.timedelta(seconds=self.step_seconds)
+        count = 0
+        while count < available:
+            length = int(self.bucket_length(start_time + step * count))
+            if count and count + length > target:
+                break
+            count += length
+        return min(count, available)
+
+class BucketTracker:
+    """Client-side model of the server's bucket catalog, fed with batches in arrival order
+    
+    Keeps one open bucket per series and counts a new bucket whenever a reading falls
+    outside it in time or the bucket is full, which is what the server does. Used to
+    report buckets opened per 1000 documents without asking the server. A batch may
+    hold late readings after its on-time ones (--disorder); each reading that goes back
+    in time before the open bucket opens another.
+    """
+    
+    def __init__(self, bucketing):
+        self.max_span, self.rounding = bucketing
+        self._open = {}  # series -> [min_seconds, closes_seconds, count, capacity]
+        self._lock = threading.Lock()
+    
+    def observe(self, series):
+        """Record a batch's (series key, timestamp seconds, measurement bytes); returns buckets opened"""
+        key, seconds, measurement_bytes = series
+        capacity = bucket_capacity(measurement_bytes)
+        opened = 0
+        # Ends of the batch's runs of readings in time order (one run unless readings arrive late)
+        run_ends = np.r_[np.flatnonzero(seconds[1:] < seconds[:-1]) + 1, len(seconds)]
+        with self._lock:
+            bucket = self._open.get(key)
+            i = 0
+            while i < len(seconds):
+                first = int(seconds[i])
+                if bucket is None or first < bucket[0] or first >= bucket[1] or bucket[2] >= bucket[3]:
+                    minimum = first - first % self.rounding
+                    bucket = [minimum, minimum + self.max_span, 0, capacity]
+                    opened += 1
+                # Within a run readings are in time order, so the ones that fit are a prefix of it
+                run_end = int(run_ends[np.searchsorted(run_ends, i, side="right")])
+                end = min(run_end, i + bucket[3] - bucket[2], i + int(np.searchsorted(seconds[i:run_end], bucket[1])))
+                end = max(end, i + 1)
+                bucket[2] += end - i
+                i = end
+            self._open[key] = bucket
+        return opened
+
+def bucket_stats(database, collection_name):
+    """Server-side bucket and storage statistics of a time series collection, or None"""
+    try:
+        stats = next(database[collection_name].aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+    except (PyMongoError, StopIteration, KeyError):
+        return None
+    timeseries = stats.get("timeseries", {})
+    return {
+        "bucket_count": timeseries.get("bucketCount", 0),
+        "buckets_opened": timeseries.get("numBucketInserts", 0),
+        "measurements": timeseries.get("numMeasurementsCommitted", 0),
+        "closed_for_count": timeseries.get("numBucketsClosedDueToCount", 0),
+        "closed_for_size": timeseries.get("numBucketsClosedDueToSize", 0),
+        "closed_for_time": timeseries.get("numBucketsClosedDueToTimeForward", 0) + timeseries.get("numBucketsClosedDueToTimeBackward", 0),
+        "size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "index_size": stats.get("totalIndexSize", 0)
+    }
+
+def print_bucket_report(before, after):
+    """Print the change in server bucket statistics over the load"""
+    if after is None:
+        print("Server bucket statistics unavailable ($collStats failed)")
+        return
+    before = before or dict.fromkeys(after, 0)
+    opened = after["buckets_opened"] - before["buckets_opened"]
+    measurements = after["measurements"] - before["measurements"]
+    if measurements:
+        print(f"Server buckets opened per 1000 docs: {opened / measurements * 1000:.2f} ({opened:,} buckets for {measurements:,} measurements)")
+    print(f"  Closed for count: {after['closed_for_count'] - before['closed_for_count']:,}, "
+          f"size: {after['closed_for_size'] - before['closed_for_size']:,}, "
+          f"time: {after['closed_for_time'] - before['closed_for_time']:,}")
+    print(f"  Collection: {after['bucket_count']:,} buckets, {after['size'] / 1e6:.1f} MB data, "
+          f"{after['storage_size'] / 1e6:.1f} MB on disk, {after['index_size'] / 1e6:.1f} MB indexes")
+
+#################################################
+# DISORDERED DELIVERY
+#################################################
+
+class ReorderBuffer:
+    """Holds back a shard's late readings and releases them out of order, like devices on a flaky uplink
+    
+    Of every producer batch, late_fraction of the readings are held for up to max_lateness
+    seconds and everything a series generates during one of its simulated outages
+    (outages_per_day on average, outage_minutes long) is held until the outage ends. Held
+    readings go out after the on-time readings of the first later batch of their series
+    whose newest timestamp is past their release time, so an outage's backlog arrives in
+    one burst and the server sees readings older than the buckets it has open. A series
+    holds at most `capacity` readings; past that the ones due soonest are released early.
+    The decisions come from a PCG64 stream of the run seed and the shard.
+    """
+    
+    def __init__(self, profile, capacity, step, seed, key, start_date):
+        self.late_fraction = profile["late_fraction"]
+        self.step_seconds = step.total_seconds()
+        self.max_lateness = max(self.step_seconds, profile["max_lateness"])
+        self.outage_gap = 86400 / profile["outages_per_day"] if profile["outages_per_day"] else None
+        self.outage_seconds = profile["outage_minutes"] * 60
+        self.capacity = capacity
+        # Nothing stays held longer than this, so a checkpoint this far behind a batch is safe
+        self.hold = datetime.timedelta(seconds=self.max_lateness + self.outage_seconds)
+        self.step = step
+        self.first_checkpoint = start_date - step
+        self.checkpoint = self.first_checkpoint
+        self.last_time = self.first_checkpoint
+        self.random = np.random.Generator(np.random.PCG64(np.random.SeedSequence([seed, *key.encode()])))
+        self._held = {}     # series key -> heap of (release seconds, timestamp seconds, order, document)
+        self._outages = {}  # series key -> (start, end) seconds of its current or next outage
+        self._series = {}   # series key -> (device_id, measurement bytes) for the batches that drain it
+        self._order = itertools.count()
+    
+    def _next_outage(self, after):
+        start = after + self.random.exponential(self.outage_gap)
+        return start, start + self.outage_seconds
+    
+    def _outage(self, key, seconds, release):
+        """Mask of the readings inside the series' outages (their release set to the outage end) and when it went offline, if it is now"""
+        inside = np.zeros(len(seconds), dtype=bool)
+        if self.outage_gap is None or not self.outage_seconds:
+            return inside, None
+        start, end = self._outages.get(key) or self._next_outage(seconds[0])
+        while start <= seconds[-1]:
+            window = (seconds >= start) & (seconds < end)
+            inside |= window
+            release[window] = end
+            if end > seconds[-1]:
+                break
+            start, end = self._next_outage(end)
+        self._outages[key] = start, end
+        return inside, start if start <= seconds[-1] < end else None
+    
+    def deliver(self, batch, current_time, device_id, series):
+        """The (batch, checkpoint_timestamp, device_id, series) to submit for a producer batch, or None if all of it is held"""
+        key, seconds, measurement_bytes = series
+        self._series[key] = device_id, measurement_bytes
+        now = seconds[-1]
+        late = self.random.random(len(seconds)) < self.late_fraction
+        release = seconds + self.random.uniform(self.step_seconds, self.max_lateness, len(seconds))
+        outage, offline_since = self._outage(key, seconds, release)
+        held = late | outage
+        heap = self._held.setdefault(key, [])
+        if held.any():
+            for i in np.flatnonzero(held).tolist():
+                heapq.heappush(heap, (float(release[i]), int(seconds[i]), next(self._order), batch[i]))
+            batch = list(itertools.compress(batch, (~held).tolist()))
+            seconds = seconds[~held]
+            METRICS.inc("late_readings_total", int((late & ~outage).sum()), device=device_id)
+            METRICS.inc("outage_readings_total", int(outage.sum()), device=device_id)
+        
+        # Everything due goes out after the on-time readings; an offline series only sends what came due before it went down
+        due = now if offline_since is None else min(now, offline_since)
+        released = []
+        while heap and (heap[0][0] <= due or len(heap) > self.capacity):
+            if heap[0][0] > due:
+                METRICS.inc("reorder_overflow_total", device=device_id)
+            released.append(heapq.heappop(heap))
+        METRICS.set("reorder_buffer_readings", sum(len(entries) for entries in self._held.values()), device=device_id)
+        if released:
+            batch = batch + [entry[3] for entry in released]
+            seconds = np.concatenate([seconds, np.array([entry[1] for entry in released], dtype=np.int64)])
+        if not batch:
+            return None
+        
+        self.last_time = max(self.last_time, current_time)
+        self.checkpoint = max(self.checkpoint, current_time - self.hold)
+        return batch, self.checkpoint, device_id, (key, seconds, measurement_bytes)
+    
+    def drain(self):
+        """Yield every still-held reading, one batch per series in release order, once the producer is done
+        
+        Only the last of these batches moves the checkpoint to the end of the shard.
+        """
+        remaining = [key for key, heap in self._held.items() if heap]
+        for i, key in enumerate(remaining):
+            heap = self._held[key]
+            entries = [heapq.heappop(heap) for _ in range(len(heap))]
+            device_id, measurement_bytes = self._series[key]
+            checkpoint_time = self.last_time if i == len(remaining) - 1 else self.checkpoint
+            series = key, np.array([entry[1] for entry in entries], dtype=np.int64), measurement_bytes
+            yield [entry[3] for entry in entries], checkpoint_time, device_id, series
+
+def disordered_batches(batches, buffer):
+    """Pass a producer's batches through a ReorderBuffer, then drain it
+    
+    Reordered batches mix readings of several producer blocks, so they carry no blocks.
+    """
+    for batch, current_time, device_id, series, _ in batches:
+        delivered = buffer.deliver(batch, current_time, device_id, series)
+        if delivered is not None:
+            yield (*delivered, None)
+    for delivered in buffer.drain():
+        yield (*delivered, None)
+
+def describe_disorder(profile, capacity):
+    """One-line summary of a disorder profile for the plan"""
+    late = f"{profile['late_fraction']:.0%} late by up to {profile['max_lateness']:g}s" if profile["late_fraction"] else "none late"
+    if profile["outages_per_day"] and profile["outage_minutes"]:
+        outages = f"{profile['outages_per_day']:g} outages/day of {profile['outage_minutes']:g} min"
+    else:
+        outages = "no outages"
+    return f"{late}, {outages}, reorder buffer {capacity:,} per device"
+
+#################################################
+# BATCH PRODUCERS AND INSERT WORKERS
+#################################################
+
+def batch_series(key, timestamps, measurement_bytes):
+    """The (series key, timestamp seconds, measurement bytes) a batch carries for BucketTracker"""
+    return key, timestamps.astype("datetime64[s]").astype(np.int64), measurement_bytes
+
+def scalar_readings(device, start_date, end_date, step, calendar, seed):
+    """Lazily yield a device's readings in time order, one generate_reading call each
+    
+    Timestamps and random draws are prepared SCALAR_CHUNK readings at a time, so the
+    stream holds the same small amount of memory however long the date range is.
+    """
+    current_time = start_date
+    while current_time <= end_date:
+        count = min(SCALAR_CHUNK, (end_date - current_time) // step + 1)
+        timestamps = timestamp_block(current_time, step, count)
+        draws = reading_draws(device, timestamps, step, seed).tolist()
+        for timestamp, row in zip(timestamps.tolist(), draws):
+            yield generate_reading(device, timestamp, calendar, row)
+        current_time += step * count
+
+def scalar_batches(device, start_date, end_date, step, sizer, calendar, seed, bucketing=None):
+    """Yield (batch, last_timestamp, device_id, series, None) cut from the scalar_readings stream"""
+    measurement_bytes = measurement_size(device)
+    aligner = BucketAligner(step, bucketing, measurement_bytes) if bucketing else None
+    readings = scalar_readings(device, start_date, end_date, step, calendar, seed)
+    current_time = start_date
+    while current_time <= end_date:
+        available = (end_date - current_time) // step + 1
+        count = aligner.count(current_time, sizer.target(), available) if aligner else min(sizer.target(), available)
+        started = time.perf_counter()
+        batch = list(itertools.islice(readings, count))
+        METRICS.observe("generation_seconds", time.perf_counter() - started, device=device["id"])
+        timestamps = timestamp_block(current_time, step, count)
+        current_time += step * count
+        yield batch, current_time - step, device["id"], batch_series(device["id"], timestamps, measurement_bytes), None
+
+def vectorized_batches(device, start_date, end_date, step, sizer, calendar, seed, encoding="raw", bucketing=None, rollups=False):
+    """Yield (batch, last_timestamp, device_id, series, blocks) generated one NumPy block per batch
+    
+    With rollups, blocks is [(metadata, columns)] for RollupAccumulator.add_blocks; otherwise None.
+    """
+    encoder = RawBatchEncoder(device, calendar) if encoding == "raw" else None
+    measurement_bytes = measurement_size(device)
+    aligner = BucketAligner(step, bucketing, measurement_bytes) if bucketing else None
+    current_time = start_date
+    while current_time <= end_date:
+        available = (end_date - current_time) // step + 1
+        count = aligner.count(current_time, sizer.target(), available) if aligner else min(sizer.target(), available)
+        started = time.perf_counter()
+        columns = generate_block(device, current_time, step, count, seed, calendar)
+        generated = time.perf_counter()
+        current_time += step * count
+        documents = encoder.encode(columns) if encoder else build_documents(device, columns)
+        METRICS.observe("generation_seconds", generated - started, device=device["id"])
+        METRICS.observe("encode_seconds", time.perf_counter() - generated, device=device["id"])
+        blocks = [(shared_metadata(device), columns)] if rollups else None
+        yield documents, current_time - step, device["id"], batch_series(device["id"], columns["timestamp"], measurement_bytes), blocks
+
+def fleet_batches(fleet, homes, start_date, end_date, step, sizer, calendar, seed, encoding="raw", bucketing=None, rollups=False):
+    """Yield (batch, checkpoint_timestamp, template_id, series, blocks) for a range of fleet homes
+    
+    Time advances in windows of sizer.target() readings (whole buckets of the template with
+    the largest readings when bucket-aligned); within a window every device of every
+    home in the range gets one single-device batch. Only the last batch of a window
+    carries the window's end as its checkpoint timestamp (the others carry the previous
+    window's end), so a shard checkpoint never passes a partly written window. blocks
+    are as in vectorized_batches.
+    """
+    first_home, last_home = homes
+    encoders = {template["id"]: RawBatchEncoder(template, calendar) for template in fleet.templates} if encoding == "raw" else None
+    measurement_bytes = {template["id"]: measurement_size(template) for template in fleet.templates}
+    aligner = BucketAligner(step, bucketing, max(measurement_bytes.values())) if bucketing else None
+    last_device = (last_home - 1, fleet.templates[-1]["id"])
+    current_time = start_date
+    while current_time <= end_date:
+        available = (end_date - current_time) // step + 1
+        count = aligner.count(current_time, sizer.target(), available) if aligner else min(sizer.target(), available)
+        window_end = current_time + step * (count - 1)
+        for home_index in range(first_home, last_home):
+            home = fleet.home(home_index)
+            for template in fleet.templates:
+                started = time.perf_counter()
+                columns = generate_block(template, current_time, step, count, seed, calendar, home)
+                generated = time.perf_counter()
+                if encoders:
+                    encoder = encoders[template["id"]]
+                    encoder.set_home(home)
+                    documents = encoder.encode(columns)
+                else:
+                    documents = build_documents(template, columns, home)
+                METRICS.observe("generation_seconds", generated - started, device=template["id"])
+                METRICS.observe("encode_seconds", time.perf_counter() - generated, device=template["id"])
+                checkpoint_time = window_end if (home_index, template["id"]) == last_device else current_time - step
+                series = batch_series(f"{home.home_id}-{template['id']}", columns["timestamp"], measurement_bytes[template["id"]])
+                blocks = [(device_metadata(template, home), columns)] if rollups else None
+                yield documents, checkpoint_time, template["id"], series, blocks
+        current_time = window_end + step
+
+def utc_now():
+    """Current UTC time as a naive datetime, like the generated timestamps"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def live_batches(units, start_date, end_date, step, sizer, calendar, seed, encoding="raw", tick=LIVE_TICK_SECONDS, rollups=False):
+    """Yield (batch, due_timestamp, template_id, None, blocks) as the readings of (device, home) units come due
+    
+    Wakes on a fixed wall-clock schedule of one tick every `tick` seconds and generates
+    every reading whose timestamp has passed, for all units, so the feed keeps pace with
+    the clock instead of drifting. A tick that starts late (generation or inserts fell
+    behind) skips the missed ticks and coalesces the overdue readings into batches of up
+    to LIVE_MAX_COALESCE times the batch size. Batches hold one template's readings and
+    carry their oldest timestamp, which BatchWriter turns into the lag metric. Fleet homes
+    are generated one block per template for all of the shard's homes, continuing their
+    random streams from the previous tick. blocks are as in vectorized_batches, one per
+    home a batch has readings of.
+    """
+    templates = {}
+    for device, home in units:
+        templates.setdefault(device["id"], (device, []))[1].append(home)
+    encoders = {template_id: RawBatchEncoder(device, calendar) for template_id, (device, _) in templates.items()} if encoding == "raw" else None
+    streams = DrawStreams(seed)
+    metadata = {template_id: [device_metadata(device, home) for home in homes] for template_id, (device, homes) in templates.items()} if rollups else None
+    label = units[0][0]["id"] if len(units) == 1 else "live"
+    # Ticks fall on start_date + k * tick, so readings come due right on a tick
+    clock_start = calendar_module.timegm(start_date.timetuple())
+    next_time = start_date  # Oldest reading not generated yet
+    tick_index = -1
+    while next_time <= end_date and not live_stop.is_set():
+        # Sleep to the next tick of the schedule; ticks missed while busy are skipped, not replayed
+        tick_index = max(tick_index + 1, int((time.time() - clock_start) / tick))
+        delay = clock_start + tick_index * tick - time.time()
+        if delay > 0 and live_stop.wait(delay):
+            break
+        now = utc_now()
+        if now < next_time:
+            continue
+        count = (min(now, end_date) - next_time) // step + 1
+        
+        # Readings overdue by more than a tick mean the feed is behind: batch them up
+        behind = max(0.0, (now - next_time).total_seconds() - tick)
+        coalesce = min(LIVE_MAX_COALESCE, 1 + int(behind / tick))
+        limit = min(sizer.target() * coalesce, MAX_WRITE_BATCH_SIZE)
+        METRICS.inc("live_ticks_total", device=label)
+        METRICS.set("live_behind_seconds", behind, device=label)
+        if coalesce > 1:
+            METRICS.inc("live_coalesced_ticks_total", device=label)
+        
+        for template_id, (device, homes) in templates.items():
+            started = time.perf_counter()
+            if homes[0] is None:
+                columns = generate_block(device, next_time, step, count, seed, calendar)
+            else:
+                columns = generate_homes_block(device, homes, next_time, step, count, seed, calendar, streams)
+            generated = time.perf_counter()
+            if homes[0] is None:
+                documents = encoders[template_id].encode(columns) if encoders else build_documents(device, columns)
+            elif encoders:
+                documents = encoders[template_id].encode_homes(columns, homes)
+            else:
+                documents = list(itertools.chain.from_iterable(
+                    build_documents(device, home_columns(columns, i, count), home) for i, home in enumerate(homes)
+                ))
+            METRICS.observe("generation_seconds", generated - started, device=template_id)
+            METRICS.observe("encode_seconds", time.perf_counter() - generated, device=template_id)
+            # Nothing waits for the next tick
+            for first in range(0, len(documents), limit):
+                end = min(first + limit, len(documents))
+                blocks = None
+                if rollups:
+                    # Homes follow one another in the block, so a batch covers a run of them
+                    blocks = [
+                        (metadata[template_id][i], column_rows(columns, max(first, i * count), min(end, (i + 1) * count)))
+                        for i in range(first // count, (end - 1) // count + 1)
+                    ]
+                yield documents[first:end], next_time, template_id, None, blocks
+        next_time += step * count
+
+def live_units(shard, fleet=None):
+    """The (device, home) pairs a live feed shard generates for"""
+    if "homes" in shard:
+        return [(template, fleet.home(index)) for index in range(*shard["homes"]) for template in fleet.templates]
+    return [(shard["device"], None)]
+
+def print_live_report(documents, seconds, target_rate):
+    """Achieved vs target rate, lag percentiles and how often a live feed fell behind"""
+    ticks = sum(METRICS.counter_values("live_ticks_total").values())
+    coalesced = sum(METRICS.counter_values("live_coalesced_ticks_total").values())
+    print(f"Live feed: {documents / seconds if seconds > 0 else 0:,.1f} docs/sec achieved, {target_rate:,.1f} docs/sec target")
+    print(f"  Lag (reading due to inserted): {format_latency(METRICS.total_histogram('live_lag_seconds'))}")
+    print(f"  Ticks behind schedule: {coalesced:,} of {ticks:,} (coalesced into batches up to {LIVE_MAX_COALESCE}x the batch size)")
+
+def print_progress(total, current_time, total_data_points, batch_sizes, target):
+    """Print the periodic progress report"""
+    elapsed = time.time() - process_start
+    docs_per_second = total / elapsed if elapsed > 0 else 0
+    if total_data_points > 0:
+        percent_done = min(total / total_data_points * 100, 100)
+        est_remaining_secs = (elapsed / percent_done * 100) - elapsed if percent_done > 0 else 0
+    else:
+        percent_done = 100
+        est_remaining_secs = 0
+    
+    print(f"\n[{datetime.datetime.now().strftime('%H:%M:%S')}] PROGRESS UPDATE:")
+    print(f"  Inserted: {total:,} documents")
+    print(f"  Progress: {percent_done:.1f}% (latest batch ends {current_time.strftime('%Y-%m-%d %H:%M')})")
+    print(f"  Elapsed time: {elapsed:.1f} seconds ({elapsed/60:.1f} minutes)")
+    print(f"  Insertion rate: {docs_per_second:.1f} docs/sec")
+    if batch_sizes:
+        print(f"  Batch size: {batch_sizes[-1]:,} latest (target {target:,}), {min(batch_sizes):,}-{max(batch_sizes):,} since last update")
+    print(f"  Insert latency: {format_latency(METRICS.total_histogram('insert_seconds'))}")
+    lag = METRICS.total_histogram("live_lag_seconds")
+    if lag is not None:
+        print(f"  Live lag: {format_latency(lag)}")
+    print(f"  Estimated remaining: {est_remaining_secs/60:.1f} minutes")
+    print("-" * 60)
+
+def progress_monitor(progress_queue, counter, total_data_points):
+    """Parent-side loop that turns worker progress messages into progress reports"""
+    last_reported = 0
+    batch_sizes = []
+    while True:
+        message = progress_queue.get()
+        if message is None:
+            break
+        if message[0] == "metrics":
+            METRICS.merge(message[1])
+            continue
+        if message[0] == "profile":
+            PROFILER.workers[message[1]["pid"]] = message[1]
+            continue
+        _, current_time, batch_size, target = message
+        batch_sizes.append(batch_size)
+        
+        # Report whenever the shared total crosses another PROGRESS_REPORT_FREQUENCY boundary
+        total = counter.value
+        if total // PROGRESS_REPORT_FREQUENCY > last_reported // PROGRESS_REPORT_FREQUENCY:
+            last_reported = total
+            print_progress(total, current_time, total_data_points, batch_sizes, target)
+            batch_sizes = []
+
+class NullCollection:
+    """Stand-in collection for --sink=null: accepts batches and discards them"""
+    
+    def insert_many(self, documents, **kwargs):
+        pass
+
+def pool_size(settings, concurrent_inserts=None):
+    """maxPoolSize for a client: the setting, or one connection per concurrent insert_many"""
+    if settings["max_pool_size"]:
+        return settings["max_pool_size"]
+    return max(DEFAULT_POOL_SIZE, concurrent_inserts or 0)
+
+def create_client(settings, concurrent_inserts=None):
+    """Open a MongoClient configured from the run settings (None unless the sink is MongoDB)
+    
+    There is one client per process: every worker thread and writer thread of the process
+    shares its connection pool, which is sized for concurrent_inserts insert_many calls.
+    """
+    if settings["sink"] != "mongodb":
+        return None
+    options = {"maxPoolSize": pool_size(settings, concurrent_inserts)}
+    if settings["compressors"]:
+        options["compressors"] = ",".join(settings["compressors"])
+    if settings["write_concern"] is not None:
+        options["w"] = settings["write_concern"]
+    if settings["journal"] is not None:
+        options["journal"] = settings["journal"]
+    return MongoClient(settings["mongodb_url"], **options)
+
+def describe_client(settings, concurrent_inserts=None):
+    """One-line description of the client and write settings for the run plan"""
+    compression = ",".join(settings["compressors"]) if settings["compressors"] else "none"
+    w = settings["write_concern"] if settings["write_concern"] is not None else "default"
+    j = settings["journal"] if settings["journal"] is not None else "default"
+    return (
+        f"one per process, maxPoolSize {pool_size(settings, concurrent_inserts)}, compression {compression}, w={w}, j={j}"
+        + (", bypassing document validation" if settings["bypass_validation"] else "")
+    )
+
+def sink_collection(client, settings):
+    """Collection the workers insert into"""
+    if client is None:
+        return NullCollection()
+    return client[settings["database_name"]][settings["collection_name"]]
+
+def document_size(document):
+    """Encoded BSON size of a document (raw or dict)"""
+    if isinstance(document, RawBSONDocument):
+        return len(document.raw)
+    return len(bson.encode(document))
+
+class BatchSizeController:
+    """Picks the next batch size from measured insert throughput
+    
+    Hill-climbs on documents committed per wall-clock second over a window of inserts
+    (per-call docs/sec would rise with batch size whenever several writers overlap):
+    the size keeps moving in the same direction (x1.5 or /1.5) while throughput
+    improves and reverses when it drops, always within [minimum, maximum] and the
+    server's per-command limits.
+    """
+    
+    WINDOW = 4          # Inserts measured at one size before deciding (at least two per writer)
+    TOLERANCE = 0.05    # Throughput drop that counts as "worse"
+    FACTOR = 1.5
+    
+    def __init__(self, initial, minimum, maximum, adaptive, writers=1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.window = max(self.WINDOW, 2 * writers)
+        self.document_bytes = None
+        self.size = initial if not adaptive else self._clamp(initial)
+        self.cut_size = self.size
+        self._direction = 1
+        self._previous_rate = None
+        self._docs = 0
+        self._window_start = None
+        self._samples = 0
+        self._lock = threading.Lock()
+    
+    def _clamp(self, size):
+        limit = min(self.maximum, MAX_WRITE_BATCH_SIZE)
+        if self.document_bytes:
+            limit = min(limit, MAX_MESSAGE_SIZE_BYTES // self.document_bytes)
+        return max(self.minimum, min(size, limit))
+    
+    def target(self):
+        """Size for the next batch a producer cuts; BatchWriter tags the batch with it
+        
+        Bucket-aligned batches hold whole buckets, so their length is only close to the
+        target. Each shard has one producer thread, which submits a batch right after
+        cutting it, so cut_size is the target of the batch being submitted.
+        """
+        self.cut_size = self.size
+        return self.cut_size
+    
+    def record(self, docs, document_bytes, target):
+        """Feed back one completed insert_many call of a batch cut for `target` documents
+        
+        A window opens when the first batch cut at the current size completes and closes
+        once `window` such batches have; its rate counts every document committed in
+        between, so batches still in flight from before a size change neither inflate
+        nor hide the throughput the writers achieved.
+        """
+        if not self.adaptive:
+            return
+        with self._lock:
+            self.document_bytes = max(self.document_bytes or 0, document_bytes)
+            now = time.perf_counter()
+            if self._window_start is None:
+                if target == self.size:
+                    self._window_start = now
+                    self._samples = 1
+                return
+            self._docs += docs
+            if target == self.size:
+                self._samples += 1
+            if self._samples < self.window:
+                return
+            
+            elapsed = now - self._window_start
+            rate = self._docs / elapsed if elapsed > 0 else float("inf")
+            if self._previous_rate is not None and rate < self._previous_rate * (1 - self.TOLERANCE):
+                self._direction = -self._direction
+            self._previous_rate = rate
+            factor = self.FACTOR if self._direction > 0 else 1 / self.FACTOR
+            self.size = self._clamp(int(self.size * factor))
+            self._docs = 0
+            self._window_start = None
+            self._samples = 0
+
+class BatchWriter:
+    """Pool of writer threads draining a bounded queue of generated batches into insert_many"""
+    
+    def __init__(self, collection, counter, progress_queue, label, writers, queue_depth, sizer, checkpoint, max_retries, backoff_seconds, buckets, ordered=False, bypass_validation=False, live=False, purge_retries=False, rollups=None):
+        self.collection = collection
+        self.live = live
+        self.purge_retries = purge_retries
+        self.rollups = rollups
+        self.buckets = buckets
+        self.ordered = ordered
+        self.bypass_validation = bypass_validation
+        self.sizer = sizer
+        self.checkpoint = checkpoint
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.counter = counter
+        self.progress_queue = progress_queue
+        self.label = label
+        self.inserted = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        # A full queue blocks submit(), so at most queue_depth + writers batches are held in memory
+        self._queue = queue.Queue(maxsize=max(1, queue_depth))
+        self._threads = [threading.Thread(target=self._drain, daemon=True) for _ in range(writers)]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, batch, current_time, device_id, series, blocks=None):
+        """Hand a batch to the writers, blocking while the queue is full; device_id labels its metrics
+        
+        blocks are the batch's column blocks for the rollups, if the producer has them.
+        """
+        PROFILER.mark("first_batch_generated")
+        item = (batch, current_time, self.checkpoint.next_sequence(), device_id, series, self.sizer.cut_size, blocks)
+        if self._threads:
+            depth = self._queue.qsize()
+            METRICS.observe("write_queue_depth", depth, buckets=DEPTH_BUCKETS, device=device_id)
+            METRICS.set("write_queue_depth", depth, device=device_id)
+            self._queue.put(item)
+        else:
+            self._insert(*item)
+    
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._insert(*item)
+    
+    def _insert(self, batch, current_time, sequence, device_id, series, target, blocks):
+        started = time.perf_counter()
+        stored = insert_with_retry(
+            self.collection, batch, self.max_retries, self.backoff_seconds, self.label, self.ordered, self.bypass_validation, self.purge_retries
+        )
+        elapsed = time.perf_counter() - started
+        if not stored:
+            # Given up: the checkpoint stays behind this batch so --resume redoes it
+            with self._lock:
+                self.failed += len(batch)
+            METRICS.inc("documents_failed_total", len(batch), device=device_id)
+            return
+        # Model the bucket catalog in the order inserts complete, the closest view of server order
+        if series is not None:
+            METRICS.inc("buckets_opened_total", self.buckets.observe(series), device=device_id)
+        self.sizer.record(len(batch), document_size(batch[0]), target)
+        if self.rollups:
+            # Only stored readings are rolled up, so the rollups never count more than the collection holds
+            if blocks is None:
+                self.rollups.add_documents(batch)
+            else:
+                self.rollups.add_blocks(blocks)
+        self.checkpoint.complete(sequence, current_time)
+        PROFILER.mark("first_batch_inserted")
+        PROFILER.sample(len(batch))
+        with self._lock:
+            self.inserted += stored
+        self.counter.add(stored)
+        METRICS.observe("insert_seconds", elapsed, device=device_id)
+        if self.live:
+            # A live batch carries the timestamp its oldest reading was due at
+            METRICS.observe("live_lag_seconds", (utc_now() - current_time).total_seconds(), device=device_id)
+        METRICS.inc("documents_inserted_total", stored, device=device_id)
+        METRICS.inc("batches_inserted_total", device=device_id)
+        METRICS.set("batch_size", len(batch), device=device_id)
+        self.progress_queue.put(("progress", current_time, len(batch), target))
+    
+    def close(self):
+        """Wait for every queued batch to be written; returns the number of documents inserted"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.inserted
+
+def time_slices(start_date, end_date, step, slices):
+    """Split the run into (slice_index, start, end) time slices aligned on interval boundaries"""
+    total_points = (end_date - start_date) // step + 1
+    points_per_slice = -(-total_points // slices)
+    
+    for slice_index in range(slices):
+        first = slice_index * points_per_slice
+        if first >= total_points:
+            break
+        last = min(total_points, first + points_per_slice) - 1
+        yield slice_index, start_date + step * first, start_date + step * last
+
+def plan_shards(devices, start_date, end_date, step, slices_per_device):
+    """Split the run into (device, time slice) shards"""
+    shards = []
+    # Slice-major order keeps concurrently running shards close together in time
+    for slice_index, start, end in time_slices(start_date, end_date, step, slices_per_device):
+        for device in devices:
+            shards.append({"device": device, "slice": slice_index, "start": start, "end": end})
+    return shards
+
+def plan_fleet_shards(homes, homes_per_shard, start_date, end_date, step, slices):
+    """Split a fleet run into (range of homes, time slice) shards"""
+    shards = []
+    for slice_index, start, end in time_slices(start_date, end_date, step, slices):
+        for first_home in range(0, homes, homes_per_shard):
+            shards.append({
+                "homes": (first_home, min(homes, first_home + homes_per_shard)),
+                "slice": slice_index,
+                "start": start,
+                "end": end
+            })
+    return shards
+
+def shard_key(shard):
+    """Stable file-name-safe id of a shard"""
+    if "homes" in shard:
+        return f"homes{shard['homes'][0]}-{shard['homes'][1] - 1}-{shard['slice']}"
+    return f"{shard['device']['id']}-{shard['slice']}"
+
+def shard_label(shard):
+    """Human-readable shard name for log lines"""
+    if "homes" in shard:
+        return f"homes {shard['homes'][0]:,}-{shard['homes'][1] - 1:,} #{shard['slice']}"
+    return f"{shard['device']['name']} #{shard['slice']}"
+
+def run_shard(shard, settings, collection, counter, progress_queue, calendar, fleet=None):
+    """Generate and insert every reading of one shard; returns the number of documents inserted"""
+    PROFILER.mark("first_shard_started")
+    step = datetime.timedelta(minutes=settings["interval_minutes"])
+    checkpoint = ShardCheckpoint(settings["checkpoint_dir"], shard)
+    
+    # Pick up after the last committed batch of an interrupted run
+    start = shard["start"]
+    if settings["resume"]:
+        committed_through, done = checkpoint.load()
+        if done:
+            print(f"Skipping {shard_label(shard)}: already complete")
+            return 0
+        if checkpoint.path and os.path.exists(checkpoint.path):
+            purge_uncommitted(collection, shard, committed_through, fleet)
+        if committed_through:
+            start = committed_through + step
+    checkpoint.save()
+    
+    sizer = BatchSizeController(
+        settings["batch_size"],
+        settings["min_batch_size"],
+        settings["max_batch_size"],
+        settings["adaptive_batch_size"],
+        settings["writer_threads"]
+    )
+    bucketing = timeseries_bucketing(settings)
+    sink = open_file_sink(settings, shard) if settings["sink"] in FILE_SINKS else None
+    rollups = None
+    if settings["rollups"]:
+        rollups = RollupAccumulator(collection if settings["sink"] == "mongodb" else None, settings["interval_seconds"])
+    alignment = bucketing if settings["insert_order"] == "bucket" else None
+    if settings["live"]:
+        batches = live_batches(
+            live_units(shard, fleet), start, shard["end"], step, sizer, calendar,
+            settings["seed"], settings["encoding"], settings["tick"], settings["rollups"]
+        )
+    elif "homes" in shard:
+        batches = fleet_batches(
+            fleet, shard["homes"], start, shard["end"], step, sizer, calendar,
+            settings["seed"], settings["encoding"], alignment, settings["rollups"]
+        )
+    elif settings["engine"] == "vectorized":
+        batches = vectorized_batches(
+            shard["device"], start, shard["end"], step, sizer, calendar,
+            settings["seed"], settings["encoding"], alignment, settings["rollups"]
+        )
+    else:
+        batches = scalar_batches(shard["device"], start, shard["end"], step, sizer, calendar, settings["seed"], alignment)
+    if settings["disorder_profile"]:
+        buffer = ReorderBuffer(settings["disorder_profile"], settings["reorder_buffer"], step, settings["seed"], shard_key(shard), start)
+        batches = disordered_batches(batches, buffer)
+    
+    # Generate batches here while the writer pool inserts earlier ones
+    writer = BatchWriter(
+        sink or collection, counter, progress_queue, shard_label(shard), settings["writer_threads"], settings["queue_depth"],
+        sizer, checkpoint, settings["max_retries"], settings["retry_backoff"], BucketTracker(bucketing),
+        settings["ordered_inserts"], settings["bypass_validation"], settings["live"], settings["purge_retries"], rollups
+    )
+    profile = PROFILER.shard_profile()
+    try:
+        for batch, current_time, device_id, series, blocks in batches:
+            writer.submit(batch, current_time, device_id, series, blocks)
+    finally:
+        if profile:
+            PROFILER.save_shard_profile(profile, shard)
+        shard_inserted = writer.close()
+        if sink:
+            sink.close()
+        if rollups:
+            rollups.close()
+    
+    if writer.failed and rollups:
+        # Their readings were left out of the rollups, but a --rollups run cannot be resumed to fill the gap
+        print(f"Warning: {writer.failed:,} documents for {shard_label(shard)} could not be inserted; they are missing from the collection and its rollups")
+    elif writer.failed:
+        print(f"Warning: {writer.failed:,} documents for {shard_label(shard)} could not be inserted; rerun with --resume")
+    checkpoint.save(done=not writer.failed)
+    return shard_inserted
+
+def worker_thread(shard, settings, collection, counter, progress_queue, calendar, fleet=None):
+    """Worker thread that generates and inserts data for a specific device (or range of homes) for a date range
+    
+    All worker threads insert through the collection of the one client main opened.
+    """
+    label = shard_label(shard)
+    print(f"Worker started for {label}: generating data from {shard['start']} to {shard['end']}")
+    device_inserted = run_shard(shard, settings, collection, counter, progress_queue, calendar, fleet)
+    print(f"Worker for {label} completed. Inserted {device_inserted:,} documents.")
+
+#################################################
+# CHECKPOINTS AND RETRIES
+#################################################
+
+def insert_with_retry(collection, batch, max_retries, backoff_seconds, label, ordered=False, bypass_validation=False, purge=False):
+    """insert_many with exponential backoff; returns the number of documents now stored
+    
+    Inserts are unordered by default so one bad document does not stop the rest. On a
+    regular collection _ids are deterministic and unique, so duplicate key errors mean an
+    earlier attempt (or run) already stored those readings and they count as applied.
+    Time series collections do not enforce _id uniqueness: a failed insert_many may have
+    stored part of the batch, so with `purge` each retry first deletes whatever of the
+    batch is there (see timeseries_cleanup for servers that cannot).
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            if purge and attempt:
+                delete_batch(collection, batch)
+            collection.insert_many(batch, ordered=ordered, bypass_document_validation=bypass_validation)
+            return len(batch)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if not e.details.get("writeConcernErrors") and all(error.get("code") == DUPLICATE_KEY_ERROR for error in write_errors):
+                if ordered and write_errors and write_errors[-1]["index"] < len(batch) - 1:
+                    # An ordered insert stops at the duplicate, so the rest still has to be sent
+                    skipped = write_errors[-1]["index"] + 1
+                    return skipped + insert_with_retry(collection, batch[skipped:], max_retries, backoff_seconds, label, ordered, bypass_validation, purge)
+                return len(batch)
+            error = e
+        except PyMongoError as e:
+            error = e
+        
+        if attempt < max_retries:
+            METRICS.inc("insert_retries_total")
+            delay = backoff_seconds * 2 ** attempt * random.uniform(1.0, 1.5)
+            print(f"Retrying batch for {label} in {delay:.1f}s (attempt {attempt + 1}/{max_retries}): {error}")
+            time.sleep(delay)
+    
+    print(f"Error inserting batch for {label} after {max_retries} retries: {error}")
+    return 0
+
+def delete_batch(collection, batch):
+    """Delete whatever part of a batch a failed insert_many stored in a time series collection
+    
+    Readings are matched by device and exact timestamp rather than by each device's time
+    range, because a disordered batch's late readings share that range with readings of
+    the device that other batches stored.
+    """
+    timestamps = {}
+    for document in batch:
+        timestamps.setdefault(document["metadata"]["device_id"], []).append(document["timestamp"])
+    collection.delete_many({"$or": [
+        {"metadata.device_id": device_id, "timestamp": {"$gte": min(times), "$lte": max(times), "$in": times}}
+        for device_id, times in timestamps.items()
+    ]})
+
+def timeseries_cleanup(settings, timeseries, server_version):
+    """Decide whether retried and resumed batches are deleted before they are written again
+    
+    Sets settings["purge_retries"]. Only time series collections need it (a regular
+    collection rejects the duplicate _ids), and deleting from one by timestamp needs
+    MongoDB 7.0; on older servers --resume is refused and retries can store duplicates.
+    """
+    settings["purge_retries"] = timeseries and server_version >= TIMESERIES_DELETE_VERSION
+    if not timeseries or settings["purge_retries"]:
+        return
+    version = ".".join(map(str, server_version))
+    required = ".".join(map(str, TIMESERIES_DELETE_VERSION))
+    if settings["resume"]:
+        print(f"Error: --resume deletes partly written batches from the time series collection, which needs MongoDB {required}+ (server is {version}).")
+        sys.exit(1)
+    if settings["max_retries"] and settings["write_concern"] != 0:
+        print(f"Warning: MongoDB {version} cannot delete from time series collections by timestamp, so a batch retried after "
+              f"a partial write stores those readings twice (use MongoDB {required}+ or --max-retries 0).")
+
+class ShardCheckpoint:
+    """Tracks the last contiguously committed timestamp of a shard and persists it as JSON
+    
+    Writers finish batches out of order, so each batch gets a sequence number and the
+    checkpoint only advances across an unbroken run of committed batches. A batch that
+    failed every retry therefore holds the checkpoint back and is redone on --resume.
+    """
+    
+    def __init__(self, directory, shard):
+        self.path = os.path.join(directory, f"{shard_key(shard)}.json") if directory else None
+        self.shard = shard
+        self.committed_through = None
+        self._next_sequence = 0
+        self._committed_sequence = -1
+        self._completed = {}
+        self._last_saved = 0.0
+        self._lock = threading.Lock()
+    
+    def load(self):
+        """Return (committed_through, done) from a previous run, or (None, False)"""
+        if not self.path or not os.path.exists(self.path):
+            return None, False
+        with open(self.path) as f:
+            state = json.load(f)
+        committed_through = state["committed_through"]
+        if committed_through:
+            self.committed_through = datetime.datetime.fromisoformat(committed_through)
+        return self.committed_through, state["done"]
+    
+    def next_sequence(self):
+        """Sequence number for the next submitted batch (called from the generating thread)"""
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        return sequence
+    
+    def complete(self, sequence, last_timestamp):
+        """Record a committed batch and advance the checkpoint over any contiguous prefix"""
+        with self._lock:
+            self._completed[sequence] = last_timestamp
+            while self._committed_sequence + 1 in self._completed:
+                self._committed_sequence += 1
+                self.committed_through = self._completed.pop(self._committed_sequence)
+            if time.time() - self._last_saved >= CHECKPOINT_INTERVAL_SECONDS:
+                self.save()
+    
+    def save(self, done=False):
+        """Atomically write the checkpoint file"""
+        self._last_saved = time.time()
+        if not self.path:
+            return
+        state = {
+            "shard": shard_key(self.shard),
+            "slice": self.shard["slice"],
+            "start": self.shard["start"].isoformat(),
+            "end": self.shard["end"].isoformat(),
+            "committed_through": self.committed_through.isoformat() if self.committed_through else None,
+            "done": done
+        }
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+def prepare_checkpoints(settings, start_date, end_date, slices, devices, homes_per_shard=None):
+    """Set up the checkpoint directory for a run; returns the (time slices, homes per shard) to use
+    
+    A fresh run clears old shard checkpoints. --resume requires the same plan (dates,
+    interval, devices, homes) and reuses its shard layout so shard boundaries line up
+    with the saved checkpoints, whatever the current worker count.
+    """
+    directory = settings["checkpoint_dir"]
+    plan = {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "interval_seconds": settings["interval_seconds"],
+        "devices": [device["id"] for device in devices],
+        "homes": settings["homes"],
+        "seed": settings["seed"],
+        "time_slices": slices,
+        "homes_per_shard": homes_per_shard
+    }
+    layout = ("time_slices", "homes_per_shard")
+    plan_path = os.path.join(directory, "plan.json")
+    
+    if settings["resume"]:
+        if not os.path.exists(plan_path):
+            print(f"Error: no checkpoint plan found in {directory}; nothing to resume.")
+            sys.exit(1)
+        with open(plan_path) as f:
+            saved = json.load(f)
+        mismatched = [key for key in plan if key not in layout and plan[key] != saved.get(key)]
+        if mismatched:
+            print(f"Error: cannot resume, the run differs from the checkpoint in: {', '.join(mismatched)}")
+            sys.exit(1)
+        return saved["time_slices"], saved.get("homes_per_shard")
+    
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            os.remove(os.path.join(directory, name))
+    with open(plan_path, "w") as f:
+        json.dump(plan, f, indent=2)
+    return slices, homes_per_shard
+
+def purge_uncommitted(collection, shard, committed_through, fleet=None):
+    """Delete a resumed shard's readings after its checkpoint
+    
+    Batches past the checkpoint may have been partly written before the interruption.
+    Regular collections reject those duplicates by _id, but time series collections do
+    not enforce _id uniqueness, so they are removed before the shard is regenerated
+    (main refuses --resume where the server cannot, see timeseries_cleanup).
+    """
+    timestamp_filter = {"$lte": shard["end"]}
+    if committed_through:
+        timestamp_filter["$gt"] = committed_through
+    else:
+        timestamp_filter["$gte"] = shard["start"]
+    if "homes" in shard:
+        # Home ids are zero-padded, so the shard's homes are a contiguous home_id range
+        first_home, last_home = shard["homes"]
+        device_filter = {"metadata.home_id": {"$gte": fleet.home_id(first_home), "$lte": fleet.home_id(last_home - 1)}}
+    else:
+        device_filter = {"metadata.device_id": shard["device"]["id"]}
+    try:
+        collection.delete_many({**device_filter, "timestamp": timestamp_filter})
+    except PyMongoError as e:
+        print(f"Warning: could not remove partial data for {shard_label(shard)}: {e}")
+
+#################################################
+# FILE SINKS AND REPLAY
+#################################################
+
+def import_pyarrow():
+    """pyarrow and pyarrow.parquet, which are only needed for Parquet files"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print("Error: pyarrow is required for Parquet files (pip install pyarrow), or use --sink bson/jsonl.")
+        sys.exit(1)
+    return pyarrow, pyarrow.parquet
+
+def parquet_schema(pyarrow):
+    """Columns of a Parquet dump; fields a reading does not have are null"""
+    string = pyarrow.string()
+    return pyarrow.schema([
+        ("_id", pyarrow.binary(12)),
+        ("metadata", pyarrow.struct([
+            ("device_id", string), ("device_name", string), ("device_type", string),
+            ("home_id", string), ("region", string)
+        ])),
+        ("timestamp", pyarrow.timestamp("ms")),
+        ("power_kw", pyarrow.float64()),
+        ("status", string),
+        ("temperature", pyarrow.int32()),
+        ("runtime_minutes", pyarrow.int32()),
+        ("efficiency", pyarrow.int32()),
+        ("maintenance_needed", pyarrow.bool_()),
+        ("holiday", string),
+        ("special_event", string)
+    ])
+
+class FileSink(abc.ABC):
+    """Collection stand-in that appends every inserted batch to one file (one file per shard)
+    
+    Writes go through a large buffered file, so memory use stays at one batch per writer
+    thread plus the buffer however much is written. Subclasses define the file format.
+    """
+    
+    def __init__(self, path):
+        self._file = open(path, "wb", buffering=FILE_BUFFER_BYTES)
+        self._lock = threading.Lock()
+    
+    @abc.abstractmethod
+    def encode(self, documents):
+        """The bytes a batch of documents adds to the file"""
+    
+    def insert_many(self, documents, **kwargs):
+        # Encode outside the lock so concurrent writers only queue up for the write itself
+        data = self.encode(documents)
+        with self._lock:
+            self._file.write(data)
+    
+    def close(self):
+        self._file.close()
+
+class BsonFileSink(FileSink):
+    """Concatenated BSON documents, the format of mongodump's <collection>.bson"""
+    
+    def encode(self, documents):
+        return b"".join(document.raw if isinstance(document, RawBSONDocument) else bson.encode(document) for document in documents)
+
+class JsonFileSink(FileSink):
+    """One relaxed Extended JSON document per line, the input format of mongoimport"""
+    
+    def encode(self, documents):
+        options = json_util.RELAXED_JSON_OPTIONS
+        return "".join(json_util.dumps(document, json_options=options) + "\n" for document in documents).encode()
+
+class ParquetFileSink:
+    """Collection stand-in that writes a columnar Parquet file a row group at a time
+    
+    Rows are buffered and written by pyarrow rather than appended as encoded bytes, so
+    unlike the byte-stream formats it is not a FileSink.
+    """
+    
+    def __init__(self, path):
+        pyarrow, parquet = import_pyarrow()
+        self._table = pyarrow.Table
+        self._schema = parquet_schema(pyarrow)
+        self._writer = parquet.ParquetWriter(path, self._schema, compression="zstd")
+        self._rows = []
+        self._lock = threading.Lock()
+    
+    def insert_many(self, documents, **kwargs):
+        rows = [{**document, "_id": document["_id"].binary} for document in documents]
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) >= PARQUET_ROW_GROUP:
+                self._flush()
+    
+    def _flush(self):
+        self._writer.write_table(self._table.from_pylist(self._rows, schema=self._schema))
+        self._rows = []
+    
+    def close(self):
+        if self._rows:
+            self._flush()
+        self._writer.close()
+
+FILE_SINK_CLASSES = {"bson": BsonFileSink, "jsonl": JsonFileSink, "parquet": ParquetFileSink}
+
+def output_path(settings, suffix):
+    """<output dir>/<database>/<collection><suffix>"""
+    return os.path.join(settings["output_dir"], settings["database_name"], settings["collection_name"] + suffix)
+
+def parts_directory(settings):
+    """Where shards write their files: the dataset directory itself for Parquet, a scratch directory otherwise"""
+    extension = FILE_SINKS[settings["sink"]]
+    return output_path(settings, extension if settings["sink"] == "parquet" else ".parts")
+
+def part_path(settings, shard):
+    """File a shard writes to"""
+    return os.path.join(parts_directory(settings), shard_key(shard) + FILE_SINKS[settings["sink"]])
+
+def open_file_sink(settings, shard):
+    """Open the file sink for one shard"""
+    return FILE_SINK_CLASSES[settings["sink"]](part_path(settings, shard))
+
+def prepare_output(settings):
+    """Start a file sink run from an empty output location"""
+    for suffix in (FILE_SINKS[settings["sink"]], ".parts"):
+        path = output_path(settings, suffix)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    os.makedirs(parts_directory(settings))
+
+def finish_output(settings, shards, documents, start_date, end_date, devices):
+    """Join the shard files into the final dump and describe it in a manifest; returns the dump path
+    
+    BSON and JSONL shard files are streamed one after another into a single file (what
+    mongorestore and mongoimport expect); Parquet keeps one file per shard as a dataset
+    directory. The manifest lets --replay recreate the time series collection.
+    """
+    sink = settings["sink"]
+    path = output_path(settings, FILE_SINKS[sink])
+    if sink != "parquet":
+        with open(path, "wb") as output:
+            for shard in shards:
+                with open(part_path(settings, shard), "rb") as part:
+                    shutil.copyfileobj(part, output, FILE_BUFFER_BYTES)
+                os.remove(part.name)
+        os.rmdir(parts_directory(settings))
+    if sink == "bson":
+        # mongorestore creates a missing collection with these options, so the readings land in a time series
+        # collection bucketed like this run's (no "type": the file holds measurements, not system.buckets documents)
+        with open(output_path(settings, ".metadata.json"), "w") as f:
+            json.dump({"options": {"timeseries": timeseries_options(settings)}, "indexes": [], "collectionName": settings["collection_name"]}, f)
+    manifest = {
+        "format": sink,
+        "file": os.path.basename(path),
+        "documents": documents,
+        "timeseries": timeseries_options(settings),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "interval_seconds": settings["interval_seconds"],
+        "devices": [device["id"] for device in devices],
+        "homes": settings["homes"],
+        "seed": settings["seed"]
+    }
+    with open(output_path(settings, ".manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+def bson_file_batches(path, sizer):
+    """Yield batches of RawBSONDocuments sliced straight out of a memory-mapped BSON file"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            offset = 0
+            while offset < len(view):
+                batch = []
+                target = sizer.target()
+                while offset < len(view) and len(batch) < target:
+                    size = int.from_bytes(view[offset:offset + 4], "little")
+                    batch.append(RawBSONDocument(view[offset:offset + size]))
+                    offset += size
+                yield batch
+
+def json_file_batches(path, sizer):
+    """Yield batches of documents parsed from an Extended JSON lines file"""
+    batch = []
+    target = sizer.target()
+    with open(path, buffering=FILE_BUFFER_BYTES) as f:
+        for line in f:
+            batch.append(json_util.loads(line))
+            if len(batch) >= target:
+                yield batch
+                batch = []
+                target = sizer.target()
+    if batch:
+        yield batch
+
+def parquet_document(row):
+    """A reading document from a Parquet row (null columns are fields the reading did not have)"""
+    document = {key: value for key, value in row.items() if value is not None}
+    document["_id"] = ObjectId(document["_id"])
+    document["metadata"] = {key: value for key, value in document["metadata"].items() if value is not None}
+    return document
+
+def parquet_file_batches(path, sizer):
+    """Yield batches of documents from a Parquet file or dataset directory"""
+    _, parquet = import_pyarrow()
+    files = sorted(os.path.join(path, name) for name in os.listdir(path)) if os.path.isdir(path) else [path]
+    rows = []
+    for name in files:
+        for record_batch in parquet.ParquetFile(name).iter_batches(batch_size=PARQUET_ROW_GROUP):
+            rows.extend(record_batch.to_pylist())
+            while len(rows) >= sizer.size:
+                target = sizer.target()
+                yield [parquet_document(row) for row in rows[:target]]
+                del rows[:target]
+    if rows:
+        sizer.target()
+        yield [parquet_document(row) for row in rows]
+
+FILE_READERS = {".bson": bson_file_batches, ".json": json_file_batches, ".parquet": parquet_file_batches}
+
+def replay(settings):
+    """Insert a dump written by a file sink without regenerating it; returns the number of documents inserted"""
+    path = settings["replay"].rstrip(os.sep)
+    stem, extension = os.path.splitext(path)
+    if extension not in FILE_READERS or not os.path.exists(path):
+        print(f"Error: {path} is not a {', '.join(FILE_READERS)} file written by a file sink.")
+        sys.exit(1)
+    manifest = {}
+    if os.path.exists(f"{stem}.manifest.json"):
+        with open(f"{stem}.manifest.json") as f:
+            manifest = json.load(f)
+    
+    try:
+        client = create_client(settings, max(1, settings["writer_threads"]))
+        db = client[settings["database_name"]]
+        collection_name = settings["collection_name"]
+        server_version = tuple(client.server_info()["versionArray"][:2])
+        if collection_name not in db.list_collection_names():
+            timeseries = manifest.get("timeseries", {"timeField": "timestamp", "metaField": "metadata"})
+            db.create_collection(collection_name, timeseries=timeseries)
+            print(f"Created time series collection: {collection_name} ({timeseries})")
+            timeseries_cleanup(settings, True, server_version)
+        else:
+            timeseries_cleanup(settings, existing_bucketing(db, collection_name) is not None, server_version)
+    except PyMongoError as e:
+        print(f"\nError connecting to MongoDB: {e}")
+        sys.exit(1)
+    
+    total = manifest.get("documents", 0)
+    print(f"\nReplaying {path} into {settings['database_name']}.{collection_name}" + (f" ({total:,} documents)" if total else ""))
+    counter = SharedCounter()
+    progress_queue = queue.Queue()
+    monitor = threading.Thread(target=progress_monitor, args=(progress_queue, counter, total), daemon=True)
+    monitor.start()
+    stats_before = bucket_stats(db, collection_name)
+    sizer = BatchSizeController(
+        settings["batch_size"],
+        settings["min_batch_size"],
+        settings["max_batch_size"],
+        settings["adaptive_batch_size"],
+        settings["writer_threads"]
+    )
+    shard = {"file": path, "slice": 0}
+    writer = BatchWriter(
+        db[collection_name], counter, progress_queue, os.path.basename(path), settings["writer_threads"], settings["queue_depth"],
+        sizer, ShardCheckpoint(None, shard), settings["max_retries"], settings["retry_backoff"], None,
+        settings["ordered_inserts"], settings["bypass_validation"], purge_retries=settings["purge_retries"]
+    )
+    started = time.time()
+    try:
+        # Reading is cheap next to inserting, so one reader keeps the writer pool busy
+        for batch in FILE_READERS[extension](path, sizer):
+            writer.submit(batch, batch[-1]["timestamp"], "replay", None)
+    finally:
+        inserted = writer.close()
+    elapsed = time.time() - started
+    progress_queue.put(None)
+    monitor.join()
+    
+    print(f"\nReplay complete! Total documents inserted: {inserted:,}")
+    print(f"Insertion rate: {inserted / elapsed if elapsed > 0 else 0:,.1f} docs/sec ({elapsed:.1f} seconds, no generation)")
+    print(f"insert_many latency: {format_latency(METRICS.total_histogram('insert_seconds'))}")
+    if writer.failed:
+        print(f"Warning: {writer.failed:,} documents could not be inserted")
+    print_bucket_report(stats_before, bucket_stats(db, collection_name))
+    client.close()
+    return inserted
+
+#################################################
+# ROLLUPS
+#################################################
+
+def rollup_collection_name(collection_name, period):
+    """Companion collection holding a raw collection's rollups for one ROLLUP_PERIODS period"""
+    return f"{collection_name}_{period}"
+
+def rollup_update(device_id, metadata, period, interval_seconds, entry):
+    """Upsert merging one accumulated (device, period) entry into its stored rollup
+    
+    The update pipeline adds counts and sums and keeps the min/max, so partial entries
+    from different shards, ticks or runs over the same period combine into one rollup.
+    """
+    start, readings, power_sum, power_min, power_max, on_readings, holiday_readings, event_readings = entry
+    def add(field, value):
+        return {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+    return UpdateOne(
+        {"_id": {"device_id": device_id, "start": datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=start)}},
+        [
+            {"$set": {
+                "metadata": {"$literal": metadata},
+                "period": period,
+                "interval_seconds": interval_seconds,
+                "readings": add("readings", readings),
+                "power_sum": add("power_sum", power_sum),
+                "power_min": {"$min": ["$power_min", power_min]},
+                "power_max": {"$max": ["$power_max", power_max]},
+                "on_minutes": add("on_minutes", on_readings * interval_seconds / 60),
+                "holiday_readings": add("holiday_readings", holiday_readings),
+                "event_readings": add("event_readings", event_readings)
+            }},
+            {"$set": {"power_avg": {"$divide": ["$power_sum", "$readings"]}}}
+        ],
+        upsert=True
+    )
+
+class RollupAccumulator:
+    """Hourly and daily rollups of one shard's readings, upserted into the companion collections
+    
+    The shard's writers fold in every batch once it is stored. A device has one open
+    entry per period; it is queued for writing as soon as a reading of another period
+    arrives and the queue goes out in unordered bulk writes of ROLLUP_FLUSH upserts.
+    Writers finish batches out of order, so a period can be queued more than once; the
+    upserts add up, so that only costs an extra write. close() writes the open entries too.
+    Without a collection (--sink=null) the rollups are computed and counted but not written.
+    """
+    
+    def __init__(self, collection, interval_seconds, flush_size=ROLLUP_FLUSH):
+        self.targets = None
+        if collection is not None:
+            self.targets = {
+                period: collection.database.get_collection(rollup_collection_name(collection.name, period), write_concern=collection.write_concern)
+                for period in ROLLUP_PERIODS
+            }
+        self.interval_seconds = interval_seconds
+        self.flush_size = flush_size
+        self.failed = 0
+        self._open = {}      # (period, device_id) -> [start, readings, sum, min, max, on, holiday, event]
+        self._complete = []  # (period, device_id, entry) waiting to be written
+        self._metadata_by_id = {}  # metadata device_id -> metadata subdocument
+        self._lock = threading.Lock()
+    
+    def add_blocks(self, blocks):
+        """Fold in a stored batch given as the (metadata, columns) blocks it was encoded from"""
+        for metadata, columns in blocks:
+            self.add(
+                metadata, columns["timestamp"], columns["power_kw"], columns["status_on"],
+                columns["holiday_code"] > 0, columns["event_code"] > 0
+            )
+    
+    def add_documents(self, documents):
+        """Fold in a stored batch of reading documents (raw or dict) that has no blocks"""
+        if isinstance(documents[0], RawBSONDocument):
+            # One C-level decode of the whole batch beats inflating every RawBSONDocument
+            documents = bson.decode_all(b"".join(document.raw for document in documents))
+        by_device = {}
+        for document in documents:
+            by_device.setdefault(document["metadata"]["device_id"], []).append(document)
+        for readings in by_device.values():
+            timestamps = np.array([reading["timestamp"] for reading in readings], dtype="datetime64[us]")
+            # Disordered batches carry late readings; sorting keeps each period one run
+            order = np.argsort(timestamps, kind="stable")
+            self.add(
+                readings[0]["metadata"], timestamps[order],
+                np.array([reading["power_kw"] for reading in readings])[order],
+                np.array([reading["status"] == "on" for reading in readings])[order],
+                np.array(["holiday" in reading for reading in readings])[order],
+                np.array(["special_event" in reading for reading in readings])[order]
+            )
+    
+    def add(self, metadata, timestamps, power_kw, status_on, holiday, event):
+        """Fold in a device's readings given as arrays in time order"""
+        device_id = metadata["device_id"]
+        seconds = timestamps.astype("datetime64[s]").astype(np.int64)
+        columns = (power_kw, status_on.astype(np.int64), holiday.astype(np.int64), event.astype(np.int64))
+        with self._lock:
+            self._metadata_by_id.setdefault(device_id, metadata)
+            self._fold(device_id, seconds, power_kw, columns)
+            if len(self._complete) < self.flush_size:
+                return
+        self.flush()
+    
+    def _fold(self, device_id, seconds, power_kw, columns):
+        for period, (_, period_seconds) in ROLLUP_PERIODS.items():
+            # Readings are in time order, so each period is one contiguous run
+            starts = seconds - seconds % period_seconds
+            firsts = np.r_[0, np.flatnonzero(starts[1:] != starts[:-1]) + 1]
+            counts = np.diff(np.r_[firsts, len(seconds)]).tolist()
+            sums, on, holidays, events = (np.add.reduceat(column, firsts).tolist() for column in columns)
+            minimums = np.minimum.reduceat(power_kw, firsts).tolist()
+            maximums = np.maximum.reduceat(power_kw, firsts).tolist()
+            for i, start in enumerate(starts[firsts].tolist()):
+                entry = self._open.get((period, device_id))
+                if entry is not None and entry[0] != start:
+                    self._complete.append((period, device_id, entry))
+                    entry = None
+                if entry is None:
+                    self._open[(period, device_id)] = [start, counts[i], sums[i], minimums[i], maximums[i], on[i], holidays[i], events[i]]
+                    continue
+                entry[1] += counts[i]
+                entry[2] += sums[i]
+                entry[3] = min(entry[3], minimums[i])
+                entry[4] = max(entry[4], maximums[i])
+                entry[5] += on[i]
+                entry[6] += holidays[i]
+                entry[7] += events[i]
+    
+    def flush(self):
+        """Write the completed entries"""
+        with self._lock:
+            complete, self._complete = self._complete, []
+        for period in ROLLUP_PERIODS:
+            entries = [(device_id, entry) for entry_period, device_id, entry in complete if entry_period == period]
+            if not entries:
+                continue
+            started = time.perf_counter()
+            if self.targets is not None:
+                updates = [
+                    rollup_update(device_id, self._metadata_by_id[device_id], period, self.interval_seconds, entry)
+                    for device_id, entry in entries
+                ]
+                try:
+                    self.targets[period].bulk_write(updates, ordered=False)
+                except PyMongoError as e:
+                    with self._lock:
+                        self.failed += len(updates)
+                    METRICS.inc("rollup_upserts_failed_total", len(updates), period=period)
+                    print(f"Warning: {len(updates):,} {period} rollups could not be written: {e}")
+                    continue
+            METRICS.observe("rollup_write_seconds", time.perf_counter() - started, period=period)
+            METRICS.inc("rollup_upserts_total", len(entries), period=period)
+    
+    def close(self):
+        """Write every entry, including the periods still open at the end of the shard"""
+        with self._lock:
+            self._complete.extend((period, device_id, entry) for (period, device_id), entry in self._open.items())
+            self._open = {}
+        self.flush()
+        return self.failed
+
+def raw_rollup_pipeline(unit, match=None):
+    """$group over the raw collection computing what the rollups of one period hold"""
+    def count_if(condition):
+        return {"$sum": {"$cond": [condition, 1, 0]}}
+    return ([{"$match": match}] if match else []) + [
+        {"$group": {
+            "_id": {"device_id": "$metadata.device_id", "start": {"$dateTrunc": {"date": "$timestamp", "unit": unit}}},
+            "readings": {"$sum": 1},
+            "power_sum": {"$sum": "$power_kw"},
+            "power_min": {"$min": "$power_kw"},
+            "power_max": {"$max": "$power_kw"},
+            "on_readings": count_if({"$eq": ["$status", "on"]}),
+            "holiday_readings": count_if({"$gt": ["$holiday", None]}),
+            "event_readings": count_if({"$gt": ["$special_event", None]})
+        }}
+    ]
+
+def rollup_differences(rollup, raw):
+    """Names of the rollup fields that disagree with the $group result"""
+    expected = {
+        "readings": raw["readings"],
+        "power_sum": raw["power_sum"],
+        "power_min": raw["power_min"],
+        "power_max": raw["power_max"],
+        "power_avg": raw["power_sum"] / raw["readings"],
+        "on_minutes": raw["on_readings"] * rollup.get("interval_seconds", 0) / 60,
+        "holiday_readings": raw["holiday_readings"],
+        "event_readings": raw["event_readings"]
+    }
+    # Sums are added up in a different order than $group does, so compare them with a tolerance
+    return [
+        field for field, value in expected.items()
+        if not isinstance(rollup.get(field), (int, float)) or not math.isclose(rollup[field], value, rel_tol=1e-9, abs_tol=1e-9)
+    ]
+
+def best_time(function, repeats=ROLLUP_TIMING_REPEATS):
+    """(fastest wall-clock seconds over `repeats` calls, result of the last call)"""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def verify_rollups(settings):
+    """Compare the rollup collections with a $group over the raw collection and time both"""
+    try:
+        client = create_client(settings)
+        db = client[settings["database_name"]]
+        raw = db[settings["collection_name"]]
+        sample = raw.find_one({}, {"metadata.device_id": 1})
+    except PyMongoError as e:
+        print(f"\nError connecting to MongoDB: {e}")
+        sys.exit(1)
+    if sample is None:
+        print(f"Error: {raw.full_name} is empty; load it with --rollups first.")
+        sys.exit(1)
+    
+    print(f"\nVerifying rollups of {raw.full_name} against $group over the raw readings")
+    mismatched_total = 0
+    for period, (unit, _) in ROLLUP_PERIODS.items():
+        rollups = db[rollup_collection_name(raw.name, period)]
+        raw_seconds, expected = best_time(lambda: {
+            (doc["_id"]["device_id"], doc["_id"]["start"]): doc
+            for doc in raw.aggregate(raw_rollup_pipeline(unit), allowDiskUse=True)
+        })
+        read_seconds, stored = best_time(lambda: {(doc["_id"]["device_id"], doc["_id"]["start"]): doc for doc in rollups.find()})
+        
+        missing = [key for key in expected if key not in stored]
+        extra = [key for key in stored if key not in expected]
+        mismatched = {key: rollup_differences(stored[key], expected[key]) for key in expected if key in stored}
+        mismatched = {key: fields for key, fields in mismatched.items() if fields}
+        mismatched_total += len(missing) + len(extra) + len(mismatched)
+        
+        print(f"  {period}: {len(stored):,} rollups vs {len(expected):,} groups: {len(missing):,} missing, {len(extra):,} extra, {len(mismatched):,} different")
+        for key, fields in list(mismatched.items())[:5]:
+            print(f"    {key[0]} {key[1]}: {', '.join(fields)} differ")
+        speedup = f" ({raw_seconds / read_seconds:,.0f}x)" if read_seconds > 0 else ""
+        print(f"    all {period} totals: $group over raw {raw_seconds * 1000:,.1f} ms, rollup read {read_seconds * 1000:,.1f} ms{speedup}")
+        
+        # What a dashboard asks for: one device's totals per period
+        device_id = sample["metadata"]["device_id"]
+        raw_seconds, _ = best_time(lambda: list(raw.aggregate(raw_rollup_pipeline(unit, {"metadata.device_id": device_id}), allowDiskUse=True)))
+        read_seconds, _ = best_time(lambda: list(rollups.find({"_id.device_id": device_id})))
+        speedup = f" ({raw_seconds / read_seconds:,.0f}x)" if read_seconds > 0 else ""
+        print(f"    {device_id} {period} totals: $group over raw {raw_seconds * 1000:,.1f} ms, rollup read {read_seconds * 1000:,.1f} ms{speedup}")
+    
+    client.close()
+    if mismatched_total:
+        print("Rollups do NOT match the raw readings.")
+        sys.exit(1)
+    print("Rollups match the raw readings.")
+
+#################################################
+# PROCESS POOL EXECUTION
+#################################################
+
+# Per-process state, set once by init_worker_process in each pool process
+worker_state = {}
+
+def init_worker_process(settings, counter, progress_queue, calendar, fleet=None, stop=None):
+    """Pool initializer: open this process's own MongoClient and keep the shared handles"""
+    global live_stop
+    if settings["live"]:
+        # The parent turns Ctrl-C into live_stop so every shard flushes its last tick
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        live_stop = stop
+    if settings["profile"]:
+        PROFILER.start(settings["profile"], settings["cprofile"], settings["tracemalloc"])
+    # A process runs one shard at a time, so its writers are all the inserts it has in flight
+    client = create_client(settings, max(1, settings["writer_threads"]))
+    PROFILER.mark("client")
+    worker_state.update({
+        "settings": settings,
+        "client": client,
+        "collection": sink_collection(client, settings),
+        "counter": counter,
+        "progress_queue": progress_queue,
+        "calendar": calendar,
+        "fleet": fleet
+    })
+    threading.Thread(target=metrics_pusher, args=(progress_queue,), daemon=True).start()
+
+def process_shard(shard):
+    """Pool task: run one (device or range of homes, time slice) shard inside a worker process"""
+    shard_inserted = run_shard(
+        shard,
+        worker_state["settings"],
+        worker_state["collection"],
+        worker_state["counter"],
+        worker_state["progress_queue"],
+        worker_state["calendar"],
+        worker_state["fleet"]
+    )
+    # Flush before reporting completion so the parent never misses a shard's tail
+    push_metrics(worker_state["progress_queue"])
+    push_profile(worker_state["progress_queue"])
+    return shard, shard_inserted
+
+def run_process_pool(shards, settings, counter, progress_queue, calendar, processes, fleet=None):
+    """Run all shards across a pool of worker processes"""
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=MP_CONTEXT,
+        initializer=init_worker_process,
+        initargs=(settings, counter, progress_queue, calendar, fleet, live_stop)
+    ) as executor:
+        futures = [executor.submit(process_shard, shard) for shard in shards]
+        PROFILER.mark("workers_started")
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                shard, shard_inserted = future.result()
+                print(f"Shard {shard_label(shard)} completed. Inserted {shard_inserted:,} documents.")
+        except KeyboardInterrupt:
+            if settings["live"]:
+                # Live shards all run until stopped: let them flush their last tick and report
+                print("\nStopping the live feed after the current tick...")
+                live_stop.set()
+                executor.shutdown(wait=True)
+                return
+            print("\nProcess interrupted by user. Cancelling pending shards...")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+def main(argv=None):
+    """Main function to set up and run the data generation process"""
+    # Settings from the command line / config file, prompting for anything missing
+    settings = load_settings(argv)
+    if settings["profile"]:
+        PROFILER.start(settings["profile"], settings["cprofile"], settings["tracemalloc"])
+        PROFILER.mark("settings")
+    if settings["replay"]:
+        replay(settings)
+        if settings["profile"]:
+            write_profile_report(settings, sum(METRICS.counter_values("documents_inserted_total").values()))
+        print(f"Total runtime: {(time.time() - process_start)/60:.1f} minutes")
+        return
+    if settings["verify_rollups"]:
+        verify_rollups(settings)
+        print(f"Total runtime: {(time.time() - process_start)/60:.1f} minutes")
+        return
+    
+    collection_name = settings["collection_name"]
+    start_date = settings["start_date"]
+    interval_seconds = settings["interval_seconds"]
+    interval_minutes = settings["interval_minutes"]
+    dry_run = settings["sink"] != "mongodb"
+    file_sink = settings["sink"] in FILE_SINKS
+    live = settings["live"]
+    
+    # Add a day to end_date and subtract the interval to include the full end date (a live feed's end is exclusive)
+    end_date = settings["end_date"] - datetime.timedelta(seconds=interval_seconds)
+    if not live:
+        end_date += datetime.timedelta(days=1)
+    processes = settings["execution_mode"] == "processes"
+    
+    # Fleet mode: every home gets its own copy of the chosen device templates
+    templates = settings["device_templates"]
+    devices = [device for device in DEVICES if templates is None or device["id"] in templates]
+    fleet = Fleet(settings["homes"], devices, settings["seed"]) if settings["homes"] else None
+    device_count = fleet.device_count if fleet else len(devices)
+    
+    # Thread mode shares main's client, so its pool has to cover every thread's writers
+    if processes:
+        concurrent_inserts = max(1, settings["writer_threads"])
+    else:
+        threads = settings["workers"] if fleet else len(devices) * (settings["time_slices"] or 1)
+        concurrent_inserts = threads * max(1, settings["writer_threads"])
+    
+    if file_sink:
+        print(f"\nWriting {settings['sink']} files to {os.path.dirname(output_path(settings, ''))}: documents are not written to MongoDB")
+        client = None
+    elif dry_run:
+        print("\nDry run: documents are generated and encoded but not written to MongoDB")
+        client = None
+    else:
+        # Connect to MongoDB
+        print(f"\nConnecting to MongoDB at: {datetime.datetime.now().strftime('%H:%M:%S')}")
+        print(f"MongoDB URL: {settings['mongodb_url']}")
+        print(f"Database: {settings['database_name']}")
+        print(f"Collection: {collection_name}")
+        
+        try:
+            client = create_client(settings, concurrent_inserts)
+            PROFILER.mark("client")
+            # Quick test of the connection
+            server_version = tuple(client.server_info()["versionArray"][:2])
+            PROFILER.mark("handshake")
+            # Create database reference
+            db = client[settings["database_name"]]
+            print("MongoDB connection successful!")
+        except Exception as e:
+            print(f"\nError connecting to MongoDB: {e}")
+            sys.exit(1)
+    
+    # Bucketing follows an existing collection; otherwise it is chosen for this interval and device count
+    if dry_run:
+        bucketing_reason = resolve_bucketing(settings, devices, device_count)
+    else:
+        collection_exists = collection_name in db.list_collection_names()
+        existing = existing_bucketing(db, collection_name) if collection_exists else None
+        bucketing_reason = resolve_bucketing(settings, devices, device_count, server_version, existing)
+        timeseries = existing is not None
+        
+        # Create collection with time series configuration if it doesn't exist
+        if not collection_exists:
+            print(f"\nCreating time series collection: {collection_name}")
+            try:
+                db.create_collection(collection_name, timeseries=timeseries_options(settings))
+                print(f"Created time series collection: {collection_name}")
+                timeseries = True
+            except Exception as e:
+                print(f"Warning: Could not create time series collection: {e}")
+                print("Will use regular collection instead.")
+        timeseries_cleanup(settings, timeseries, server_version)
+        PROFILER.mark("collections")
+    
+    # Calculate total documents and estimate data size
+    total_seconds = int((end_date - start_date).total_seconds()) + 1
+    total_data_points = (total_seconds // interval_seconds) * device_count
+    if live:
+        total_data_points = ((end_date - start_date) // datetime.timedelta(seconds=interval_seconds) + 1) * device_count
+    estimated_size_mb = total_data_points * 0.0005  # Rough estimate of 500 bytes per document
+    vectorized = settings["engine"] == "vectorized"
+    
+    print(f"\nData Generation Plan:")
+    if live:
+        duration = f"for {settings['duration']:g} seconds" if settings["duration"] else "until interrupted"
+        print(f"  Live feed: from {start_date.strftime('%Y-%m-%d %H:%M:%S')} UTC {duration}, tick {settings['tick']:g}s")
+        print(f"  Target rate: {device_count / interval_seconds:,.1f} docs/sec")
+    else:
+        print(f"  Time range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+    print(f"  Resolution: Every {interval_seconds} second(s)")
+    if fleet:
+        print(f"  Homes: {fleet.homes:,} x {len(devices)} device templates ({device_count:,} devices)")
+    else:
+        print(f"  Devices: {device_count}")
+    print(f"  Estimated data points: {total_data_points:,}")
+    print(f"  Estimated data size: {estimated_size_mb:.1f} MB")
+    if processes:
+        print(f"  Worker processes: {settings['workers']}")
+    elif not fleet:
+        print(f"  Threads: {len(devices)}")
+    print(f"  Generation engine: {settings['engine']}" + (f" ({settings['encoding']} encoding)" if vectorized else ""))
+    print(f"  Batch size: {settings['batch_size']:,}" + (f" (adaptive, {settings['min_batch_size']:,}-{settings['max_batch_size']:,})" if settings["adaptive_batch_size"] else ""))
+    print(f"  Writers per worker: {settings['writer_threads']} (queue depth {settings['queue_depth']})")
+    print(f"  Bucketing: {describe_bucketing(settings)}: {bucketing_reason}")
+    print(f"  Insert order: {settings['insert_order']} ({'ordered' if settings['ordered_inserts'] else 'unordered'})")
+    if not dry_run:
+        print(f"  Client: {describe_client(settings, concurrent_inserts)}")
+    print(f"  Seed: {settings['seed']}")
+    print(f"  Sink: {settings['sink']}")
+    if settings["disorder_profile"]:
+        print(f"  Disorder: {settings['disorder']}: {describe_disorder(settings['disorder_profile'], settings['reorder_buffer'])}")
+    if settings["rollups"]:
+        names = ", ".join(rollup_collection_name(collection_name, period) if collection_name else period for period in ROLLUP_PERIODS)
+        print(f"  Rollups: {names}" + (" (computed, not written)" if dry_run else ""))
+    print("-" * 60)
+    
+    # Get confirmation for large datasets (only when someone is there to answer)
+    if total_data_points > 1000000 and not live and not settings["yes"] and sys.stdin.isatty():
+        confirm = input(f"\nWarning: This will generate a large dataset ({total_data_points:,} data points). Continue? (y/n): ")
+        if confirm.lower() != 'y':
+            print("Operation cancelled.")
+            return
+    
+    # Holiday and special-event lookups are resolved once for the whole run (a day longer for
+    # a live feed, whose start moves to when setup is done)
+    calendar_end = end_date + datetime.timedelta(days=1) if live else end_date
+    calendar = CalendarIndex(start_date, calendar_end, DEVICES, MAX_EVENT_SHIFT_DAYS if fleet else 0, settings["profiles"])
+    
+    PROFILER.mark("setup")
+    
+    exporter = MetricsExporter(settings["metrics_port"], settings["metrics_file"], settings["metrics_interval"])
+    step = datetime.timedelta(minutes=interval_minutes)
+    counter = SharedCounter()
+    progress_queue = MP_CONTEXT.Queue()
+    monitor = threading.Thread(target=progress_monitor, args=(progress_queue, counter, total_data_points))
+    monitor.daemon = True
+    monitor.start()
+    stats_before = None if dry_run else bucket_stats(db, collection_name)
+    if file_sink:
+        prepare_output(settings)
+    if live:
+        start_date, end_date = live_window(settings)
+        end_date -= datetime.timedelta(seconds=interval_seconds)
+    load_start = time.time()
+    
+    workers = settings["workers"]
+    homes_per_shard = None
+    if live:
+        # Every live shard runs for the whole feed, so there is one per process or thread
+        slices = 1
+        if fleet:
+            homes_per_shard = settings["homes_per_shard"] or max(1, -(-fleet.homes // workers))
+    elif fleet:
+        # Fleet runs are sharded by home: 4 shards per process, or one per thread
+        slices = settings["time_slices"] or 1
+        homes_per_shard = settings["homes_per_shard"] or max(1, -(-fleet.homes // (workers * 4 if processes else workers)))
+    elif processes:
+        slices = settings["time_slices"] or max(1, -(-workers * 4 // len(devices)))
+    else:
+        slices = settings["time_slices"] or 1
+    if settings["checkpoint_dir"]:
+        slices, homes_per_shard = prepare_checkpoints(settings, start_date, end_date, slices, devices, homes_per_shard)
+        print(f"Checkpoints: {settings['checkpoint_dir']}" + (" (resuming)" if settings["resume"] else ""))
+    if fleet:
+        shards = plan_fleet_shards(fleet.homes, homes_per_shard, start_date, end_date, step, slices)
+        shape = f"{-(-fleet.homes // homes_per_shard)} home ranges of {homes_per_shard:,} x {slices} time slices"
+    else:
+        shards = plan_shards(devices, start_date, end_date, step, slices)
+        shape = f"{len(devices)} devices x {slices} time slices"
+    
+    if processes:
+        print(f"\nRunning {len(shards)} shards ({shape}) on {workers} processes")
+        try:
+            run_process_pool(shards, settings, counter, progress_queue, calendar, max(workers, len(shards)) if live else workers, fleet)
+        except KeyboardInterrupt:
+            print(f"Process terminated. Inserted {counter.value:,} documents.")
+            if settings["checkpoint_dir"]:
+                print("Rerun with --resume to continue from the last checkpoints.")
+            sys.exit(0)
+    else:
+        # Start worker threads for each device (one per shard when resuming a sliced run)
+        threads = []
+        collection = sink_collection(client, settings)
+        for shard in shards:
+            thread = threading.Thread(
+                target=worker_thread,
+                args=(shard, settings, collection, counter, progress_queue, calendar, fleet)
+            )
+            thread.daemon = True  # Set daemon to True so main program can exit if threads are still running
+            threads.append(thread)
+            thread.start()
+        PROFILER.mark("workers_started")
+        
+        # Wait for all threads to complete
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            if live:
+                print("\nStopping the live feed after the current tick...")
+                live_stop.set()
+                for thread in threads:
+                    thread.join()
+            else:
+                print("\nProcess interrupted by user. Waiting for threads to complete...")
+                print("Please wait to ensure data integrity.")
+                # Let threads finish their current batch
+                for thread in threads:
+                    if thread.is_alive():
+                        thread.join(timeout=10)
+                print("Process terminated.")
+                if settings["checkpoint_dir"]:
+                    print("Rerun with --resume to continue from the last checkpoints.")
+                sys.exit(0)
+    
+    progress_queue.put(None)
+    monitor.join()
+    load_seconds = time.time() - load_start
+    PROFILER.mark("load_done")
+    exporter.close()
+    
+    if file_sink:
+        path = finish_output(settings, shards, counter.value, start_date, end_date, devices)
+        print(f"\nFile output complete! Total documents written: {counter.value:,} to {path}")
+        print(f"Write throughput: {counter.value / load_seconds if load_seconds > 0 else 0:,.1f} docs/sec ({load_seconds:.1f} seconds)")
+        print(f"Load it with: python generateAndInsert.py --replay {path} --url ... --database ... --collection ...")
+    elif dry_run:
+        print(f"\nDry run complete! Total documents generated: {counter.value:,}")
+        print(f"Generation throughput: {counter.value / load_seconds if load_seconds > 0 else 0:,.1f} docs/sec ({load_seconds:.1f} seconds, no database)")
+    else:
+        print(f"\nData generation complete! Total documents inserted: {counter.value:,}")
+        print(f"Insertion rate: {counter.value / load_seconds if load_seconds > 0 else 0:,.1f} docs/sec")
+        print(f"insert_many latency: {format_latency(METRICS.total_histogram('insert_seconds'))}")
+    stale_rollups = None
+    if settings["rollups"]:
+        upserts = sum(METRICS.counter_values("rollup_upserts_total").values())
+        print(f"Rollups: {upserts:,} hourly/daily upserts, write latency {format_latency(METRICS.total_histogram('rollup_write_seconds'))}")
+        failed = sum(METRICS.counter_values("documents_failed_total").values())
+        failed_upserts = sum(METRICS.counter_values("rollup_upserts_failed_total").values())
+        if failed or failed_upserts:
+            # --resume cannot fill the gap without counting the stored readings twice
+            stale_rollups = (f"{failed:,} documents and {failed_upserts:,} rollup upserts could not be written, so the rollups "
+                             "do not cover the load; drop the collection and its rollups and load them again (--rollups cannot be resumed).")
+        elif not dry_run:
+            print("Check them with: python generateAndInsert.py --verify-rollups --url ... --database ... --collection ...")
+    if live:
+        # Each tick delivers the interval that just ended, starting with the one ending at start_date
+        feed_seconds = load_start + load_seconds - calendar_module.timegm(start_date.timetuple()) + interval_seconds
+        print_live_report(counter.value, feed_seconds, device_count / interval_seconds)
+    documents = sum(METRICS.counter_values("documents_inserted_total").values())
+    if settings["disorder_profile"] and documents:
+        late = sum(METRICS.counter_values("late_readings_total").values())
+        outage = sum(METRICS.counter_values("outage_readings_total").values())
+        overflow = sum(METRICS.counter_values("reorder_overflow_total").values())
+        print(f"Disorder ({settings['disorder']}): {late / documents:.1%} of readings delivered late, {outage / documents:.1%} in post-outage bursts"
+              + (f", {overflow:,} released early by the full reorder buffer" if overflow else ""))
+    # Live batches are not cut per series, so the bucket model does not follow them
+    if documents and not live:
+        opened = sum(METRICS.counter_values("buckets_opened_total").values())
+        print(f"Buckets opened per 1000 docs: {opened / documents * 1000:.2f} (client-side model, {settings['insert_order']} order)")
+    if not dry_run:
+        # Secondary indexes are built once over the loaded data rather than maintained by every insert
+        if settings["create_indexes"]:
+            print("Creating index on metadata.device_id, timestamp...")
+            print(f"Index built in {create_secondary_indexes(db[collection_name]):.1f} seconds")
+        print_bucket_report(stats_before, bucket_stats(db, collection_name))
+        client.close()
+    if settings["profile"]:
+        write_profile_report(settings, counter.value, load_seconds)
+    print(f"Total runtime: {(time.time() - process_start)/60:.1f} minutes")
+    if stale_rollups:
+        print(f"Error: {stale_rollups}")
+        sys.exit(1)
 
 # Call the main function if the script is run directly
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Query benchmark for the time series block-processing (SBE) engine over the loaded readings
+
+Runs every aggregation pipeline in the "BlockProcessing Queries" catalog repeatedly against a
+collection loaded by generateAndInsert.py, uses explain to record which engine executed it
+(classic, SBE, or SBE with time series block processing) and reports latency percentiles for
+the eligible and ineligible queries side by side. --compare-engines repeats every query with
+the classic engine forced, so each query also gets a direct before/after.
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+import generateAndInsert as loader
+
+#################################################
+# BENCHMARK CONFIGURATION
+#################################################
+
+CATALOG = "BlockProcessing Queries"  # Catalog file: queries under the eligible / not eligible headings
+REPEATS = 20                         # Timed runs per query
+WARMUP = 2                           # Untimed runs per query first (plan cache, WiredTiger cache)
+PERCENTILES = (50, 95, 99)
+# SBE stages that only show up in a plan when time series block processing runs
+BLOCK_STAGES = ("ts_bucket_to_cellblock", "block_to_row", "block_hashagg")
+FRAMEWORK_PARAMETER = "internalQueryFrameworkControl"
+
+#################################################
+# QUERY CATALOG
+#################################################
+
+def parse_catalog(path):
+    """Read the query catalog: a list of {name, eligible, description, pipeline}
+
+    "#Query ..." headings set whether the queries below them are tagged eligible for
+    block processing, "## name" starts a query, "# text" lines describe it and the rest
+    is its pipeline as Extended JSON. "{start}" and "{end}" stand for the time range.
+    """
+    queries = []
+    eligible = None
+    query = None
+
+    def finish():
+        if query is not None:
+            query["pipeline"] = json_util.loads("\n".join(query.pop("lines")))
+            queries.append(query)
+
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#Query"):
+                finish()
+                query = None
+                eligible = "not eligible" not in line.lower()
+            elif line.startswith("## "):
+                finish()
+                query = {"name": line[3:].strip(), "eligible": eligible, "description": "", "lines": []}
+            elif line.startswith("#") and query is not None:
+                query["description"] = (query["description"] + " " + line.lstrip("#").strip()).strip()
+            elif query is not None:
+                query["lines"].append(line)
+    finish()
+    return queries
+
+def bind_range(value, start, end):
+    """Replace the "{start}" / "{end}" placeholders anywhere in a pipeline"""
+    if isinstance(value, dict):
+        return {key: bind_range(item, start, end) for key, item in value.items()}
+    if isinstance(value, list):
+        return [bind_range(item, start, end) for item in value]
+    if value == "{start}":
+        return start
+    if value == "{end}":
+        return end
+    return value
+
+def data_range(collection):
+    """(first, last + 1s) timestamps of the collection, used when no range is given"""
+    result = list(collection.aggregate([
+        {"$group": {"_id": None, "start": {"$min": "$timestamp"}, "end": {"$max": "$timestamp"}}}
+    ]))
+    if not result:
+        print(f"Error: {collection.full_name} is empty; load data with generateAndInsert.py first.")
+        sys.exit(1)
+    return result[0]["start"], result[0]["end"] + datetime.timedelta(seconds=1)
+
+#################################################
+# ENGINE DETECTION AND TIMING
+#################################################
+
+def explain_engine(collection, pipeline):
+    """Which engine runs a pipeline: "sbe-block", "sbe" or "classic" (from explain)"""
+    explain = collection.database.command("aggregate", collection.name, pipeline=pipeline, explain=True)
+    text = json_util.dumps(explain)
+    if any(stage in text for stage in BLOCK_STAGES):
+        return "sbe-block"
+    if '"slotBasedPlan"' in text or '"explainVersion": "2"' in text:
+        return "sbe"
+    return "classic"
+
+def framework_control(client, value=None):
+    """Read (or set, returning the previous value) the server's query framework control"""
+    admin = client.admin
+    previous = admin.command({"getParameter": 1, FRAMEWORK_PARAMETER: 1})[FRAMEWORK_PARAMETER]
+    if value is not None:
+        admin.command({"setParameter": 1, FRAMEWORK_PARAMETER: value})
+    return previous
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    rank = max(1, -(-p * len(ordered) // 100))
+    return ordered[rank - 1]
+
+def time_pipeline(collection, pipeline, repeats, warmup):
+    """Run a pipeline warmup + repeats times; returns latency statistics in milliseconds"""
+    for _ in range(warmup):
+        list(collection.aggregate(pipeline, allowDiskUse=True))
+    samples = []
+    rows = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = len(list(collection.aggregate(pipeline, allowDiskUse=True)))
+        samples.append((time.perf_counter() - started) * 1000)
+    result = {f"p{p}_ms": percentile(samples, p) for p in PERCENTILES}
+    result.update({"mean_ms": sum(samples) / len(samples), "rows": rows, "samples_ms": samples})
+    return result
+
+def run_query(collection, query, start, end, repeats, warmup):
+    """Explain and time one catalog query"""
+    pipeline = bind_range(query["pipeline"], start, end)
+    engine = explain_engine(collection, pipeline)
+    result = {
+        "eligible": query["eligible"],
+        "description": query["description"],
+        "engine": engine,
+        # Flag queries whose tag disagrees with what the server actually did
+        "tag_matches": (engine == "sbe-block") == query["eligible"]
+    }
+    result.update(time_pipeline(collection, pipeline, repeats, warmup))
+    return result
+
+#################################################
+# REPORTING
+#################################################
+
+def print_report(results, compared):
+    """Latency table with the eligible and ineligible queries side by side"""
+    header = f"  {'query':<30} {'engine':<10} " + " ".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f" {'rows':>8}"
+    if compared:
+        header += f" {'classic p50':>12} {'speedup':>8}"
+    for eligible in (True, False):
+        print(f"\n{'Eligible' if eligible else 'Not eligible'} for block processing:")
+        print(header)
+        for name, result in results.items():
+            if result["eligible"] != eligible:
+                continue
+            flag = "" if result["tag_matches"] else "  <-- tag differs from explain"
+            line = f"  {name:<30} {result['engine']:<10} " + " ".join(f"{result[f'p{p}_ms']:>10.1f}" for p in PERCENTILES) + f" {result['rows']:>8,}"
+            if compared:
+                classic = result["classic"]["p50_ms"]
+                line += f" {classic:>12.1f} {classic / result['p50_ms']:>7.1f}x"
+            print(line + flag)
+
+def main(argv=None):
+    """Run the query catalog against a loaded collection and report per-engine latencies"""
+    parser = argparse.ArgumentParser(description="Benchmark block-processing eligible vs ineligible aggregations.")
+    parser.add_argument("--url", required=True, help="MongoDB connection URL")
+    parser.add_argument("--database", required=True, help="Database name")
+    parser.add_argument("--collection", required=True, help="Time series collection loaded by generateAndInsert.py")
+    parser.add_argument("--catalog", default=CATALOG, help=f"Query catalog file (default {CATALOG!r})")
+    parser.add_argument("--query", action="append", help="Only run this query (repeatable)")
+    parser.add_argument("--start", type=loader.parse_date, help="Start of the queried range (default: first reading)")
+    parser.add_argument("--end", type=loader.parse_date, help="End of the queried range, exclusive (default: after the last reading)")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed runs per query")
+    parser.add_argument("--warmup", type=int, default=WARMUP, help="Untimed runs per query")
+    parser.add_argument("--compare-engines", action="store_true", help=f"Also time every query with {FRAMEWORK_PARAMETER}=forceClassicEngine (needs setParameter)")
+    parser.add_argument("--output", help="Write the full results (including every sample) as JSON")
+    args = parser.parse_args(argv)
+
+    queries = parse_catalog(args.catalog)
+    if args.query:
+        unknown = set(args.query) - {query["name"] for query in queries}
+        if unknown:
+            parser.error(f"unknown query: {', '.join(sorted(unknown))}")
+        queries = [query for query in queries if query["name"] in args.query]
+
+    client = MongoClient(args.url)
+    collection = client[args.database][args.collection]
+    try:
+        version = client.server_info()["version"]
+        start, end = data_range(collection)
+    except PyMongoError as e:
+        print(f"Error connecting to MongoDB: {e}")
+        sys.exit(1)
+    start = args.start or start
+    end = args.end or end
+    print(f"MongoDB {version}, {collection.full_name}, {start} to {end}")
+    print(f"Running {len(queries)} queries x {args.repeats} runs (+{args.warmup} warm-up)...")
+
+    results = {}
+    for query in queries:
+        results[query["name"]] = run_query(collection, query, start, end, args.repeats, args.warmup)
+        print(f"  {query['name']}: {results[query['name']]['engine']}, p50 {results[query['name']]['p50_ms']:.1f} ms")
+
+    if args.compare_engines:
+        try:
+            previous = framework_control(client, "forceClassicEngine")
+        except OperationFailure as e:
+            print(f"Error: cannot switch to the classic engine ({e}); --compare-engines needs setParameter rights.")
+            sys.exit(1)
+        print("Repeating with the classic engine forced...")
+        try:
+            for query in queries:
+                results[query["name"]]["classic"] = run_query(collection, query, start, end, args.repeats, args.warmup)
+        finally:
+            framework_control(client, previous)
+
+    print_report(results, args.compare_engines)
+
+    if args.output:
+        report = {
+            "server_version": version,
+            "collection": collection.full_name,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "repeats": args.repeats,
+            "queries": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+    client.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
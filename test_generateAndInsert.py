@@ -0,0 +1,246 @@
+"""Tests for generateAndInsert.py (run with: python -m pytest)"""
+import calendar as calendar_module
+import collections
+import datetime
+
+import bson
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import generateAndInsert as loader
+
+# A full calendar year at an odd step, so every holiday and special event is sampled
+START = datetime.datetime(2024, 1, 1)
+END = datetime.datetime(2024, 12, 31, 23, 59)
+STEP = datetime.timedelta(minutes=97)
+COUNT = (END - START) // STEP + 1
+SEED = 7
+
+@pytest.fixture(scope="module")
+def calendar():
+    return loader.CalendarIndex(START, END, loader.DEVICES, loader.MAX_EVENT_SHIFT_DAYS)
+
+@pytest.fixture(scope="module")
+def fleet():
+    return loader.Fleet(4, loader.DEVICES, seed=SEED)
+
+@pytest.mark.parametrize("device", loader.DEVICES, ids=lambda device: device["id"])
+def test_raw_encoding_matches_scalar_readings(device, calendar):
+    """Raw documents hold the same readings as the original one-dict-per-reading path"""
+    columns = loader.generate_block(device, START, STEP, COUNT, SEED, calendar)
+    actual = [bson.decode(document.raw) for document in loader.RawBatchEncoder(device, calendar).encode(columns)]
+    # Round trip the dicts so both sides have the types BSON gives back
+    expected = [bson.decode(bson.encode(reading)) for reading in loader.scalar_readings(device, START, END, STEP, calendar, SEED)]
+    assert len(actual) == len(expected) == COUNT
+    for a, b in zip(actual, expected):
+        # The engines round power_kw independently (np.round vs round), so it may differ in the last place
+        assert a.pop("power_kw") == pytest.approx(b.pop("power_kw"), abs=0.0011)
+        assert list(a) == list(b) and a == b
+
+@pytest.mark.parametrize("device", loader.DEVICES, ids=lambda device: device["id"])
+@pytest.mark.parametrize("home_index", [None, 2])
+def test_raw_encoding_matches_bson_encode(device, home_index, calendar, fleet):
+    """RawBatchEncoder writes exactly the bytes bson.encode gives for build_documents"""
+    home = fleet.home(home_index) if home_index is not None else None
+    columns = loader.generate_block(device, START, STEP, COUNT, SEED, calendar, home)
+    expected = [bson.encode(document) for document in loader.build_documents(device, columns, home)]
+    actual = [document.raw for document in loader.RawBatchEncoder(device, calendar, home).encode(columns)]
+    assert actual == expected
+
+@pytest.mark.parametrize("device", loader.DEVICES, ids=lambda device: device["id"])
+def test_encode_homes_matches_per_home_encoding(device, calendar, fleet):
+    """A block of several homes encodes to the documents of each home's own block, in home order"""
+    homes = [fleet.home(index) for index in range(fleet.homes)]
+    count = 500
+    columns = loader.generate_homes_block(device, homes, START, STEP, count, SEED, calendar, loader.DrawStreams(SEED))
+    expected = []
+    for home in homes:
+        home_columns = loader.generate_block(device, START, STEP, count, SEED, calendar, home)
+        expected += [bson.encode(document) for document in loader.build_documents(device, home_columns, home)]
+    actual = [document.raw for document in loader.RawBatchEncoder(device, calendar).encode_homes(columns, homes)]
+    assert actual == expected
+
+class FlakyCollection:
+    """Collection stand-in that keeps what it stores and fails every fifth insert_many"""
+    name = "readings"
+    write_concern = None
+    
+    def __init__(self):
+        self.database = self
+        self.stored = []
+        self.calls = 0
+    
+    def get_collection(self, name, write_concern=None):
+        return self
+    
+    def insert_many(self, documents, **kwargs):
+        self.calls += 1
+        if self.calls % 5 == 0:
+            raise AutoReconnect("connection reset")
+        self.stored.extend(bson.decode(bson.encode(document)) for document in documents)
+
+class NullQueue:
+    def put(self, message):
+        pass
+
+@pytest.mark.parametrize("options", [
+    ["--engine", "vectorized"], ["--engine", "scalar"], ["--engine", "vectorized", "--disorder", "mixed"]
+], ids=["vectorized", "scalar", "disorder"])
+def test_rollups_count_only_stored_batches(options, monkeypatch):
+    """Readings of batches that were given up are left out of the rollups"""
+    settings = loader.load_settings([
+        "--sink", "null", "--start", "2024-03-01", "--end", "2024-03-02", "--interval", "20", "--seed", str(SEED),
+        "--rollups", "--max-retries", "0", "--yes", *options
+    ])
+    loader.resolve_bucketing(settings, loader.DEVICES, len(loader.DEVICES))
+    settings["sink"] = "mongodb"
+    written = []
+    monkeypatch.setattr(loader.RollupAccumulator, "flush", lambda self: (written.extend(self._complete), self._complete.clear()))
+    end = settings["end_date"] + datetime.timedelta(days=1, seconds=-1)
+    shard = {"device": loader.DEVICES[0], "slice": 0, "start": settings["start_date"], "end": end}
+    collection = FlakyCollection()
+    loader.run_shard(shard, settings, collection, loader.SharedCounter(), NullQueue(), loader.CalendarIndex(settings["start_date"], end, loader.DEVICES))
+    
+    rolled_up = collections.Counter()
+    for period, device_id, entry in written:
+        rolled_up[period, device_id, entry[0]] += entry[1]
+    expected = collections.Counter()
+    for document in collection.stored:
+        seconds = calendar_module.timegm(document["timestamp"].timetuple())
+        for period, (_, period_seconds) in loader.ROLLUP_PERIODS.items():
+            expected[period, document["metadata"]["device_id"], seconds - seconds % period_seconds] += 1
+    assert 0 < len(collection.stored) < 2 * 86400 // 20
+    assert rolled_up == expected
+
+class ScriptedCollection:
+    """Collection stand-in whose insert_many calls raise the scripted errors in turn, then succeed"""
+    
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+    
+    def insert_many(self, documents, **kwargs):
+        self.calls.append(("insert", list(documents)))
+        if self.errors:
+            raise self.errors.pop(0)
+    
+    def delete_many(self, query):
+        self.calls.append(("delete", query))
+
+def duplicate_key_error(*indexes):
+    return BulkWriteError({"writeErrors": [{"index": i, "code": loader.DUPLICATE_KEY_ERROR} for i in indexes], "writeConcernErrors": []})
+
+def readings(count):
+    """Documents with the fields insert_with_retry and delete_batch look at"""
+    return [
+        {"_id": i, "metadata": {"device_id": f"D{i % 2}"}, "timestamp": START + i * STEP}
+        for i in range(count)
+    ]
+
+def test_insert_with_retry_counts_duplicates_as_applied():
+    collection = ScriptedCollection(duplicate_key_error(0, 1, 2, 3))
+    assert loader.insert_with_retry(collection, readings(4), 3, 0.0, "test") == 4
+    assert len(collection.calls) == 1
+
+def test_ordered_insert_with_retry_sends_the_rest_after_a_duplicate():
+    batch = readings(5)
+    collection = ScriptedCollection(duplicate_key_error(2))
+    assert loader.insert_with_retry(collection, batch, 3, 0.0, "test", ordered=True) == 5
+    assert [documents for _, documents in collection.calls] == [batch, batch[3:]]
+
+def test_insert_with_retry_gives_up_after_max_retries():
+    collection = ScriptedCollection(*[AutoReconnect("connection reset")] * 3)
+    assert loader.insert_with_retry(collection, readings(4), 2, 0.0, "test") == 0
+    assert len(collection.calls) == 3
+
+def test_insert_with_retry_purges_the_batch_before_every_retry():
+    batch = readings(4)
+    collection = ScriptedCollection(AutoReconnect("connection reset"), AutoReconnect("connection reset"))
+    assert loader.insert_with_retry(collection, batch, 3, 0.0, "test", purge=True) == 4
+    assert [call for call, _ in collection.calls] == ["insert", "delete", "insert", "delete", "insert"]
+    query = collection.calls[1][1]
+    assert query == {"$or": [
+        {"metadata.device_id": device_id, "timestamp": {"$gte": times[0], "$lte": times[-1], "$in": times}}
+        for device_id, times in (("D0", [batch[0]["timestamp"], batch[2]["timestamp"]]), ("D1", [batch[1]["timestamp"], batch[3]["timestamp"]]))
+    ]}
+
+def test_checkpoint_advances_only_over_contiguous_batches():
+    checkpoint = loader.ShardCheckpoint(None, {"device": loader.DEVICES[0], "slice": 0, "start": START, "end": END})
+    times = [START + i * STEP for i in range(4)]
+    assert [checkpoint.next_sequence() for _ in times] == [0, 1, 2, 3]
+    checkpoint.complete(2, times[2])
+    assert checkpoint.committed_through is None
+    checkpoint.complete(0, times[0])
+    assert checkpoint.committed_through == times[0]
+    checkpoint.complete(3, times[3])
+    assert checkpoint.committed_through == times[0]
+    checkpoint.complete(1, times[1])
+    assert checkpoint.committed_through == times[3]
+
+def measure_window(sizer, clock, rate, document_bytes=500):
+    """Complete one window of batches at the current size, inserted at `rate` docs/sec; returns the next size"""
+    size = sizer.size
+    for _ in range(sizer.window):
+        clock[0] += size / rate
+        sizer.record(size, document_bytes, size)
+    return sizer.size
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(loader.time, "perf_counter", lambda: now[0])
+    return now
+
+def test_batch_size_reverses_when_throughput_drops(clock):
+    sizer = loader.BatchSizeController(1000, 100, 50000, True)
+    # Throughput improves up to 2250 documents per batch and collapses above
+    sizes = [sizer.size] + [measure_window(sizer, clock, 10000 + size if size <= 2250 else 5000) for size in [1000, 1500, 2250, 3375]]
+    assert sizes == [1000, 1500, 2250, 3375, 2250]
+
+@pytest.mark.parametrize("document_bytes", [500, 40000])
+def test_batch_size_stays_within_limits(clock, document_bytes):
+    minimum, maximum = 100, 5000
+    limit = min(maximum, loader.MAX_WRITE_BATCH_SIZE, loader.MAX_MESSAGE_SIZE_BYTES // document_bytes)
+    # Throughput that grows with the batch size drives it up to the limit and keeps it there
+    sizer = loader.BatchSizeController(1000, minimum, maximum, True)
+    rising = [measure_window(sizer, clock, float(sizer.size), document_bytes) for _ in range(12)]
+    assert rising[-1] == limit and all(minimum <= size <= limit for size in rising)
+    # Throughput that shrinks with the batch size drives it down to the minimum
+    sizer = loader.BatchSizeController(1000, minimum, maximum, True)
+    falling = [measure_window(sizer, clock, 1e9 / sizer.size, document_bytes) for _ in range(12)]
+    assert falling[-1] == minimum and all(minimum <= size <= limit for size in falling)
+
+class FixedSizer:
+    def target(self):
+        return 500
+
+@pytest.mark.parametrize("profile", loader.DISORDER_PROFILES)
+def test_disorder_delivers_every_reading_once_behind_the_checkpoint(profile):
+    """Every reading comes out of the ReorderBuffer exactly once, and no checkpoint passes one still held"""
+    start, end, step = datetime.datetime(2024, 2, 9), datetime.datetime(2024, 2, 12, 23, 59), datetime.timedelta(seconds=37)
+    calendar = loader.CalendarIndex(start, end, loader.DEVICES, loader.MAX_EVENT_SHIFT_DAYS)
+    generated = list(loader.vectorized_batches(loader.DEVICES[0], start, end, step, FixedSizer(), calendar, SEED))
+    buffer = loader.ReorderBuffer(loader.DISORDER_PROFILES[profile], loader.REORDER_BUFFER, step, SEED, loader.DEVICES[0]["id"], start)
+    delivered = list(loader.disordered_batches(iter(generated), buffer))
+    
+    sent = [document["_id"] for batch, *_ in generated for document in batch]
+    received = [document["_id"] for batch, *_ in delivered for document in batch]
+    assert collections.Counter(received) == collections.Counter(sent)
+    assert (received == sent) == (profile == "none")
+    
+    times = sorted(document["timestamp"] for batch, *_ in generated for document in batch)
+    undelivered = collections.Counter(times)
+    oldest = 0
+    checkpoints = []
+    for batch, checkpoint_time, *_ in delivered:
+        undelivered.subtract(document["timestamp"] for document in batch)
+        while oldest < len(times) and not undelivered[times[oldest]]:
+            oldest += 1
+        assert oldest == len(times) or checkpoint_time < times[oldest]
+        checkpoints.append(checkpoint_time)
+    assert checkpoints == sorted(checkpoints)
+
+def test_prometheus_text_escapes_label_values():
+    metrics = loader.MetricsRegistry()
+    metrics.inc("errors_total", device='C:\\data "main"\nbackup')
+    assert f'{loader.METRICS_PREFIX}errors_total{{device="C:\\\\data \\"main\\"\\nbackup"}} 1' in metrics.prometheus_text().splitlines()